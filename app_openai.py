@@ -11,9 +11,14 @@ from flask import Flask, render_template, request, jsonify, session, Response, s
 from flask_cors import CORS
 import os
 import re
+import copy
+import functools
+import hashlib
+import heapq
+import shutil
+import time
 import tempfile
 from werkzeug.utils import secure_filename
-import concurrent.futures
 import threading
 import uuid
 import json
@@ -38,6 +43,23 @@ except ImportError:
     GeminiAdapter = None
 from openai_extractor.security import SecurityValidator
 from openai_extractor.prompts import SYSTEM_PROMPT
+from metron import (
+    JobStore, ExtractionScheduler, PRIORIDADE_INTERATIVA, PRIORIDADE_LOTE, SingleFlight,
+    ChunkedUploadManager, ChunkedUploadError, TaskInbox, iter_zip_pdfs, HotFolderWatcher, TaskBoard,
+    acquire_single_instance_lock, UrlFetcher, create_session_store, StageHistogram, medir_etapa, registrar_etapa,
+    registrar_bytes, resumir_etapas, compact_json, LabGeoIndex, haversine_km, LabCatalog, ConnectionPool, encode_cursor, parse_fields,
+    LatestCalibrationReconciler, LATEST_CALIBRATION_JOIN, refresh_latest_calibrations,
+    SearchIndexReconciler, refresh_search_index,
+    is_truthy_filter, instrument_page_query, instrument_list_query, SEARCH_FIELDS, SEARCH_DEFAULT_FIELDS,
+    LIST_FIELDS, LIST_COUNT_SQL, FIRST_GRANDEZA_SQL, EXISTING_INSTRUMENTS_SQL, EXISTING_CALIBRATIONS_SQL,
+    EXPORT_SQL, CERTIFICATE_SQL, CERTIFICATE_CONTENT_SQL,
+    BatchWriter, chunked, ci_key, fetch_in,
+    create_blob_store, digest_from_key, CertificateBlobMigrator, check_migration_target, BlobStoreError,
+    RangeNotSatisfiable, strong_etag, file_validator, etag_matches, if_range_allows, parse_range, iter_stream,
+    content_disposition, CACHE_IMMUTABLE, CACHE_REVALIDATE,
+    EXPORT_FORMATS, EXPORT_CONTENT_TYPES, fetch_iter, group_consecutive, make_encoder, encode_stream,
+    gzip_stream, accepts_gzip, zip_stream, SqlExpr, insert_statements, tsv_lines, load_data_statement,
+)
 
 # ============================================================
 # CONFIGURACAO FLASK
@@ -60,6 +82,26 @@ DB_CONFIG = {
     'charset': 'utf8mb4',
     'use_unicode': True
 }
+# Pool de conexoes por worker, usado por todas as rotas e helpers
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    size=int(os.getenv('DB_POOL_SIZE', 5)),
+    checkout_timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+    health_check_after=float(os.getenv('DB_POOL_HEALTH_CHECK_SECONDS', 30)),
+)
+
+
+
+def _carregar_coordenadas_labs():
+    """(id, latitude, longitude) dos laboratorios ativos para o indice espacial (vem do catalogo)"""
+    return lab_catalog.coordinates()
+
+
+# Coordenadas dos laboratorios em memoria ("laboratorio mais proximo" sem ACOS no SQL)
+lab_geo_index = LabGeoIndex(
+    _carregar_coordenadas_labs,
+    refresh_seconds=float(os.getenv('LAB_GEO_REFRESH_SECONDS', 900)),
+)
 
 # ============================================================
 # INICIALIZACAO
@@ -76,8 +118,75 @@ except Exception as e:
     extractor = None
 
 validator = SecurityValidator()
-extracted_cache = {}  # Cache: {session_id: [dados_extraidos]}
-processing_tasks = {} # Cache de tarefas assincronas {task_id: status}
+# Documentos extraidos por sessao, compartilhados entre workers (memory | sqlite | redis)
+extracted_cache = create_session_store(
+    kind=os.getenv('SESSION_STORE', 'memory'),
+    path=os.getenv('SESSION_STORE_PATH') or os.path.join(tempfile.gettempdir(), 'metron_sessions.sqlite3'),
+    url=os.getenv('SESSION_STORE_URL', ''),
+    ttl_seconds=int(os.getenv('SESSION_STORE_TTL_SECONDS', 4 * 3600)),
+    local_ttl=float(os.getenv('SESSION_STORE_LOCAL_TTL', 2)),
+    max_items=int(os.getenv('SESSION_STORE_MAX_ITEMS', 200)),
+    max_bytes=int(os.getenv('SESSION_STORE_MAX_MB', 128)) * 1024 * 1024,
+)
+# Estado das tarefas assincronas {task_id: status}, com TTL e orcamento de memoria
+processing_tasks = JobStore(
+    max_bytes=int(os.getenv('JOB_STORE_MAX_MB', 256)) * 1024 * 1024,
+    ttl_seconds=int(os.getenv('JOB_TTL_SECONDS', 2 * 3600)),
+    spill_threshold=int(os.getenv('JOB_SPILL_THRESHOLD_KB', 2048)) * 1024,
+)
+# Copia do estado das tarefas lida pelos outros workers (status, PDFs do lote, pasta vigiada)
+task_board = TaskBoard(
+    os.getenv('JOB_BOARD_DIR') or os.path.join(tempfile.gettempdir(), 'metron_tarefas'),
+    ttl_seconds=int(os.getenv('JOB_TTL_SECONDS', 2 * 3600)),
+)
+JOB_BOARD_INTERVAL = float(os.getenv('JOB_BOARD_INTERVAL', 1.0))
+# Fila unica de extracao (chat antes do lote, rodizio entre clientes)
+extraction_scheduler = ExtractionScheduler(workers=int(os.getenv('EXTRACTION_WORKERS', 5)))
+INTERACTIVE_MAX_FILES = int(os.getenv('INTERACTIVE_MAX_FILES', 5))
+# Extracoes simultaneas do mesmo PDF (mesmo modo) viram uma so chamada a IA
+extraction_singleflight = SingleFlight()
+# Upload retomavel em partes para lotes maiores que MAX_CONTENT_LENGTH
+chunked_uploads = ChunkedUploadManager(max_file_bytes=int(os.getenv('CHUNKED_MAX_FILE_MB', 100)) * 1024 * 1024)
+# Arquivos completos e finalize recebidos por um worker que nao e o dono da tarefa
+task_inbox = TaskInbox(lambda *args: _mensagem_tarefa(*args))
+CHUNKED_CHUNK_SIZE = int(os.getenv('CHUNKED_CHUNK_MB', 5)) * 1024 * 1024
+# Importacao de ZIP: limites por arquivo (protecao contra ZIP malicioso)
+ZIP_MAX_ENTRIES = int(os.getenv('ZIP_MAX_ENTRIES', 2000))
+ZIP_MAX_ENTRY_BYTES = int(os.getenv('ZIP_MAX_ENTRY_MB', 50)) * 1024 * 1024
+# Pasta vigiada (certificados escaneados depositados pelos laboratorios)
+HOT_FOLDER_DIRS = [d.strip() for d in os.getenv('HOT_FOLDER_DIRS', '').split(os.pathsep) if d.strip()]
+HOT_FOLDER_USER_ID = os.getenv('HOT_FOLDER_USER_ID', '')
+HOT_FOLDER_STATE_DIR = os.getenv('HOT_FOLDER_STATE_DIR') or tempfile.gettempdir()
+hot_folder_watcher = None
+# Download de pdf_url fora da requisicao (pool proprio, timeouts e limite de tamanho)
+url_fetcher = UrlFetcher(
+    workers=int(os.getenv('URL_FETCH_WORKERS', 4)),
+    connect_timeout=float(os.getenv('URL_FETCH_CONNECT_TIMEOUT', 5)),
+    read_timeout=float(os.getenv('URL_FETCH_READ_TIMEOUT', 30)),
+    total_timeout=float(os.getenv('URL_FETCH_TOTAL_TIMEOUT', 120)),
+    max_bytes=int(os.getenv('URL_FETCH_MAX_MB', 50)) * 1024 * 1024,
+    verify_tls=os.getenv('URL_FETCH_VERIFY_TLS', 'false').lower() in ('1', 'true', 'yes'),
+)
+URL_FETCH_MAX_URLS = int(os.getenv('URL_FETCH_MAX_URLS', 50))
+# Histograma movel do tempo por etapa das extracoes (exposto em /metrics)
+stage_histogram = StageHistogram(window=int(os.getenv('STAGE_TIMING_WINDOW', 1000)))
+_hot_folder_trava = None  # arquivo de trava mantido aberto pelo processo que vigia
+# PDFs de certificado enderecados por SHA-256 (por padrao no storage do Laravel)
+LARAVEL_STORAGE = os.getenv('LARAVEL_STORAGE', 'C:/xampp/htdocs/gocal/storage/app/public')
+cert_blob_store = create_blob_store(
+    os.getenv('CERT_BLOB_STORE') or LARAVEL_STORAGE,
+    prefix=os.getenv('CERT_BLOB_PREFIX', 'certificados'),
+    endpoint=os.getenv('CERT_BLOB_S3_ENDPOINT', ''),
+    access_key=os.getenv('CERT_BLOB_S3_ACCESS_KEY', ''),
+    secret_key=os.getenv('CERT_BLOB_S3_SECRET_KEY', ''),
+    region=os.getenv('CERT_BLOB_S3_REGION', 'us-east-1'),
+)
+# Jobs de manutencao do banco: ultima calibracao, indice de busca e migracao
+# dos PDFs para o blob store (so no processo que pegar a trava)
+latest_calibration_job = None
+search_index_job = None
+cert_blob_job = None
+_jobs_banco_trava = None
 
 # Mapa de correcao de status (sem acento -> com acento)
 STATUS_MAP = {
@@ -92,6 +201,65 @@ STATUS_MAP = {
     'inativo': 'Inativo',
 }
 
+def _dados_requisicao():
+    """Campos da requisicao, seja multipart/form ou JSON."""
+    return request.form if request.form else (request.get_json(silent=True) or {})
+
+
+def _tenant_key_extracao():
+    """Chave de divisao justa da fila de extracao: empresa, usuario ou sessao."""
+    dados = _dados_requisicao()
+    return str(
+        dados.get('empresa_id') or session.get('gocal_empresa_id')
+        or dados.get('user_id') or session.get('gocal_user_id')
+        or session.get('session_id') or ''
+    )
+
+
+def _prioridade_extracao(num_arquivos):
+    """Classe de prioridade do upload: lote explicito ou muitos arquivos vao para o fim."""
+    origem = str(_dados_requisicao().get('prioridade') or '').strip().lower()
+    if origem == 'lote' or num_arquivos > INTERACTIVE_MAX_FILES:
+        return PRIORIDADE_LOTE
+    return PRIORIDADE_INTERATIVA
+
+
+def _extrair_pdf_coalescido(path, filename, user_prompt='', cancel_event=None, pdf_bytes=None, timings=None):
+    """Extrai o PDF com a IA, coalescendo extracoes simultaneas do mesmo conteudo.
+    Chave: SHA-256 do PDF + comando do usuario (que define o modo de extracao).
+    timings (opcional) recebe o tempo/bytes de cada etapa da extracao."""
+    if pdf_bytes is None:
+        with medir_etapa(timings, 'file_read'):
+            with open(path, 'rb') as f:
+                pdf_bytes = f.read()
+        registrar_bytes(timings, 'file_read', len(pdf_bytes))
+    chave = hashlib.sha256(pdf_bytes).hexdigest() + ':' + (user_prompt or '').strip().lower()
+
+    while True:
+        inicio = time.perf_counter()
+        res, compartilhado = extraction_singleflight.do(
+            chave,
+            lambda: extractor.extract_from_pdf(path, filename, user_prompt=user_prompt,
+                                               cancel_event=cancel_event, timings=timings)
+        )
+        if compartilhado:
+            # As etapas foram medidas na chamada que executou; aqui so a espera
+            registrar_etapa(timings, 'coalesced_wait', time.perf_counter() - inicio)
+        # Quem executou foi cancelado, mas esta chamada nao: extrai de novo
+        if (compartilhado and isinstance(res, dict) and res.get('cancelled')
+                and not (cancel_event and cancel_event.is_set())):
+            continue
+        break
+
+    if compartilhado:
+        print(f"[SINGLE-FLIGHT] {filename}: resultado compartilhado com extracao em andamento")
+    # Cada chamador recebe sua copia (os resultados sao alterados depois)
+    res = copy.deepcopy(res)
+    if compartilhado and isinstance(res, dict) and 'arquivo_origem' in res:
+        res['arquivo_origem'] = filename
+    return res
+
+
 def normalizar_status(status_raw):
     """Normaliza o status para o formato correto com acentos"""
     if not status_raw:
@@ -100,58 +268,71 @@ def normalizar_status(status_raw):
     return STATUS_MAP.get(chave, status_raw)
 
 
+@functools.lru_cache(maxsize=4096)
 def _normalizar_chave_extraida(valor):
+    # As mesmas chaves se repetem em todos os itens extraidos: normaliza uma vez so
     texto = unicodedata.normalize('NFKD', str(valor or ''))
     texto = texto.encode('ascii', 'ignore').decode('ascii')
     texto = re.sub(r'[^a-z0-9]+', '_', texto.lower()).strip('_')
     return texto
 
 
+def _aliases_normalizados(aliases):
+    return frozenset(_normalizar_chave_extraida(alias) for alias in aliases)
+
+
 def _buscar_valor_por_alias(dados_json, aliases, default=None):
-    aliases_normalizados = {_normalizar_chave_extraida(alias) for alias in aliases}
+    if not isinstance(aliases, frozenset):
+        aliases = _aliases_normalizados(aliases)
 
     if isinstance(dados_json, dict):
         for chave, valor in dados_json.items():
-            if _normalizar_chave_extraida(chave) in aliases_normalizados:
+            if _normalizar_chave_extraida(chave) in aliases:
                 return valor
-            encontrado = _buscar_valor_por_alias(valor, aliases, default=None)
-            if encontrado is not None:
-                return encontrado
+            if isinstance(valor, (dict, list)):
+                encontrado = _buscar_valor_por_alias(valor, aliases, default=None)
+                if encontrado is not None:
+                    return encontrado
     elif isinstance(dados_json, list):
         for item in dados_json:
-            encontrado = _buscar_valor_por_alias(item, aliases, default=None)
-            if encontrado is not None:
-                return encontrado
+            if isinstance(item, (dict, list)):
+                encontrado = _buscar_valor_por_alias(item, aliases, default=None)
+                if encontrado is not None:
+                    return encontrado
 
     return default
 
 
+_ALIASES_NUMERO_CERTIFICADO = _aliases_normalizados([
+    'numero_certificado',
+    'numero calibracao',
+    'numero_calibracao',
+    'ml',
+])
+_ALIASES_IDENTIFICACAO = _aliases_normalizados([
+    'identificacao',
+    'autenticacao',
+    'tag',
+    'codigo',
+    'patrimonio',
+    'numero do gabarito',
+    'n do gabarito',
+    'nº do gabarito',
+    'n° do gabarito',
+    'numero_gabarito',
+    'numero_do_gabarito',
+])
+
+
 def _resolver_numero_certificado_extraido(dados_json, default='n/i'):
-    valor = _buscar_valor_por_alias(dados_json, [
-        'numero_certificado',
-        'numero calibracao',
-        'numero_calibracao',
-        'ml',
-    ])
+    valor = _buscar_valor_por_alias(dados_json, _ALIASES_NUMERO_CERTIFICADO)
     if valor is None or str(valor).strip() == '':
         return default
     return valor
 
 
 def _resolver_identificacao_extraida(dados_json, default='n/i'):
-    valor = _buscar_valor_por_alias(dados_json, [
-        'identificacao',
-        'autenticacao',
-        'tag',
-        'codigo',
-        'patrimonio',
-        'numero do gabarito',
-        'n do gabarito',
-        'nº do gabarito',
-        'n° do gabarito',
-        'numero_gabarito',
-        'numero_do_gabarito',
-    ])
+    valor = _buscar_valor_por_alias(dados_json, _ALIASES_IDENTIFICACAO)
     if valor is None or str(valor).strip() == '':
         valor = _resolver_numero_certificado_extraido(dados_json, default)
     return valor
@@ -270,7 +451,8 @@ def _build_document_context_v2(dados, max_chars):
     if not dados:
         return "", False, 0
 
-    json_str = json.dumps(dados, ensure_ascii=False, indent=2)
+    # JSON compacto: sai pronto do cache da sessao e gasta menos tokens que indent=2
+    json_str = compact_json(dados)
     original_len = len(json_str)
     truncated = False
     if original_len > max_chars:
@@ -279,108 +461,42 @@ def _build_document_context_v2(dados, max_chars):
 
     return f"\n\nDADOS DO DOCUMENTO (PDF atual em sessão):\n{json_str}", truncated, original_len
 
-def _is_truthy_filter_v2(value):
-    """Normaliza flags de filtro vindas do frontend/IA."""
-    if isinstance(value, bool):
-        return value
-    if isinstance(value, (int, float)):
-        return value != 0
-    if isinstance(value, str):
-        return value.strip().lower() in ('1', 'true', 'sim', 'yes', 'on')
-    return False
-
-
-def _normalize_filter_date_v2(value):
-    """Aceita apenas YYYY-MM-DD para filtros de data."""
-    if not value:
-        return ''
-    text = str(value).strip()
-    if re.match(r'^\d{4}-\d{2}-\d{2}$', text):
-        return text
-    return ''
-
-
-def _aplicar_filtros_instrumentos_sql_v2(sql, params, filtros):
-    """Aplica filtros de monitoramento ao SQL sem remover os existentes."""
-    termo = (filtros.get('termo') or '').strip()
-    status = (filtros.get('status') or '').strip()
-    identificacao = (filtros.get('identificacao') or '').strip()
-    instrumento = (filtros.get('instrumento') or '').strip()
-    responsavel = (filtros.get('responsavel') or '').strip()
-    departamento = (filtros.get('departamento') or '').strip()
-    data_inicio = _normalize_filter_date_v2(filtros.get('data_inicio'))
-    data_fim = _normalize_filter_date_v2(filtros.get('data_fim'))
-    filtro_vencidos = _is_truthy_filter_v2(filtros.get('filtro_vencidos'))
-    filtro_a_vencer = _is_truthy_filter_v2(filtros.get('filtro_a_vencer'))
-
-    if termo:
-        sql += " AND (i.identificacao COLLATE utf8mb4_general_ci LIKE %s OR i.nome COLLATE utf8mb4_general_ci LIKE %s OR i.descricao COLLATE utf8mb4_general_ci LIKE %s OR i.responsavel COLLATE utf8mb4_general_ci LIKE %s OR i.departamento COLLATE utf8mb4_general_ci LIKE %s)"
-        params += [f'%{termo}%', f'%{termo}%', f'%{termo}%', f'%{termo}%', f'%{termo}%']
-
-    if identificacao:
-        sql += " AND i.identificacao COLLATE utf8mb4_general_ci LIKE %s"
-        params.append(f'%{identificacao}%')
-
-    if instrumento:
-        sql += " AND i.descricao COLLATE utf8mb4_general_ci LIKE %s"
-        params.append(f'%{instrumento}%')
-
-    if responsavel:
-        sql += " AND i.responsavel COLLATE utf8mb4_general_ci LIKE %s"
-        params.append(f'%{responsavel}%')
-
-    if departamento:
-        sql += " AND i.departamento COLLATE utf8mb4_general_ci LIKE %s"
-        params.append(f'%{departamento}%')
-
-    if status:
-        sql += " AND i.status = %s"
-        params.append(status)
-
-    if data_inicio:
-        sql += """
-            AND EXISTS (
-                SELECT 1
-                FROM calibracoes cdt_ini
-                WHERE cdt_ini.instrumento_id = i.id
-                  AND DATE(cdt_ini.data_proxima_calibracao) >= %s
-            )
-        """
-        params.append(data_inicio)
-
-    if data_fim:
-        sql += """
-            AND EXISTS (
-                SELECT 1
-                FROM calibracoes cdt_fim
-                WHERE cdt_fim.instrumento_id = i.id
-                  AND DATE(cdt_fim.data_proxima_calibracao) <= %s
-            )
-        """
-        params.append(data_fim)
-
-    if filtro_vencidos:
-        sql += """
-            AND (
-                (c.data_proxima_calibracao IS NOT NULL AND DATE(c.data_proxima_calibracao) <= CURDATE())
-                OR
-                (c.id IS NULL AND i.periodicidade IS NOT NULL
-                    AND DATE_ADD(DATE(i.created_at), INTERVAL i.periodicidade MONTH) <= CURDATE())
-            )
-        """
-
-    if filtro_a_vencer:
-        sql += """
-            AND (
-                (c.data_proxima_calibracao IS NOT NULL
-                    AND DATE(c.data_proxima_calibracao) <= DATE_ADD(CURDATE(), INTERVAL 30 DAY))
-                OR
-                (c.id IS NULL AND i.periodicidade IS NOT NULL
-                    AND DATE_ADD(DATE(i.created_at), INTERVAL i.periodicidade MONTH) <= DATE_ADD(CURDATE(), INTERVAL 30 DAY))
-            )
-        """
 
-    return sql, params
+_BUSCA_INSTRUMENTOS_MAX = 200
+
+
+def _pagina_instrumentos(user_id, filtros, campos=SEARCH_DEFAULT_FIELDS, ordenar='', limite=50,
+                         token='', com_total=False):
+    """
+    Uma pagina da busca de instrumentos por keyset (custo igual em qualquer profundidade)
+
+    O cursor guarda (ordenacao, valor, id) do ultimo item; cursor de outra
+    ordenacao ou invalido recomeca da primeira pagina. O total, quando pedido,
+    e um COUNT(*) separado com os mesmos filtros.
+
+    Returns:
+        (linhas, next_cursor, total ou None)
+    """
+    sql, params, sql_total, params_total, campo_ordem = instrument_page_query(
+        user_id, filtros, campos, ordenar, limite, token)
+
+    with db_pool.cursor(dictionary=True) as cursor:
+        cursor.execute(sql, params)
+        linhas = cursor.fetchall()
+        total = None
+        if com_total:
+            cursor.execute(sql_total, params_total)
+            total = cursor.fetchone()['total']
+
+    next_cursor = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        next_cursor = encode_cursor([campo_ordem, linhas[-1]['_ordem'], linhas[-1]['id']])
+    for linha in linhas:
+        linha.pop('_ordem', None)
+        if 'id' not in campos:
+            linha.pop('id', None)
+    return linhas, next_cursor, total
 
 
 @app.route('/')
@@ -403,6 +519,8 @@ def index():
         session['gocal_user_id'] = integration_data['user_id']
     if integration_data['funcionario_id']:
         session['gocal_funcionario_id'] = integration_data['funcionario_id']
+    if integration_data['empresa_id']:
+        session['gocal_empresa_id'] = integration_data['empresa_id']
 
     return render_template('gocal_chat.html', integration=integration_data)
 
@@ -421,26 +539,25 @@ def processamento_lote():
     funcionario_name = ''
     company_name = ''
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        if funcionario_id:
-            cursor.execute("SELECT name FROM funcionarios WHERE id = %s LIMIT 1", (funcionario_id,))
-            row = cursor.fetchone()
-            if row:
-                funcionario_name = row[0]
-        if not funcionario_name and user_id:
-            # Fallback: usuário logado diretamente como empresa
-            cursor.execute("SELECT name FROM users WHERE id = %s LIMIT 1", (user_id,))
-            row = cursor.fetchone()
-            if row:
-                funcionario_name = row[0] or ''
-        if user_id:
-            cursor.execute("SELECT nome_fantasia FROM users WHERE id = %s LIMIT 1", (user_id,))
-            row = cursor.fetchone()
-            if row:
-                company_name = row[0] or ''
-        cursor.close()
-        conn.close()
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            if funcionario_id:
+                cursor.execute("SELECT name FROM funcionarios WHERE id = %s LIMIT 1", (funcionario_id,))
+                row = cursor.fetchone()
+                if row:
+                    funcionario_name = row[0]
+            if not funcionario_name and user_id:
+                # Fallback: usuário logado diretamente como empresa
+                cursor.execute("SELECT name FROM users WHERE id = %s LIMIT 1", (user_id,))
+                row = cursor.fetchone()
+                if row:
+                    funcionario_name = row[0] or ''
+            if user_id:
+                cursor.execute("SELECT nome_fantasia FROM users WHERE id = %s LIMIT 1", (user_id,))
+                row = cursor.fetchone()
+                if row:
+                    company_name = row[0] or ''
+            cursor.close()
     except Exception:
         pass
     return render_template('processamento_lote.html', user_id=user_id, funcionario_id=funcionario_id,
@@ -455,25 +572,24 @@ def api_user_context():
     user_name = ''
     company_name = ''
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        if funcionario_id:
-            cursor.execute("SELECT name FROM funcionarios WHERE id = %s LIMIT 1", (funcionario_id,))
-            row = cursor.fetchone()
-            if row:
-                user_name = row[0]
-        if not user_name and user_id:
-            cursor.execute("SELECT name FROM users WHERE id = %s LIMIT 1", (user_id,))
-            row = cursor.fetchone()
-            if row:
-                user_name = row[0] or ''
-        if user_id:
-            cursor.execute("SELECT nome_fantasia FROM users WHERE id = %s LIMIT 1", (user_id,))
-            row = cursor.fetchone()
-            if row:
-                company_name = row[0] or ''
-        cursor.close()
-        conn.close()
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            if funcionario_id:
+                cursor.execute("SELECT name FROM funcionarios WHERE id = %s LIMIT 1", (funcionario_id,))
+                row = cursor.fetchone()
+                if row:
+                    user_name = row[0]
+            if not user_name and user_id:
+                cursor.execute("SELECT name FROM users WHERE id = %s LIMIT 1", (user_id,))
+                row = cursor.fetchone()
+                if row:
+                    user_name = row[0] or ''
+            if user_id:
+                cursor.execute("SELECT nome_fantasia FROM users WHERE id = %s LIMIT 1", (user_id,))
+                row = cursor.fetchone()
+                if row:
+                    company_name = row[0] or ''
+            cursor.close()
     except Exception:
         pass
     return jsonify({'user_name': user_name, 'company_name': company_name})
@@ -514,15 +630,19 @@ def chat_extrair():
             # Gera nome unico para evitar colisao em paralelo
             unique_filename = f"{uuid.uuid4().hex}_{filename}"
             temp_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(temp_path)
-            temp_files.append((temp_path, filename))
+            etapas = {}
+            with medir_etapa(etapas, 'file_save'):
+                file.save(temp_path)
+            registrar_bytes(etapas, 'file_save', _tamanho_arquivo(temp_path))
+            temp_files.append((temp_path, filename, etapas))
 
         # 2. Funcao de processamento individual
         def process_single_pdf(args):
-            path, original_name = args
+            path, original_name, etapas = args
             print(f"[PDF-THREAD] Iniciando: {original_name}")
             try:
-                res = extractor.extract_from_pdf(path, original_name)
+                res = _extrair_pdf_coalescido(path, original_name, timings=etapas)
+                stage_histogram.record(etapas)
                 # Remove arquivo logo apos processar
                 try:
                     os.remove(path)
@@ -533,11 +653,15 @@ def chat_extrair():
                 print(f"[ERRO-THREAD] {original_name}: {e}")
                 return {'error': str(e)}
 
-        # 3. Executa em paralelo (max 5 threads para evitar Rate Limit excessivo)
+        # 3. Executa na fila global de extracao (prioridade interativa)
         print(f"[PARALELO] Iniciando extracao de {len(temp_files)} arquivos...")
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            results = list(executor.map(process_single_pdf, temp_files))
+
+        tenant = _tenant_key_extracao()
+        futures = [
+            extraction_scheduler.submit(process_single_pdf, tf, priority=PRIORIDADE_INTERATIVA, tenant=tenant)
+            for tf in temp_files
+        ]
+        results = [f.result() for f in futures]
 
         # 4. Coleta resultados validos
         for dados in results:
@@ -553,7 +677,7 @@ def chat_extrair():
 
 
         if instrumentos:
-            extracted_cache[session_id] = instrumentos
+            extracted_cache.set(session_id, instrumentos)
             
             # Gera resumo em texto para o chat
             resumo_msg = f"Ã¢Å“â€¦ **{len(instrumentos)} documento(s) analisado(s)!**\n\n"
@@ -589,14 +713,14 @@ def chat_extrair():
             return jsonify({
                 'success': True,
                 'message': 'Dados extraidos:',
-                'instrumentos': dados
+                'instrumentos': list(dados)
             })
 
         # Chat livre com OpenAI
         try:
             contexto = ""
             if dados:
-                contexto = f"\n\nDADOS EXTRAIDOS:\n{json.dumps(dados, ensure_ascii=False, indent=2)}"
+                contexto = f"\n\nDADOS EXTRAIDOS:\n{compact_json(dados)}"
 
             prompt = f"""Voce e o Metron, um assistente inteligente.
 
@@ -661,13 +785,12 @@ def chat_mensagem():
         return jsonify({
             'success': True,
             'message': 'Aqui estão os dados extraídos:',
-            'instrumentos': dados
+            'instrumentos': list(dados)
         })
         
     # Comando para limpar sessao
     if 'limpar' in message_lower or 'nova sessao' in message_lower or 'novo arquivo' in message_lower:
-        if session_id in extracted_cache:
-            del extracted_cache[session_id]
+        extracted_cache.delete(session_id)
         return jsonify({'success': True, 'message': 'Sessão limpa! Pode enviar um novo arquivo.'})
 
     # Chat normal com GPT-4o
@@ -677,24 +800,20 @@ def chat_mensagem():
         # Carrega instrumentos do banco para o contexto do chat
         if req_user_id:
             try:
-                conn_ctx = mysql.connector.connect(**DB_CONFIG)
-                cur_ctx = conn_ctx.cursor(dictionary=True)
-                cur_ctx.execute("""
-                    SELECT i.identificacao AS tag, i.nome, i.status, i.descricao,
-                           c.data_calibracao, c.data_proxima_calibracao,
-                           c.laboratorio_responsavel, c.numero_calibracao
-                    FROM instrumentos i
-                    LEFT JOIN calibracoes c ON c.id = (
-                        SELECT id FROM calibracoes WHERE instrumento_id = i.id
-                        ORDER BY data_calibracao DESC LIMIT 1
-                    )
-                    WHERE i.user_id = %s
-                    ORDER BY i.identificacao
-                    LIMIT 200
-                """, (req_user_id,))
-                instrumentos_db = cur_ctx.fetchall()
-                cur_ctx.close()
-                conn_ctx.close()
+                with db_pool.connection() as conn_ctx:
+                    cur_ctx = conn_ctx.cursor(dictionary=True)
+                    cur_ctx.execute(f"""
+                        SELECT i.identificacao AS tag, i.nome, i.status, i.descricao,
+                               c.data_calibracao, c.data_proxima_calibracao,
+                               c.laboratorio_responsavel, c.numero_calibracao
+                        FROM instrumentos i
+                        {LATEST_CALIBRATION_JOIN}
+                        WHERE i.user_id = %s
+                        ORDER BY i.identificacao
+                        LIMIT 200
+                    """, (req_user_id,))
+                    instrumentos_db = cur_ctx.fetchall()
+                    cur_ctx.close()
 
                 if instrumentos_db:
                     for row in instrumentos_db:
@@ -739,7 +858,7 @@ def chat_mensagem():
             })
 
         if is_grafico_request and dados:
-            grafico_local = _extract_chart_points_from_data_v2(dados)
+            grafico_local = _extract_chart_points_from_data_v2(list(dados))
             if grafico_local and grafico_local.get('pontos'):
                 print(f"[CHAT-MSG] Grafico local v2: {len(grafico_local.get('pontos', []))} ponto(s) extraido(s).")
                 return jsonify({
@@ -1053,26 +1172,10 @@ def _buscar_laboratorios_texto_v2(user_id, filtros):
     [NOVO] Busca laboratórios no banco e retorna resumo em texto.
     """
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        
         termo = (filtros.get('termo') or '').strip()
-        
-        # [ATUALIZADO] Busca mais robusta (Nome, Contato, Email, Cidade, Estado)
-        sql = "SELECT nome, contato, email, cidade, estado FROM laboratorios WHERE 1=1"
-        params = []
-        
-        if termo:
-            sql += " AND (nome LIKE %s OR contato LIKE %s OR email LIKE %s OR cidade LIKE %s OR estado LIKE %s)"
-            wildcard = f'%{termo}%'
-            params.extend([wildcard, wildcard, wildcard, wildcard, wildcard])
-            
-        sql += " ORDER BY nome ASC LIMIT 50"
-        
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
+
+        # [ATUALIZADO] Busca mais robusta (Nome, Contato, Email, Cidade, Estado), pelo catalogo em memoria
+        rows = lab_catalog.search_legacy(termo, limit=50)
         
         if not rows:
             return "Nenhum laboratório encontrado com esse termo."
@@ -1120,63 +1223,95 @@ _INSTRUMENTO_ALIASES = {
 }
 
 
+def _carregar_catalogo_labs():
+    """Tabelas do catalogo de laboratorios (ver LabCatalog)"""
+    with db_pool.cursor(dictionary=True) as cur:
+        cur.execute("""
+            SELECT id, nome_laboratorio, uf, cidade, situacao, telefone, email,
+                   acreditacao_num, latitude, longitude
+            FROM laboratorio
+        """)
+        labs = cur.fetchall()
+        cur.execute("SELECT laboratorio_id, descricao_servico, grupo, cmc FROM escopo_calibracao")
+        escopos = cur.fetchall()
+    try:
+        with db_pool.cursor(dictionary=True) as cur:
+            cur.execute("SELECT id, nome, contato, email, telefone, cidade, estado FROM laboratorios")
+            legado = cur.fetchall()
+    except Exception as e:
+        # Tabela legada ausente nao derruba a busca por servico
+        print(f"[LAB-CATALOG] Tabela laboratorios indisponivel: {e}")
+        legado = []
+    return {'labs': labs, 'scopes': escopos, 'legacy': legado}
+
+
+# Laboratorios + escopo em memoria: "quem calibra X" vira consulta a indice invertido
+lab_catalog = LabCatalog(
+    _carregar_catalogo_labs,
+    aliases=_INSTRUMENTO_ALIASES,
+    refresh_seconds=float(os.getenv('LAB_CATALOG_REFRESH_SECONDS', 900)),
+)
+
+
 def _consultar_detalhes_laboratorio(termo, lat=None, lon=None):
     """Consulta dados diretos da tabela laboratorio pelo nome ou RBC.
     Estrategia: tenta por RBC, depois LIKE completo, depois palavras individuais."""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cur = conn.cursor(dictionary=True)
-
-        lat_v = float(lat) if lat else 0
-        lon_v = float(lon) if lon else 0
-
-        base_select = """
-            SELECT id, nome_laboratorio, razao_social, acreditacao_num, uf, cidade,
-                   email, telefone, fax, gerente_tecnico, endereco, bairro, cep,
-                   situacao, latitude, longitude, grupo_servico,
-                   ROUND((6371 * ACOS(GREATEST(-1, LEAST(1,
-                       COS(RADIANS(%s)) * COS(RADIANS(IFNULL(latitude,0))) *
-                       COS(RADIANS(IFNULL(longitude,0)) - RADIANS(%s)) +
-                       SIN(RADIANS(%s)) * SIN(RADIANS(IFNULL(latitude,0)))
-                   )))), 0) AS distancia_km
-            FROM laboratorio
-        """
-        params_geo = (lat_v, lon_v, lat_v)
-
-        # 1. Por numero RBC
-        rbc_match = re.search(r'\b(\d+)\b', termo)
-        if rbc_match:
-            rbc_num = rbc_match.group(1)
-            cur.execute(base_select + " WHERE acreditacao_num = %s LIMIT 1",
-                        params_geo + (rbc_num,))
-            res = cur.fetchall()
-            if res:
-                cur.close(); conn.close()
-                return res
-
-        # 2. LIKE completo no nome ou razao social
-        cur.execute(base_select + " WHERE nome_laboratorio LIKE %s OR razao_social LIKE %s LIMIT 1",
-                    params_geo + (f'%{termo}%', f'%{termo}%'))
-        res = cur.fetchall()
-        if res:
-            cur.close(); conn.close()
-            return res
-
-        # 3. Cada palavra com >= 3 chars como condicao OR
-        palavras = [p for p in re.split(r'\s+', termo) if len(p) >= 3]
-        if palavras:
-            conditions = " OR ".join(["nome_laboratorio LIKE %s OR razao_social LIKE %s"] * len(palavras))
-            word_params = []
-            for p in palavras:
-                word_params += [f'%{p}%', f'%{p}%']
-            cur.execute(base_select + f" WHERE {conditions} LIMIT 3",
-                        params_geo + tuple(word_params))
+        with db_pool.connection() as conn:
+            cur = conn.cursor(dictionary=True)
+
+            lat_v = float(lat) if lat else 0
+            lon_v = float(lon) if lon else 0
+
+            # Distancia calculada em Python so para as linhas encontradas
+            base_select = """
+                SELECT id, nome_laboratorio, razao_social, acreditacao_num, uf, cidade,
+                       email, telefone, fax, gerente_tecnico, endereco, bairro, cep,
+                       situacao, latitude, longitude, grupo_servico
+                FROM laboratorio
+            """
+            params_geo = ()
+
+            def com_distancia(rows):
+                for r in rows:
+                    r['distancia_km'] = int(round(haversine_km(
+                        lat_v, lon_v, r.get('latitude') or 0, r.get('longitude') or 0)))
+                return rows
+
+            # 1. Por numero RBC
+            rbc_match = re.search(r'\b(\d+)\b', termo)
+            if rbc_match:
+                rbc_num = rbc_match.group(1)
+                cur.execute(base_select + " WHERE acreditacao_num = %s LIMIT 1",
+                            params_geo + (rbc_num,))
+                res = cur.fetchall()
+                if res:
+                    cur.close()
+                    return com_distancia(res)
+
+            # 2. LIKE completo no nome ou razao social
+            cur.execute(base_select + " WHERE nome_laboratorio LIKE %s OR razao_social LIKE %s LIMIT 1",
+                        params_geo + (f'%{termo}%', f'%{termo}%'))
             res = cur.fetchall()
             if res:
-                cur.close(); conn.close()
-                return res
-
-        cur.close(); conn.close()
+                cur.close()
+                return com_distancia(res)
+
+            # 3. Cada palavra com >= 3 chars como condicao OR
+            palavras = [p for p in re.split(r'\s+', termo) if len(p) >= 3]
+            if palavras:
+                conditions = " OR ".join(["nome_laboratorio LIKE %s OR razao_social LIKE %s"] * len(palavras))
+                word_params = []
+                for p in palavras:
+                    word_params += [f'%{p}%', f'%{p}%']
+                cur.execute(base_select + f" WHERE {conditions} LIMIT 3",
+                            params_geo + tuple(word_params))
+                res = cur.fetchall()
+                if res:
+                    cur.close()
+                    return com_distancia(res)
+
+            cur.close()
         return []
     except Exception as e:
         print(f"[ERRO] _consultar_detalhes_laboratorio: {e}")
@@ -1187,52 +1322,23 @@ def _buscar_laboratorios_para_instrumento(termo, lat=None, lon=None, limit=8):
     """Busca laboratorios acreditados para calibrar um instrumento.
     Se lat/lon fornecidos, ordena por distancia (Haversine)."""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cur = conn.cursor(dictionary=True)
-        like_term = f'%{termo}%'
+        # Capacidade pelo catalogo em memoria (termo + aliases do instrumento)
+        candidatos = lab_catalog.find_capabilities(termo)
 
         if lat and lon:
-            query = """
-                SELECT DISTINCT
-                    l.id, l.nome_laboratorio, l.uf, l.cidade, l.situacao,
-                    l.telefone, l.email, l.acreditacao_num,
-                    e.descricao_servico, e.grupo, e.cmc,
-                    ROUND((6371 * ACOS(GREATEST(-1, LEAST(1,
-                        COS(RADIANS(%s)) * COS(RADIANS(l.latitude)) *
-                        COS(RADIANS(l.longitude) - RADIANS(%s)) +
-                        SIN(RADIANS(%s)) * SIN(RADIANS(l.latitude))
-                    )))), 0) AS distancia_km
-                FROM escopo_calibracao e
-                JOIN laboratorio l ON l.id = e.laboratorio_id
-                WHERE (e.descricao_servico LIKE %s OR e.grupo LIKE %s)
-                  AND l.situacao = 'Ativo'
-                  AND l.latitude IS NOT NULL AND l.longitude IS NOT NULL
-                ORDER BY distancia_km ASC
-                LIMIT %s
-            """
-            cur.execute(query, (lat, lon, lat, like_term, like_term, limit))
-        else:
-            query = """
-                SELECT DISTINCT
-                    l.id, l.nome_laboratorio, l.uf, l.cidade, l.situacao,
-                    l.telefone, l.email, l.acreditacao_num,
-                    e.descricao_servico, e.grupo, e.cmc
-                FROM escopo_calibracao e
-                JOIN laboratorio l ON l.id = e.laboratorio_id
-                WHERE (e.descricao_servico LIKE %s OR e.grupo LIKE %s)
-                  AND l.situacao = 'Ativo'
-                ORDER BY l.nome_laboratorio ASC
-                LIMIT %s
-            """
-            cur.execute(query, (like_term, like_term, limit))
-
-        results = cur.fetchall()
-        for r in results:
-            if r.get('distancia_km') is not None:
-                r['distancia_km'] = int(r['distancia_km'])
-        cur.close()
-        conn.close()
-        return results
+            # Distancia so dos candidatos, pelo indice em memoria
+            lab_ids = {r['id'] for r in candidatos}
+            distancias = dict(lab_geo_index.nearest(float(lat), float(lon), k=len(lab_ids),
+                                                    candidates=lab_ids))
+            results = heapq.nsmallest(
+                limit, (r for r in candidatos if r['id'] in distancias),
+                key=lambda r: distancias[r['id']]
+            )
+            for r in results:
+                r['distancia_km'] = int(round(distancias[r['id']]))
+            return results
+
+        return sorted(candidatos, key=lambda r: r['nome_laboratorio'] or '')[:limit]
     except Exception as e:
         print(f"[LAB-SEARCH] Erro: {e}")
         return []
@@ -1292,24 +1398,8 @@ def buscar_laboratorios_v2():
     """[NOVO] Rota para o frontend buscar lista estruturada de laboratórios"""
     try:
         termo = request.args.get('termo', '')
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        
-        # [ATUALIZADO] Query expandida para o Widget
-        sql = "SELECT id, nome, contato, email, telefone, cidade, estado FROM laboratorios WHERE 1=1"
-        params = []
-        if termo:
-            sql += " AND (nome LIKE %s OR contato LIKE %s OR email LIKE %s OR cidade LIKE %s OR estado LIKE %s)"
-            wildcard = f'%{termo}%'
-            params.extend([wildcard, wildcard, wildcard, wildcard, wildcard])
-        
-        sql += " ORDER BY nome ASC LIMIT 50"
-        
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        # [ATUALIZADO] Campos expandidos para o Widget, pelo catalogo em memoria
+        rows = lab_catalog.search_legacy(termo, limit=50)
         return jsonify({'success': True, 'items': rows})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -1321,35 +1411,23 @@ def _buscar_instrumentos_texto(user_id, filtros):
     if not user_id:
         return "Não foi possível identificar o usuário. Faça login novamente."
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
-
-        sql = """
-            SELECT i.identificacao, i.nome, i.status,
-                   c.data_proxima_calibracao
-            FROM instrumentos i
-            LEFT JOIN calibracoes c ON c.id = (
-                SELECT id FROM calibracoes WHERE instrumento_id = i.id ORDER BY data_calibracao DESC LIMIT 1
-            )
-            WHERE i.user_id = %s
-        """
-        params = [user_id]
-        sql, params = _aplicar_filtros_instrumentos_sql_v2(sql, params, filtros or {})
-
-        sql += " ORDER BY i.identificacao LIMIT 50"
-
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        filtros = filtros or {}
+        limite = max(1, min(int(filtros.get('limite') or 50), _BUSCA_INSTRUMENTOS_MAX))
+        rows, next_cursor, total = _pagina_instrumentos(
+            user_id, filtros, ('identificacao', 'nome', 'status', 'data_proxima_calibracao'),
+            ordenar=filtros.get('ordenar') or '', limite=limite, token=filtros.get('cursor') or '',
+            com_total=True,
+        )
 
         if not rows:
             return "Nenhum instrumento encontrado com esses filtros."
 
-        linhas = [f"Encontrei **{len(rows)}** instrumento(s):\n"]
+        linhas = [f"Encontrei **{total}** instrumento(s):\n"]
         for r in rows:
             prox = str(r['data_proxima_calibracao']) if r.get('data_proxima_calibracao') else 'sem data'
             linhas.append(f"- **{r['identificacao']}** - {r['nome']} | {r['status']} | Prox. calib.: {prox}")
+        if next_cursor:
+            linhas.append(f"\n_Mostrando os primeiros {len(rows)}; refine os filtros para ver os demais._")
 
         return "\n".join(linhas)
 
@@ -1360,7 +1438,12 @@ def _buscar_instrumentos_texto(user_id, filtros):
 
 @app.route('/buscar-instrumentos', methods=['GET'])
 def buscar_instrumentos():
-    """Busca instrumentos com filtros para o chat"""
+    """Busca instrumentos com filtros para o chat
+
+    Paginacao por chave: ?limite=N&cursor=<next_cursor>. ?ordenar=campo ou -campo
+    (identificacao, nome, created_at, proxima_calibracao, relevancia), ?fields=
+    limita as colunas e ?total=1 devolve total_geral (COUNT separado).
+    """
     user_id = request.args.get('user_id') or session.get('gocal_user_id')
     if not user_id:
         return jsonify({'success': False, 'items': [], 'message': 'Usuário não identificado.'})
@@ -1378,38 +1461,25 @@ def buscar_instrumentos():
         'data_fim': request.args.get('data_fim', '').strip(),
     }
 
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
-
-        sql = """
-            SELECT i.id, i.identificacao, i.nome, i.status,
-                   c.data_calibracao, c.data_proxima_calibracao, c.status_calibracao,
-                   c.laboratorio_responsavel
-            FROM instrumentos i
-            LEFT JOIN calibracoes c ON c.id = (
-                SELECT id FROM calibracoes WHERE instrumento_id = i.id ORDER BY data_calibracao DESC LIMIT 1
-            )
-            WHERE i.user_id = %s
-        """
-        params = [user_id]
-
-        sql, params = _aplicar_filtros_instrumentos_sql_v2(sql, params, filtros)
-
-        sql += " ORDER BY i.identificacao LIMIT 50"
+    limite = max(1, min(request.args.get('limite', 50, type=int), _BUSCA_INSTRUMENTOS_MAX))
+    campos = parse_fields(request.args.get('fields', ''), SEARCH_FIELDS, SEARCH_DEFAULT_FIELDS)
 
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
+    try:
+        rows, next_cursor, total_geral = _pagina_instrumentos(
+            user_id, filtros, campos, ordenar=request.args.get('ordenar', ''), limite=limite,
+            token=request.args.get('cursor', ''), com_total=is_truthy_filter(request.args.get('total')),
+        )
 
         # Formata datas
         for r in rows:
-            for k in ['data_calibracao', 'data_proxima_calibracao']:
+            for k in ['data_calibracao', 'data_proxima_calibracao', 'created_at']:
                 if r.get(k):
                     r[k] = str(r[k])
 
-        return jsonify({'success': True, 'items': rows, 'total': len(rows)})
+        resposta = {'success': True, 'items': rows, 'total': len(rows), 'next_cursor': next_cursor}
+        if total_geral is not None:
+            resposta['total_geral'] = total_geral
+        return jsonify(resposta)
 
     except Exception as e:
         print(f"[ERRO] buscar-instrumentos: {e}")
@@ -1424,211 +1494,929 @@ def limpar_cache():
     
     session_id = session['session_id']
     
-    if session_id in extracted_cache:
-        del extracted_cache[session_id]
-        print(f"[CACHE] Sessao {session_id[:8]}... limpa.")
+    extracted_cache.delete(session_id)
+    print(f"[CACHE] Sessao {session_id[:8]}... limpa.")
     
     return jsonify({'success': True, 'message': 'Cache limpo com sucesso.'})
 
 
+# ============================================================
+# PIPELINE DE EXTRACAO ASSINCRONA
+# Tarefa -> arquivos enfileirados um a um no scheduler -> fechamento.
+# Arquivos podem entrar na tarefa aos poucos (upload em partes, ZIP, etc).
+# ============================================================
+_pipeline_lock = threading.Lock()
+_pipeline_ctx = {}  # {task_id: contexto de execucao (fora do JobStore, nao serializavel)}
+
+
+_publicacao_lock = threading.Lock()
+_publicacao = {}  # {task_id: (ultima publicacao, timer da publicacao adiada)}
+
+
+def _publicar_tarefa(task_id, agora_mesmo=False):
+    """Publica o estado da tarefa no task_board para os outros workers.
+    No maximo uma vez por JOB_BOARD_INTERVAL; a ultima mudanca sai no fim do intervalo."""
+    with _publicacao_lock:
+        ultima, timer = _publicacao.get(task_id, (0.0, None))
+        espera = ultima + JOB_BOARD_INTERVAL - time.time()
+        if not agora_mesmo and espera > 0:
+            if timer is None:
+                timer = threading.Timer(espera, _publicar_tarefa, args=(task_id, True))
+                timer.daemon = True
+                _publicacao[task_id] = (ultima, timer)
+                timer.start()
+            return
+        if timer is not None:
+            timer.cancel()
+        _publicacao[task_id] = (time.time(), None)
+    estado = processing_tasks.snapshot(task_id)
+    if estado is None:
+        return
+    pdf_info = {idx: processing_tasks.pdf_info(task_id, idx) for idx in range(len(estado['results']))}
+    task_board.publish(task_id, estado, pdf_info)
+
+
+def _esquecer_publicacao(task_id):
+    with _publicacao_lock:
+        _, timer = _publicacao.pop(task_id, (0.0, None))
+    if timer is not None:
+        timer.cancel()
+
+
+def _tarefa_publicada(task_id):
+    """Estado publicado de uma tarefa que roda em outro worker (None se e deste processo ou nao existe)"""
+    if task_id in processing_tasks:
+        return None
+    return task_board.load(task_id)
+
+
+def _iniciar_tarefa_extracao(session_id, user_cmd, prioridade, tenant, total=0, extra=None):
+    """Cria a tarefa no JobStore e o contexto de execucao. Retorna o task_id."""
+    task_id = str(uuid.uuid4())
+    estado = {
+        'status': 'starting',
+        'session_id': session_id,
+        'priority': 'interativo' if prioridade == PRIORIDADE_INTERATIVA else 'lote',
+        'total': total,
+        'completed': 0,
+        'files': {},  # {filename: status}
+        'results': []
+    }
+    if extra:
+        estado.update(extra)
+    processing_tasks.create(task_id, estado)
+    with _pipeline_lock:
+        _pipeline_ctx[task_id] = {
+            'session_id': session_id,
+            'user_cmd': user_cmd or '',
+            'priority': prioridade,
+            'tenant': tenant,
+            'pendentes': 0,
+            'fechada': False,
+            'instrumentos': [],
+        }
+    _publicar_tarefa(task_id, agora_mesmo=True)
+    return task_id
+
+
+def _enfileirar_pdf_tarefa(task_id, path, name, contar_total=False, timings=None):
+    """Envia um PDF ja salvo em disco para a fila de extracao da tarefa.
+    timings: etapas ja medidas antes da fila (file_save, download, zip_read)."""
+    # Consultado antes do _pipeline_lock: o scheduler nunca e chamado com esse lock preso
+    cancelada = extraction_scheduler.is_cancelled(task_id)
+    with _pipeline_lock:
+        ctx = _pipeline_ctx.get(task_id)
+        if not ctx or ctx['fechada'] or cancelada:
+            ctx = None
+        else:
+            ctx['pendentes'] += 1
+    if ctx is None:
+        _remover_temp(path)
+        return False
+
+    processing_tasks.set_file_status(task_id, name, 'pending')
+    if contar_total:
+        processing_tasks.increment(task_id, 'total')
+    task = processing_tasks.get(task_id) or {}
+    if task.get('status') == 'starting' and not extraction_scheduler.is_paused(task_id):
+        processing_tasks.update(task_id, status='queued')
+    _publicar_tarefa(task_id)
+
+    future = extraction_scheduler.submit(
+        _processar_pdf_tarefa, task_id, path, name, dict(timings or {}), time.perf_counter(),
+        priority=ctx['priority'], tenant=ctx['tenant'], job_id=task_id
+    )
+    future.add_done_callback(lambda f: _pdf_tarefa_concluido(task_id, path, name, f))
+    return True
+
+
+def _processar_pdf_tarefa(tid, p, n, etapas, enfileirado_em):
+    """Extrai um PDF da tarefa (roda no worker do scheduler)."""
+    registrar_etapa(etapas, 'queue_wait', time.perf_counter() - enfileirado_em)
+    try:
+        return _processar_pdf_tarefa_medido(tid, p, n, etapas)
+    finally:
+        processing_tasks.set_file_timings(tid, n, etapas)
+        stage_histogram.record(etapas)
+
+
+def _processar_pdf_tarefa_medido(tid, p, n, etapas):
+    cancel_ev = extraction_scheduler.cancel_event(tid)
+    with _pipeline_lock:
+        user_cmd = (_pipeline_ctx.get(tid) or {}).get('user_cmd', '')
+    if cancel_ev.is_set():
+        _remover_temp(p)
+        processing_tasks.set_file_status(tid, n, 'cancelled')
+        return None
+    if not extraction_scheduler.is_paused(tid):
+        processing_tasks.update(tid, status='running')
+    processing_tasks.set_file_status(tid, n, 'processing')
+    _publicar_tarefa(tid)
+    try:
+        # Le o PDF ANTES de processar (para salvar no banco depois).
+        # Os bytes ficam no JobStore, fora do resultado.
+        pdf_bytes = None
+        try:
+            with medir_etapa(etapas, 'file_read'):
+                with open(p, 'rb') as f:
+                    pdf_bytes = f.read()
+            registrar_bytes(etapas, 'file_read', len(pdf_bytes))
+        except:
+            pass
+
+        # Extrai dados com IA
+        res = _extrair_pdf_coalescido(p, n, user_prompt=user_cmd,
+                                      cancel_event=cancel_ev, pdf_bytes=pdf_bytes, timings=etapas)
+        _remover_temp(p)
+
+        if res and res.get('cancelled'):
+            processing_tasks.set_file_status(tid, n, 'cancelled')
+            return None
+        if res and 'error' not in res:
+            with medir_etapa(etapas, 'postprocess'):
+                if not res.get('identificacao'):
+                    res['identificacao'] = _resolver_identificacao_extraida(res, '')
+                if not res.get('numero_certificado'):
+                    res['numero_certificado'] = _resolver_numero_certificado_extraido(res, '')
+                if pdf_bytes:
+                    res['_pdf_filename'] = n
+                idx = processing_tasks.add_result(tid, res, pdf_bytes)
+                if pdf_bytes and idx >= 0:
+                    task_board.publish_pdf(tid, idx, pdf_bytes)
+            processing_tasks.set_file_status(tid, n, 'done')
+            return res
+        else:
+            processing_tasks.set_file_status(tid, n, 'error')
+            return None
+    except:
+        _remover_temp(p)
+        processing_tasks.set_file_status(tid, n, 'error')
+        return None
+
+
+def _pdf_tarefa_concluido(tid, path, name, future):
+    """Callback do scheduler: contabiliza o arquivo e fecha a tarefa se for o ultimo."""
+    res = None
+    if future.cancelled():
+        # Cancelado antes de sair da fila: so libera o arquivo temporario
+        _remover_temp(path)
+        processing_tasks.set_file_status(tid, name, 'cancelled')
+    else:
+        try:
+            res = future.result()
+        except Exception as e:
+            print(f"[TASK-ERR] {name}: {e}")
+        processing_tasks.increment(tid, 'completed')
+    _publicar_tarefa(tid)
+
+    with _pipeline_lock:
+        ctx = _pipeline_ctx.get(tid)
+        if not ctx:
+            return
+        if res:
+            ctx['instrumentos'].append(res)
+        ctx['pendentes'] -= 1
+        finalizar = ctx['fechada'] and ctx['pendentes'] == 0
+    if finalizar:
+        _finalizar_tarefa_extracao(tid)
+
+
+def _fechar_tarefa_extracao(task_id):
+    """Indica que nao entram mais arquivos; a tarefa termina quando a fila dela esvaziar."""
+    with _pipeline_lock:
+        ctx = _pipeline_ctx.get(task_id)
+        if not ctx:
+            return
+        ctx['fechada'] = True
+        finalizar = ctx['pendentes'] == 0
+    if finalizar:
+        _finalizar_tarefa_extracao(task_id)
+
+
+def _reter_tarefa_extracao(task_id):
+    """Impede que a tarefa termine enquanto uma fonte (ZIP, download) ainda alimenta a fila."""
+    with _pipeline_lock:
+        ctx = _pipeline_ctx.get(task_id)
+        if not ctx:
+            return False
+        ctx['pendentes'] += 1
+    return True
+
+
+def _liberar_tarefa_extracao(task_id):
+    with _pipeline_lock:
+        ctx = _pipeline_ctx.get(task_id)
+        if not ctx:
+            return
+        ctx['pendentes'] -= 1
+        finalizar = ctx['fechada'] and ctx['pendentes'] == 0
+    if finalizar:
+        _finalizar_tarefa_extracao(task_id)
+
+
+def _finalizar_tarefa_extracao(task_id, status=None):
+    with _pipeline_lock:
+        ctx = _pipeline_ctx.pop(task_id, None)
+    if not ctx:
+        return
+    instrumentos = ctx['instrumentos']
+    sid = ctx['session_id']
+
+    # Salva no Cache da Sessao (resultados parciais tambem, se cancelado)
+    if instrumentos:
+        extracted_cache.extend(sid, instrumentos)
+
+    status_final = status or ('cancelled' if extraction_scheduler.is_cancelled(task_id) else 'completed')
+    processing_tasks.finish(task_id, status_final)
+    _esquecer_publicacao(task_id)
+    _publicar_tarefa(task_id, agora_mesmo=True)
+    extraction_scheduler.forget(task_id)
+    task_inbox.unregister(task_id)
+    print(f"[TASK] {task_id} {status_final}. {len(instrumentos)} itens.")
+
+
+def _iniciar_download_url(task_id, url):
+    """Segura a tarefa e baixa o PDF no pool de downloads; ao terminar ele entra na fila."""
+    nome = _nome_unico_tarefa(task_id, url_fetcher.filename_for(url))
+    if not _reter_tarefa_extracao(task_id):
+        return False
+    processing_tasks.set_file_status(task_id, nome, 'downloading')
+    future = url_fetcher.submit(url, app.config['UPLOAD_FOLDER'], extraction_scheduler.cancel_event(task_id))
+    future.add_done_callback(lambda f: _download_url_concluido(task_id, url, nome, f))
+    return True
+
+
+def _download_url_concluido(task_id, url, nome, future):
+    try:
+        try:
+            baixado = future.result()
+        except Exception as e:
+            print(f"[URL] {url}: {e}")
+            processing_tasks.set_file_status(task_id, nome, 'error', error=str(e))
+            processing_tasks.increment(task_id, 'completed')
+            return
+        print(f"[URL] {nome} baixado ({baixado['size']} bytes, sha256={baixado['sha256'][:12]}...)")
+        etapas = {}
+        registrar_etapa(etapas, 'download', baixado['seconds'], baixado['size'])
+        _enfileirar_pdf_tarefa(task_id, baixado['path'], nome, timings=etapas)
+    finally:
+        _liberar_tarefa_extracao(task_id)
+
+
 @app.route('/upload-async', methods=['POST'])
 def upload_async():
-    """Recebe arquivos e inicia processamento em background, retornando task_id"""
+    """Recebe arquivos e/ou URLs e inicia processamento em background, retornando task_id.
+    URLs (pdf_url, pode repetir) sao baixadas em background, nunca dentro da requisicao."""
     if 'session_id' not in session:
         session['session_id'] = str(uuid.uuid4())
     session_id = session['session_id']
     
-    files = request.files.getlist('pdfs')
-    pdf_url = request.form.get('pdf_url') # Novo parametro
+    files = [f for f in request.files.getlist('pdfs') if f and f.filename]
+    pdf_urls = [u.strip() for u in request.form.getlist('pdf_url') + request.form.getlist('pdf_urls') if u and u.strip()]
     comando = request.form.get('comando')
 
-    has_files = (files and files[0].filename) or pdf_url
-    if not has_files:
+    if not files and not pdf_urls:
         return jsonify({'success': False, 'message': 'Sem arquivos ou URL'})
+    if len(pdf_urls) > URL_FETCH_MAX_URLS:
+        return jsonify({'success': False, 'message': f'Maximo de {URL_FETCH_MAX_URLS} URLs por envio'})
+    invalidas = [u for u in pdf_urls if not url_fetcher.validate_url(u)]
+    if invalidas:
+        return jsonify({'success': False, 'message': f'URL invalida: {invalidas[0]}'})
         
-    task_id = str(uuid.uuid4())
-    temp_files_info = [] # (path, name)
-    
-    # Inicializa status da task
-    processing_tasks[task_id] = {
-        'status': 'starting',
-        'session_id': session_id,
-        'total': 1 if pdf_url else len(files),
-        'completed': 0,
-        'files': {}, # {filename: status}
-        'results': []
-    }
+    prioridade = _prioridade_extracao(len(files) + len(pdf_urls))
+    task_id = _iniciar_tarefa_extracao(session_id, comando, prioridade, _tenant_key_extracao(),
+                                       total=len(files) + len(pdf_urls))
     
     try:
-        # 1. Se veio URL, faz download
-        if pdf_url:
-            import requests
-            try:
-                # Nome do arquivo da URL ou padrao
-                fname = pdf_url.split('/')[-1] or "documento_web.pdf"
-                if not fname.lower().endswith('.pdf'): fname += '.pdf'
-                
-                unique = f"{uuid.uuid4().hex}_{fname}"
-                path = os.path.join(app.config['UPLOAD_FOLDER'], unique)
-                
-                # Download
-                response = requests.get(pdf_url, stream=True, verify=False) # verify=False para local/dev
-                if response.status_code == 200:
-                    with open(path, 'wb') as f:
-                        for chunk in response.iter_content(1024):
-                            f.write(chunk)
-                    
-                    temp_files_info.append((path, fname))
-                    processing_tasks[task_id]['files'][fname] = 'pending'
-                else:
-                    return jsonify({'success': False, 'message': f'Erro ao acessar URL: {response.status_code}'})
-            except Exception as e:
-                return jsonify({'success': False, 'message': f'Falha no download: {e}'})
-
-        # 2. Se veio Arquivos (Upload normal)
-        if files and files[0].filename:
-            for file in files:
-                fname = secure_filename(file.filename)
-                unique = f"{uuid.uuid4().hex}_{fname}"
-                path = os.path.join(app.config['UPLOAD_FOLDER'], unique)
+        # 1. URLs: o download acontece no pool de downloads, a resposta nao espera
+        for url in pdf_urls:
+            _iniciar_download_url(task_id, url)
+
+        # 2. Arquivos (upload normal): salva e enfileira
+        for file in files:
+            fname = secure_filename(file.filename)
+            unique = f"{uuid.uuid4().hex}_{fname}"
+            path = os.path.join(app.config['UPLOAD_FOLDER'], unique)
+            etapas = {}
+            with medir_etapa(etapas, 'file_save'):
                 file.save(path)
-                temp_files_info.append((path, fname))
-                processing_tasks[task_id]['files'][fname] = 'pending'
-            
-            # Recalcula total real
-            processing_tasks[task_id]['total'] = len(temp_files_info)
-            
-        # Funcao Worker (Background)
-        def run_job(tid, files_info, sid, user_cmd):
-            try:
-                 processing_tasks[tid]['status'] = 'running'
-                 instrumentos = []
-                 
-                 def process_one(args):
-                     p, n = args
-                     processing_tasks[tid]['files'][n] = 'processing'
-                     try:
-                         # Le o PDF como base64 ANTES de processar (para salvar no banco depois)
-                         import base64
-                         pdf_base64 = None
-                         try:
-                             with open(p, 'rb') as f:
-                                 pdf_base64 = base64.b64encode(f.read()).decode('utf-8')
-                         except:
-                             pass
-                         
-                         # Extrai dados com IA
-                         res = extractor.extract_from_pdf(p, n, user_prompt=user_cmd)
-                         try: os.remove(p)
-                         except: pass
-                         
-                         if res and 'error' not in res:
-                             if not res.get('identificacao'):
-                                 res['identificacao'] = _resolver_identificacao_extraida(res, '')
-                             if not res.get('numero_certificado'):
-                                 res['numero_certificado'] = _resolver_numero_certificado_extraido(res, '')
-                             # Anexa o PDF base64 e nome original ao resultado
-                             if pdf_base64:
-                                 res['_pdf_base64'] = pdf_base64
-                                 res['_pdf_filename'] = n
-                             processing_tasks[tid]['files'][n] = 'done'
-                             return res
-                         else:
-                             processing_tasks[tid]['files'][n] = 'error'
-                             return None
-                     except:
-                         processing_tasks[tid]['files'][n] = 'error'
-                         return None
-                 
-                 # Paralelismo
-                 with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                     # Usa as_completed para atualizar contador realtime? 
-                     # Ou map simples. Map é mais facil de coletar ordem, mas as_completed é melhor pra progresso.
-                     future_to_file = {executor.submit(process_one, f): f[1] for f in files_info}
-                     
-                     for future in concurrent.futures.as_completed(future_to_file):
-                         res = future.result()
-                         processing_tasks[tid]['completed'] += 1
-                         if res:
-                             instrumentos.append(res)
-                
-                 # Salva no Cache da Sessao
-                 if sid not in extracted_cache: extracted_cache[sid] = []
-                 extracted_cache[sid].extend(instrumentos)
-                 
-                 processing_tasks[tid]['results'] = instrumentos
-                 processing_tasks[tid]['status'] = 'completed'
-                 print(f"[TASK] {tid} concluida. {len(instrumentos)} itens.")
-                 
-            except Exception as e:
-                 print(f"[TASK-ERR] {e}")
-                 processing_tasks[tid]['status'] = 'error'
+            registrar_bytes(etapas, 'file_save', _tamanho_arquivo(path))
+            _enfileirar_pdf_tarefa(task_id, path, fname, timings=etapas)
 
-        # Lança thread solta
-        threading.Thread(target=run_job, args=(task_id, temp_files_info, session_id, comando)).start()
+        # Fecha a tarefa (o processamento segue em background)
+        _fechar_tarefa_extracao(task_id)
         
         return jsonify({'success': True, 'task_id': task_id})
         
     except Exception as e:
+        _finalizar_tarefa_extracao(task_id, 'error')
         return jsonify({'success': False, 'message': str(e)})
 
+
+# ============================================================
+# IMPORTACAO DE ZIP
+# As entradas sao lidas uma a uma direto do arquivo (sem descompactar tudo)
+# e cada PDF entra na fila assim que e lido. PDFs repetidos (mesmo SHA-256)
+# dentro da tarefa sao ignorados.
+# ============================================================
+def _iniciar_ingestao_zip(task_id, zip_path, zip_name):
+    """Segura a tarefa e le o ZIP em background. Retorna False se a tarefa ja terminou."""
+    if not _reter_tarefa_extracao(task_id):
+        _remover_temp(zip_path)
+        return False
+    processing_tasks.set_file_status(task_id, zip_name, 'unpacking')
+    threading.Thread(target=_ingerir_zip_tarefa, args=(task_id, zip_path, zip_name),
+                     name='metron-zip', daemon=True).start()
+    return True
+
+
+def _ingerir_zip_tarefa(task_id, zip_path, zip_name):
+    resumo = {'entries': 0, 'pdfs': 0, 'duplicates': 0, 'skipped': 0, 'done': False}
+    with _pipeline_lock:
+        ctx = _pipeline_ctx.get(task_id) or {}
+        vistos = ctx.setdefault('hashes', set())
+        progresso = ctx.setdefault('zip_progress', {})
+        progresso[zip_name] = resumo
+
+    def publicar():
+        with _pipeline_lock:
+            copia = {k: dict(v) for k, v in progresso.items()}
+        processing_tasks.update(task_id, zip_progress=copia)
+
+    status_zip = 'done'
+    try:
+        inicio = time.perf_counter()
+        for ev in iter_zip_pdfs(zip_path, app.config['UPLOAD_FOLDER'],
+                                max_entry_bytes=ZIP_MAX_ENTRY_BYTES, max_entries=ZIP_MAX_ENTRIES,
+                                seen_hashes=vistos):
+            etapas = {}
+            registrar_etapa(etapas, 'zip_read', time.perf_counter() - inicio, ev.get('size', 0))
+            if extraction_scheduler.is_cancelled(task_id):
+                if ev.get('path'):
+                    _remover_temp(ev['path'])
+                status_zip = 'cancelled'
+                break
+            with _pipeline_lock:
+                resumo['entries'] += 1
+            nome = _nome_unico_tarefa(task_id, ev['name']) if ev['name'] else ''
+            if ev['status'] == 'ok':
+                if not _enfileirar_pdf_tarefa(task_id, ev['path'], nome, contar_total=True, timings=etapas):
+                    status_zip = 'cancelled'
+                    break
+                with _pipeline_lock:
+                    resumo['pdfs'] += 1
+            elif ev['status'] == 'duplicate':
+                with _pipeline_lock:
+                    resumo['duplicates'] += 1
+                processing_tasks.set_file_status(task_id, nome, 'duplicate')
+            else:
+                with _pipeline_lock:
+                    resumo['skipped'] += 1
+                if ev['name']:
+                    processing_tasks.set_file_status(task_id, nome, 'skipped')
+                if ev.get('reason'):
+                    print(f"[ZIP] {zip_name}: {ev['entry'] or '-'} ignorado ({ev['reason']})")
+            publicar()
+            inicio = time.perf_counter()
+    except Exception as e:
+        print(f"[ZIP-ERR] {zip_name}: {e}")
+        status_zip = 'error'
+    finally:
+        _remover_temp(zip_path)
+        with _pipeline_lock:
+            resumo['done'] = True
+        publicar()
+        processing_tasks.set_file_status(task_id, zip_name, status_zip)
+        print(f"[ZIP] {zip_name}: {resumo['pdfs']} PDF(s), {resumo['duplicates']} duplicado(s), "
+              f"{resumo['skipped']} ignorado(s)")
+        _liberar_tarefa_extracao(task_id)
+
+
+def _nome_unico_tarefa(task_id, nome):
+    """Evita que arquivos com o mesmo nome (pastas do ZIP, URLs) se sobreponham na tarefa."""
+    with _pipeline_lock:
+        usados = (_pipeline_ctx.get(task_id) or {}).setdefault('nomes', set())
+        base, ext = os.path.splitext(nome)
+        candidato, n = nome, 1
+        while candidato in usados:
+            n += 1
+            candidato = f"{base}_{n}{ext}"
+        usados.add(candidato)
+    return candidato
+
+
+@app.route('/upload-zip', methods=['POST'])
+def upload_zip():
+    """Recebe um ou mais ZIPs de certificados e extrai os PDFs em background.
+    Para ZIPs maiores que o limite de upload use /upload-chunked com o arquivo .zip."""
+    if 'session_id' not in session:
+        session['session_id'] = str(uuid.uuid4())
+    session_id = session['session_id']
+
+    arquivos = [f for f in request.files.getlist('zip') if f and f.filename]
+    if not arquivos:
+        return jsonify({'success': False, 'message': 'Nenhum ZIP enviado'})
+    for f in arquivos:
+        is_valid, error = validator.validate_zip(secure_filename(f.filename))
+        if not is_valid:
+            return jsonify({'success': False, 'message': f"{f.filename}: {error}"})
+
+    task_id = _iniciar_tarefa_extracao(session_id, request.form.get('comando'), PRIORIDADE_LOTE,
+                                       _tenant_key_extracao())
+    try:
+        for f in arquivos:
+            fname = secure_filename(f.filename)
+            path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{fname}")
+            f.save(path)
+            _iniciar_ingestao_zip(task_id, path, fname)
+        _fechar_tarefa_extracao(task_id)
+        return jsonify({'success': True, 'task_id': task_id})
+    except Exception as e:
+        _finalizar_tarefa_extracao(task_id, 'error')
+        return jsonify({'success': False, 'message': str(e)})
+
+
+# ============================================================
+# UPLOAD EM PARTES (retomavel)
+# init -> PUT das partes com offset -> finalize. Cada arquivo completo
+# entra na fila de extracao na hora, sem esperar o resto do lote.
+# ============================================================
+def _erro_chunked(e):
+    payload = {'success': False, 'message': str(e)}
+    if e.expected_offset is not None:
+        payload['expected_offset'] = e.expected_offset
+    return jsonify(payload), e.status
+
+
+def _upload_da_sessao(upload_id):
+    """Garante que o upload pertence a sessao atual (levanta ChunkedUploadError)."""
+    if chunked_uploads.owner_of(upload_id) != session.get('session_id'):
+        raise ChunkedUploadError('Upload indisponivel para esta sessao', status=403)
+
+
+@app.route('/upload-chunked/init', methods=['POST'])
+def upload_chunked_init():
+    """Abre um upload em partes e a tarefa de extracao que recebera os arquivos.
+    Corpo JSON: {"files": [{"name", "size", "sha256"?}], "comando"?, "prioridade"?}"""
+    if 'session_id' not in session:
+        session['session_id'] = str(uuid.uuid4())
+    session_id = session['session_id']
+
+    data = request.get_json(silent=True) or {}
+    arquivos = []
+    for f in data.get('files') or []:
+        fname = secure_filename(str(f.get('name') or ''))
+        if fname.lower().endswith('.zip'):
+            is_valid, error = validator.validate_zip(fname)
+        else:
+            is_valid, error = validator.validate_pdf(fname)
+        if not is_valid:
+            return jsonify({'success': False, 'message': f"{f.get('name')}: {error}"}), 400
+        arquivos.append({'name': fname, 'size': f.get('size'), 'sha256': f.get('sha256')})
+    if not arquivos:
+        return jsonify({'success': False, 'message': 'Nenhum arquivo informado'}), 400
+
+    # ZIPs nao contam no total: cada PDF lido do ZIP soma quando entra na fila
+    pdfs = [f for f in arquivos if not f['name'].lower().endswith('.zip')]
+    prioridade = PRIORIDADE_LOTE if len(pdfs) < len(arquivos) else _prioridade_extracao(len(arquivos))
+    task_id = _iniciar_tarefa_extracao(session_id, data.get('comando'), prioridade, _tenant_key_extracao(),
+                                       total=len(pdfs))
+    try:
+        upload = chunked_uploads.init_upload(arquivos, owner=session_id, task_id=task_id)
+    except ChunkedUploadError as e:
+        _finalizar_tarefa_extracao(task_id, 'error')
+        return _erro_chunked(e)
+
+    processing_tasks.update(task_id, upload_id=upload['upload_id'])
+    for f in upload['files']:
+        processing_tasks.set_file_status(task_id, f['name'], 'uploading')
+    # Partes e finalize podem cair em outro worker: eles entregam aqui pela caixa da tarefa
+    task_inbox.register(task_id)
+
+    print(f"[CHUNKED] Upload {upload['upload_id'][:8]}... aberto com {len(arquivos)} arquivo(s) -> task {task_id}")
+    return jsonify({'success': True, 'chunk_size': CHUNKED_CHUNK_SIZE, **upload})
+
+
+@app.route('/upload-chunked/<upload_id>/<file_id>', methods=['PUT'])
+def upload_chunked_parte(upload_id, file_id):
+    """Recebe uma parte de um arquivo. Query: ?offset=N (bytes ja enviados do arquivo)."""
+    try:
+        _upload_da_sessao(upload_id)
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            raise ChunkedUploadError('Parametro offset obrigatorio')
+        entry, concluido = chunked_uploads.write_chunk(upload_id, file_id, offset, request.get_data())
+    except ChunkedUploadError as e:
+        return _erro_chunked(e)
+
+    if concluido:
+        task_id = chunked_uploads.status(upload_id)['task_id']
+        if task_inbox.is_local(task_id):
+            aceito = _enfileirar_arquivo_chunked(task_id, concluido['path'], concluido['name'])
+        else:
+            # A fila da tarefa esta no worker que abriu o upload: o arquivo vai para a caixa dele
+            aceito = task_inbox.send(task_id, {'acao': 'arquivo', 'nome': concluido['name']},
+                                     attachment=concluido['path'])
+        if not aceito:
+            # O arquivo montado foi descartado: volta para "nao recebido" para poder ser reenviado
+            chunked_uploads.reopen(upload_id, file_id)
+            if extraction_scheduler.is_cancelled(task_id):
+                return jsonify({'success': False, 'message': 'Tarefa de extracao cancelada'}), 409
+            # Tarefa encerrada, ou o processo dono reiniciou
+            print(f"[CHUNKED] {concluido['name']} completo, mas a tarefa {task_id} nao esta mais ativa")
+            return jsonify({'success': False, 'expected_offset': 0,
+                            'message': 'Tarefa de extracao indisponivel; reenvie o arquivo ou abra um novo upload'}), 503
+        print(f"[CHUNKED] {concluido['name']} completo (sha256={concluido['sha256'][:12]}...), "
+              f"{'lendo entradas do ZIP' if concluido['name'].lower().endswith('.zip') else 'enfileirado'}")
+
+    return jsonify({'success': True, **entry})
+
+
+@app.route('/upload-chunked/<upload_id>', methods=['GET'])
+def upload_chunked_status(upload_id):
+    """Estado do upload (bytes recebidos por arquivo) para retomar apos queda."""
+    try:
+        _upload_da_sessao(upload_id)
+        return jsonify({'success': True, **chunked_uploads.status(upload_id)})
+    except ChunkedUploadError as e:
+        return _erro_chunked(e)
+
+
+@app.route('/upload-chunked/<upload_id>/finalize', methods=['POST'])
+def upload_chunked_finalize(upload_id):
+    """Fecha o upload: arquivos incompletos sao descartados e a tarefa termina
+    quando os arquivos ja enfileirados forem processados."""
+    try:
+        _upload_da_sessao(upload_id)
+        upload = chunked_uploads.finalize(upload_id)
+    except ChunkedUploadError as e:
+        return _erro_chunked(e)
+
+    task_id = upload['task_id']
+    incompletos = [f['name'] for f in upload['files'] if not f['complete']]
+    if task_inbox.is_local(task_id):
+        _fechar_upload_chunked(task_id, incompletos)
+    elif not task_inbox.send(task_id, {'acao': 'finalizar', 'incompletos': incompletos}):
+        return jsonify({'success': False, 'task_id': task_id,
+                        'message': 'Tarefa de extracao indisponivel (processo reiniciado); abra um novo upload'}), 503
+
+    return jsonify({'success': True, 'task_id': task_id, 'incompletos': incompletos})
+
+
+def _fechar_upload_chunked(task_id, incompletos):
+    """Fim do upload no processo dono da tarefa: incompletos viram erro e a tarefa fecha"""
+    for nome in incompletos:
+        processing_tasks.set_file_status(task_id, nome, 'error')
+    pdfs_incompletos = [n for n in incompletos if not n.lower().endswith('.zip')]
+    if pdfs_incompletos:
+        processing_tasks.increment(task_id, 'total', -len(pdfs_incompletos))
+    _fechar_tarefa_extracao(task_id)
+
+
+def _enfileirar_arquivo_chunked(task_id, path, name):
+    if name.lower().endswith('.zip'):
+        return _iniciar_ingestao_zip(task_id, path, name)
+    return _enfileirar_pdf_tarefa(task_id, path, name)
+
+
+def _mensagem_tarefa(task_id, mensagem, anexo):
+    """Handler do TaskInbox: arquivo completo ou finalize recebidos por outro worker"""
+    if mensagem.get('acao') == 'arquivo':
+        if not _enfileirar_arquivo_chunked(task_id, anexo, mensagem['nome']):
+            # Tarefa fechada ou cancelada depois do envio: o arquivo foi descartado
+            processing_tasks.set_file_status(task_id, mensagem['nome'], 'error')
+    elif mensagem.get('acao') == 'finalizar':
+        _fechar_upload_chunked(task_id, mensagem.get('incompletos') or [])
+
+
+def _remover_temp(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _tamanho_arquivo(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _task_da_sessao(task_id):
+    """Retorna (task, None) se a tarefa pertence a sessao atual, ou (None, resposta de erro)."""
+    task = processing_tasks.get(task_id)
+    if not task:
+        return None, (jsonify({'success': False, 'message': 'Tarefa nao encontrada'}), 404)
+    if not _tarefa_visivel(task):
+        return None, (jsonify({'success': False, 'message': 'Tarefa indisponivel para esta sessao'}), 403)
+    return task, None
+
+
+def _tarefa_visivel(task):
+    """A tarefa e da sessao atual, ou veio da pasta vigiada do usuario logado."""
+    if task.get('session_id') == session.get('session_id'):
+        return True
+    dono = task.get('owner_user_id')
+    return bool(dono) and str(dono) == str(session.get('gocal_user_id') or '')
+
+
+@app.route('/upload-cancel/<task_id>', methods=['POST'])
+def cancelar_upload(task_id):
+    """Cancela a tarefa: tira da fila o que falta e interrompe as extracoes em andamento.
+    Os resultados ja concluidos continuam disponiveis em /upload-status."""
+    task, erro = _task_da_sessao(task_id)
+    if erro:
+        return erro
+    if task.get('status') in processing_tasks.FINISHED_STATUSES:
+        return jsonify({'success': False, 'message': 'Tarefa ja finalizada.'})
+
+    processing_tasks.update(task_id, status='cancelling')
+    removidos = extraction_scheduler.cancel(task_id)
+    _publicar_tarefa(task_id)
+    # Nenhum arquivo novo entra depois do cancelamento (ex: upload em partes ainda aberto)
+    _fechar_tarefa_extracao(task_id)
+    print(f"[TASK] {task_id} cancelada ({removidos} arquivo(s) retirados da fila)")
+    return jsonify({'success': True, 'message': 'Cancelamento solicitado.', 'removidos_da_fila': removidos})
+
+
+@app.route('/upload-pause/<task_id>', methods=['POST'])
+def pausar_upload(task_id):
+    """Pausa a tarefa: os arquivos pendentes deixam de ser enviados para a IA."""
+    task, erro = _task_da_sessao(task_id)
+    if erro:
+        return erro
+    if task.get('status') in processing_tasks.FINISHED_STATUSES:
+        return jsonify({'success': False, 'message': 'Tarefa ja finalizada.'})
+
+    retidos = extraction_scheduler.pause(task_id)
+    processing_tasks.update(task_id, status='paused')
+    _publicar_tarefa(task_id)
+    return jsonify({'success': True, 'message': 'Tarefa pausada.', 'retidos': retidos})
+
+
+@app.route('/upload-resume/<task_id>', methods=['POST'])
+def retomar_upload(task_id):
+    """Retoma uma tarefa pausada."""
+    task, erro = _task_da_sessao(task_id)
+    if erro:
+        return erro
+    if task.get('status') != 'paused':
+        return jsonify({'success': False, 'message': 'Tarefa nao esta pausada.'})
+
+    pendentes = extraction_scheduler.resume(task_id)
+    processing_tasks.update(task_id, status='queued')
+    _publicar_tarefa(task_id)
+    return jsonify({'success': True, 'message': 'Tarefa retomada.', 'pendentes': pendentes})
+
+
 @app.route('/upload-status/<task_id>')
 def check_status(task_id):
     """Retorna o status do processamento assincrono"""
-    raw_data = processing_tasks.get(task_id, {'status': 'not_found'})
-    
-    # Cria uma copia rasa para nao alterar o original em cache (que tem o PDF)
-    data = raw_data.copy()
-    
-    # Se tiver resultados, remove o base64 para nao travar o front
-    if 'results' in data and data['results']:
-        clean_results = []
-        for res in data['results']:
-            # Copia o dict do resultado para remover a chave sem afetar o original
-            res_clean = res.copy()
-            if '_pdf_base64' in res_clean:
-                del res_clean['_pdf_base64']
-            clean_results.append(res_clean)
-        data['results'] = clean_results
+    # Copia rasa: os PDFs ficam no JobStore, fora dos resultados
+    data = processing_tasks.snapshot(task_id)
+    if data is None:
+        # Tarefa aberta em outro worker (ou pela pasta vigiada): copia publicada
+        data = _tarefa_publicada(task_id)
+        if data is not None and _tarefa_visivel(data):
+            data.pop('pdf_info', None)
+        else:
+            data = {'status': 'not_found'}
+
+    # Posicao na fila e inicio estimado (enquanto houver arquivos aguardando)
+    fila = extraction_scheduler.queue_info(task_id)
+    if fila:
+        data.update(fila)
+
+    # Tempo por etapa: 'timings' por arquivo e p50/p95 da tarefa
+    if data.get('timings'):
+        data['timings_summary'] = resumir_etapas(data['timings'].values())
 
     if extractor:
         data['token_usage'] = extractor.token_usage
     return jsonify(data)
 
 
+# ============================================================
+# PASTA VIGIADA
+# PDFs estaveis dos diretorios configurados entram no mesmo pipeline do
+# /upload-async, em nome de HOT_FOLDER_USER_ID. Cada lote detectado vira uma
+# tarefa listada em /hot-folder/tarefas para revisao e gravacao no banco.
+# ============================================================
+def _sessao_hot_folder(user_id):
+    return f"hotfolder:{user_id}"
+
+
+def _enfileirar_lote_hot_folder(arquivos):
+    """Callback do watcher: copia os PDFs para o temp e abre uma tarefa. Retorna quantos entraram."""
+    user_id = HOT_FOLDER_USER_ID
+    task_id = _iniciar_tarefa_extracao(_sessao_hot_folder(user_id), '', PRIORIDADE_LOTE, f"user:{user_id}",
+                                       extra={'source': 'hot_folder', 'owner_user_id': user_id})
+    aceitos = 0
+    try:
+        for arq in arquivos:
+            # A pasta e do laboratorio: o pipeline trabalha (e apaga) uma copia
+            path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{secure_filename(arq['name'])}")
+            etapas = {}
+            with medir_etapa(etapas, 'file_save', arq['size']):
+                shutil.copyfile(arq['path'], path)
+            if not _enfileirar_pdf_tarefa(task_id, path, arq['name'], contar_total=True, timings=etapas):
+                break
+            aceitos += 1
+    finally:
+        _fechar_tarefa_extracao(task_id)
+    print(f"[HOT-FOLDER] {aceitos} PDF(s) enfileirado(s) -> task {task_id}")
+    return aceitos
+
+
+def _iniciar_hot_folder():
+    global hot_folder_watcher, _hot_folder_trava
+    if not HOT_FOLDER_DIRS or hot_folder_watcher is not None:
+        return
+    if not HOT_FOLDER_USER_ID:
+        print("[HOT-FOLDER] HOT_FOLDER_DIRS definido sem HOT_FOLDER_USER_ID; pasta vigiada desativada")
+        return
+    estado_dir = HOT_FOLDER_STATE_DIR
+    # Com varios workers, so quem pegar a trava vigia as pastas
+    trava = acquire_single_instance_lock(os.path.join(estado_dir, 'metron_hotfolder.lock'))
+    if trava is None:
+        return
+    hot_folder_watcher = HotFolderWatcher(
+        HOT_FOLDER_DIRS, _enfileirar_lote_hot_folder,
+        settle_seconds=float(os.getenv('HOT_FOLDER_SETTLE_SECONDS', 5)),
+        poll_interval=float(os.getenv('HOT_FOLDER_POLL_SECONDS', 10)),
+        state_path=os.path.join(estado_dir, 'metron_hotfolder.json'),
+    )
+    _hot_folder_trava = trava
+    hot_folder_watcher.start()
+    print(f"[HOT-FOLDER] Vigiando {', '.join(HOT_FOLDER_DIRS)} (user_id={HOT_FOLDER_USER_ID})")
+
+
+def _iniciar_jobs_banco():
+    """Jobs periodicos do banco: instrumento_ultima_calibracao, instrumento_busca e
+    migracao de certificados.pdf_content para o blob store (um processo so)"""
+    global latest_calibration_job, search_index_job, cert_blob_job, _jobs_banco_trava
+    intervalo_cal = float(os.getenv('LATEST_CAL_RECONCILE_SECONDS', 300))
+    intervalo_busca = float(os.getenv('SEARCH_INDEX_RECONCILE_SECONDS', 600))
+    intervalo_blob = float(os.getenv('CERT_BLOB_MIGRATE_SECONDS', 0))
+    if _jobs_banco_trava is not None or (intervalo_cal <= 0 and intervalo_busca <= 0 and intervalo_blob <= 0):
+        return
+    trava = acquire_single_instance_lock(os.path.join(tempfile.gettempdir(), 'metron_jobs_banco.lock'))
+    if trava is None:
+        return
+    _jobs_banco_trava = trava
+    if intervalo_cal > 0:
+        latest_calibration_job = LatestCalibrationReconciler(
+            db_pool, interval=intervalo_cal, batch_size=int(os.getenv('LATEST_CAL_BATCH', 1000)),
+        )
+        latest_calibration_job.start()
+    if intervalo_busca > 0:
+        search_index_job = SearchIndexReconciler(
+            db_pool, interval=intervalo_busca, batch_size=int(os.getenv('SEARCH_INDEX_BATCH', 1000)),
+        )
+        search_index_job.start()
+    if intervalo_blob > 0:
+        try:
+            check_migration_target(cert_blob_store)
+        except BlobStoreError as e:
+            print(f"[CERT-BLOB] {e}; CERT_BLOB_MIGRATE_SECONDS ignorado")
+        else:
+            cert_blob_job = CertificateBlobMigrator(
+                db_pool, cert_blob_store, interval=intervalo_blob,
+                batch_size=int(os.getenv('CERT_BLOB_MIGRATE_BATCH', 200)),
+            )
+            cert_blob_job.start()
+
+
+@app.route('/hot-folder/tarefas')
+def hot_folder_tarefas():
+    """Tarefas abertas pela pasta vigiada para o usuario logado (mais recentes primeiro)."""
+    user_id = str(session.get('gocal_user_id') or '')
+    if not HOT_FOLDER_DIRS or not user_id or user_id != str(HOT_FOLDER_USER_ID):
+        return jsonify({'success': True, 'tarefas': [], 'watcher': None})
+
+    # Copia publicada pelo processo do watcher: a lista e a mesma em qualquer worker
+    tarefas = []
+    for task_id, task in task_board.find(session_id=_sessao_hot_folder(user_id)):
+        tarefas.append({
+            'task_id': task_id,
+            'status': task.get('status'),
+            'total': task.get('total', 0),
+            'completed': task.get('completed', 0),
+            'created_at': task.get('created_at'),
+        })
+    tarefas.sort(key=lambda t: t.get('created_at') or 0, reverse=True)
+    return jsonify({
+        'success': True,
+        'tarefas': tarefas,
+        'watcher': hot_folder_watcher.stats() if hot_folder_watcher else None,
+    })
+
+
+def _responder_pdf(abrir, tamanho, digest, nome, cache_control=CACHE_REVALIDATE):
+    """
+    Resposta de PDF em blocos com ETag forte (SHA-256), 304 e Range de um intervalo
+
+    Args:
+        abrir: abrir(inicio, comprimento) -> arquivo binario posicionado em `inicio`
+        tamanho: Tamanho total em bytes
+        digest: SHA-256 do conteudo (ou file_validator() de um arquivo do storage)
+        nome: Nome sugerido ao navegador
+        cache_control: CACHE_IMMUTABLE so para URLs enderecadas por conteudo
+    """
+    etag = strong_etag(digest)
+    cabecalhos = {'ETag': etag, 'Cache-Control': cache_control, 'Accept-Ranges': 'bytes'}
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=cabecalhos)
+
+    faixa = None
+    if request.headers.get('Range') and if_range_allows(request.headers.get('If-Range'), etag):
+        try:
+            faixa = parse_range(request.headers.get('Range'), tamanho)
+        except RangeNotSatisfiable:
+            return Response(status=416, headers={**cabecalhos, 'Content-Range': f'bytes */{tamanho}'})
+
+    inicio, fim = faixa or (0, tamanho - 1)
+    comprimento = max(0, fim - inicio + 1)
+    cabecalhos['Content-Length'] = str(comprimento)
+    cabecalhos['Content-Disposition'] = content_disposition(nome)
+    if faixa:
+        cabecalhos['Content-Range'] = f'bytes {inicio}-{fim}/{tamanho}'
+    corpo = iter_stream(lambda: abrir(inicio, comprimento), comprimento) if comprimento else iter(())
+    return Response(corpo, status=206 if faixa else 200, mimetype='application/pdf',
+                    headers=cabecalhos, direct_passthrough=True)
+
+
+def _abrir_bytes(dados):
+    """abrir() de _responder_pdf para um PDF ja em memoria"""
+    import io
+
+    def abrir(inicio, comprimento):
+        return io.BytesIO(memoryview(dados)[inicio:inicio + comprimento])
+    return abrir
+
+
 @app.route('/lote-pdf/<task_id>/<int:item_idx>')
 def servir_pdf_lote(task_id, item_idx):
     """Serve o PDF original de um item do lote para conferencia antes da gravacao."""
-    import base64
-    import io
-
     task = processing_tasks.get(task_id)
-    if not task:
+    publicada = None if task else _tarefa_publicada(task_id)
+    if not task and not publicada:
         return jsonify({'error': 'Lote nao encontrado'}), 404
 
-    if task.get('session_id') != session.get('session_id'):
+    if not _tarefa_visivel(task or publicada):
         return jsonify({'error': 'Lote indisponivel para esta sessao'}), 403
 
-    results = task.get('results') or []
+    if publicada:
+        results = publicada.get('results') or []
+        info = task_board.pdf_info(publicada, item_idx)
+        origem = task_board
+    else:
+        results = processing_tasks.iter_results(task_id)
+        info = processing_tasks.pdf_info(task_id, item_idx)
+        origem = processing_tasks
     if item_idx < 0 or item_idx >= len(results):
         return jsonify({'error': 'Item do lote nao encontrado'}), 404
 
     item = results[item_idx] or {}
-    pdf_base64 = item.get('_pdf_base64')
-    if not pdf_base64:
+    if not info:
         return jsonify({'error': 'PDF nao disponivel para este item'}), 404
+    digest, tamanho = info
+    # Abre antes de responder: o PDF pode ter saido do store (TTL) desde o pdf_info
+    arquivo = origem.open_pdf(task_id, item_idx)
+    if arquivo is None:
+        return jsonify({'error': 'PDF nao disponivel para este item'}), 404
+    arquivo.close()
 
-    pdf_filename = item.get('_pdf_filename') or f'lote_{item_idx + 1}.pdf'
-    try:
-        pdf_bytes = base64.b64decode(pdf_base64)
-    except Exception:
-        return jsonify({'error': 'PDF invalido'}), 500
+    def abrir(inicio, comprimento):
+        f = origem.open_pdf(task_id, item_idx)
+        if f is None:
+            raise FileNotFoundError(f'{task_id}/{item_idx}')
+        f.seek(inicio)
+        return f
 
-    return send_file(
-        io.BytesIO(pdf_bytes),
-        mimetype='application/pdf',
-        download_name=pdf_filename
-    )
+    pdf_filename = item.get('_pdf_filename') or f'lote_{item_idx + 1}.pdf'
+    return _responder_pdf(abrir, tamanho, digest, pdf_filename)
 
 
 
@@ -1660,6 +2448,329 @@ def normalizar_data(data_str):
         
     return data_str # Retorna original se nao bater
 
+# Itens gravados por transacao no /inserir-banco
+INSERIR_BANCO_LOTE = max(1, int(os.getenv('INSERIR_BANCO_LOTE', 50)))
+
+_SQL_INSERIR_INSTRUMENTO = """
+    INSERT INTO instrumentos (
+        identificacao, nome, fabricante, modelo, numero_serie, descricao,
+        periodicidade, departamento, responsavel, status, tipo_familia,
+        serie_desenv, criticidade, motivo_calibracao, quantidade,
+        user_id, responsavel_cadastro_id, created_at, updated_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+"""
+
+_SQL_INSERIR_CALIBRACAO = """
+    INSERT INTO calibracoes (
+        user_id, responsavel_cadastro_id, instrumento_id,
+        numero_calibracao, sufixo,
+        laboratorio_responsavel, motivo_calibracao,
+        data_calibracao, data_proxima_calibracao,
+        status_calibracao, status_instrumento,
+        created_at, updated_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+"""
+
+_SQL_INSERIR_AUDITORIA = """
+    INSERT INTO logs_auditoria (
+        user_id, funcionario_id, acao, modelo, modelo_id, depois, created_at, updated_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
+"""
+
+_SQL_INSERIR_CERTIFICADO = """
+    INSERT INTO certificados (
+        calibracao_id, arquivo_pdf, nome_original,
+        pdf_content, pdf_in_database,
+        created_at, updated_at
+    ) VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
+"""
+
+_SQL_INSERIR_GRANDEZA = """
+    INSERT INTO grandezas (
+        instrumento_id, servicos, tolerancia_processo, tolerancia_simetrica,
+        unidade, resolucao, criterio_aceitacao, regra_decisao_id,
+        faixa_nominal, classe_norma, classificacao, faixa_uso,
+        created_at, updated_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+"""
+
+
+def _buscar_valor_extraido(chave, dados_json, default=None):
+    """Busca a chave em qualquer nivel do JSON extraido"""
+    if isinstance(dados_json, dict):
+        if chave in dados_json:
+            return dados_json[chave]
+        for v in dados_json.values():
+            res = _buscar_valor_extraido(chave, v, default=None)
+            if res is not None:
+                return res
+    return default
+
+
+def _chave_calibracao(instrumento_id, numero, data):
+    """Chave de duplicidade (instrumento, certificado, data); None quando o SQL nunca casaria (NULL)"""
+    if numero is None or data is None:
+        return None
+    return (instrumento_id, ci_key(numero), str(data))
+
+
+def _prebuscar_existentes(cursor, user_id, identificacoes):
+    """
+    Instrumentos do usuario com essas identificacoes e as calibracoes deles
+
+    Returns:
+        ({ci_key(identificacao): instrumento_id}, {(instrumento_id, ci_key(numero), 'AAAA-MM-DD')})
+    """
+    existentes = {}
+    for identificacao, instrumento_id in fetch_in(
+            cursor, EXISTING_INSTRUMENTS_SQL, identificacoes, params=(user_id,)):
+        existentes.setdefault(ci_key(identificacao), instrumento_id)
+    calibracoes = set()
+    for instrumento_id, numero, data in fetch_in(
+            cursor, EXISTING_CALIBRATIONS_SQL, sorted(set(existentes.values()))):
+        chave = _chave_calibracao(instrumento_id, numero, data)
+        if chave:
+            calibracoes.add(chave)
+    return existentes, calibracoes
+
+
+def _atualizar_projecoes(conn, cursor, resultados_lote):
+    """
+    Ultima calibracao e texto de busca do lote ja gravado, cada um na sua transacao
+
+    Falha aqui (ex.: deadlock com a reconciliacao, que escreve nas mesmas
+    tabelas) nao desfaz os itens do lote; a reconciliacao periodica corrige.
+    """
+    for nome, atualizar, ids in (
+        ('ultima calibracao', refresh_latest_calibrations,
+         [r['instrumento_id'] for r in resultados_lote if r.get('calibracao_id')]),
+        ('indice de busca', refresh_search_index,
+         [r['instrumento_id'] for r in resultados_lote if r['status'] == 'inserido']),
+    ):
+        if not ids:
+            continue
+        try:
+            atualizar(cursor, ids)
+            conn.commit()
+        except Exception as e:
+            print(f"[AVISO] Falha ao atualizar {nome} (a reconciliacao corrige): {e}")
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+
+
+def _linha_certificado(calibracao_id, inst):
+    """
+    Linha de certificados para o PDF do item (None se o item nao trouxe PDF)
+
+    O PDF vai para o blob store (chave = SHA-256, o mesmo arquivo em varias
+    calibracoes e gravado uma vez) e a linha guarda so a chave em arquivo_pdf.
+    Se o Laravel nao consegue ler o store (object store, pasta inexistente)
+    ou a gravacao falhar, o base64 continua no banco como antes, com o nome
+    antigo em arquivo_pdf (a migracao troca pela chave quando mover o PDF).
+    """
+    import base64
+    pdf_base64 = inst.get('_pdf_base64')
+    if not (calibracao_id and pdf_base64):
+        return None
+    pdf_filename = inst.get('_pdf_filename', 'certificado.pdf')
+    if _blob_store_legivel_laravel():
+        try:
+            chave = cert_blob_store.put(base64.b64decode(pdf_base64))
+            return (calibracao_id, chave, pdf_filename, None, 0)
+        except Exception as e_pdf:
+            print(f"[AVISO] PDF da calibracao #{calibracao_id} fica no banco ({e_pdf})")
+    hash_name = hashlib.md5(f"{time.time()}_{pdf_filename}".encode()).hexdigest()
+    return (calibracao_id, f"certificados/{hash_name}.pdf", pdf_filename, pdf_base64, 1)
+
+
+def _blob_store_legivel_laravel():
+    """O Laravel acha o PDF por arquivo_pdf no store (pode tirar o base64 do banco)"""
+    try:
+        check_migration_target(cert_blob_store)
+        return True
+    except BlobStoreError:
+        return False
+
+
+def _linhas_grandezas(inst):
+    """Valores de grandezas do item, sem o instrumento_id (mapeados antes de gravar qualquer coisa)"""
+    # Tenta pegar direto da chave 'grandezas' ou 'tabelas'
+    lista_grandezas = _buscar_valor_extraido('grandezas', inst) or _buscar_valor_extraido('tabelas', inst) or []
+    if not isinstance(lista_grandezas, list):
+        return []
+
+    linhas = []
+    for grandeza in lista_grandezas:
+        if not isinstance(grandeza, dict):
+            continue
+
+        def get_g(key, default=None):
+            # Tenta direto, depois um nivel abaixo. O default so vale para valor ausente:
+            # tolerancia_simetrica=False e regra_decisao_id=0 sao gravados como vieram
+            val = grandeza.get(key)
+            if val is None:
+                for k, v in grandeza.items():
+                    if isinstance(v, dict) and key in v:
+                        val = v[key]
+                        break
+            return default if val is None else val
+
+        linhas.append((
+            json.dumps(get_g('servicos', []) if isinstance(get_g('servicos'), list) else []),
+            get_g('tolerancia_processo') or get_g('tolerancia') or get_g('erro_maximo'),
+            get_g('tolerancia_simetrica', True),
+            get_g('unidade'),
+            get_g('resolucao'),
+            get_g('criterio_aceitacao'),
+            get_g('regra_decisao_id', 1),
+            get_g('faixa_nominal') or get_g('faixa') or get_g('valor_nominal'),
+            get_g('classe_norma'),
+            get_g('classificacao'),
+            get_g('faixa_uso')
+        ))
+    return linhas
+
+
+def _gravar_item_banco(cursor, escrita, inst, identificacao, user_id, funcionario_id,
+                       existentes, calibracoes_existentes):
+    """
+    Grava um item extraido: INSERT direto so de instrumento e calibracao (precisam do id);
+    auditoria, certificado e grandezas vao para o BatchWriter.
+    Atualiza os mapas da pre-busca para itens repetidos no mesmo envio, so
+    no fim (um item que falha no meio nao deixa chave de algo desfeito).
+
+    Returns:
+        dict com status 'inserido', 'calibracao_adicionada' ou 'ignorado' e os dados da calibracao
+    """
+    buscar_valor = _buscar_valor_extraido
+    instrumento_id_existente = existentes.get(ci_key(identificacao))
+
+    if instrumento_id_existente:
+        # Extrai dados da calibração do PDF
+        data_calib_dup = buscar_valor('data_calibracao', inst)
+        # PRIORIDADE TOTAL para numero_certificado
+        numero_cert_dup = _resolver_numero_certificado_extraido(inst, identificacao)
+        laboratorio_dup = buscar_valor('laboratorio', inst) or buscar_valor('laboratorio_responsavel', inst) or 'N/I'
+        validade_dup = buscar_valor('validade', inst) or buscar_valor('data_proxima_calibracao', inst)
+        motivo_dup = buscar_valor('motivo_calibracao', inst, 'Calibração Periódica') or 'Calibração Periódica'
+        status_dup = normalizar_status(buscar_valor('status', inst)) or 'Em Revisão'
+
+        # Ja existe calibração com mesmo número de certificado E mesma data?
+        chave = _chave_calibracao(instrumento_id_existente, numero_cert_dup, normalizar_data(data_calib_dup))
+        if chave in calibracoes_existentes:
+            return {'status': 'ignorado', 'instrumento_id': instrumento_id_existente}
+
+        # Instrumento existe mas calibração é nova: insere só a calibração
+        cursor.execute(_SQL_INSERIR_CALIBRACAO, (
+            user_id, user_id, instrumento_id_existente,
+            numero_cert_dup, '',
+            laboratorio_dup, motivo_dup,
+            normalizar_data(data_calib_dup), normalizar_data(validade_dup),
+            'Em Revisão', status_dup
+        ))
+        calibracao_id_dup = cursor.lastrowid
+        linha_cert = _linha_certificado(calibracao_id_dup, inst)
+        if linha_cert:
+            escrita.add(_SQL_INSERIR_CERTIFICADO, linha_cert)
+        if chave:
+            calibracoes_existentes.add(chave)
+        return {
+            'status': 'calibracao_adicionada',
+            'instrumento_id': instrumento_id_existente,
+            'calibracao_id': calibracao_id_dup,
+            'numero_calibracao': numero_cert_dup,
+            'data_calibracao': data_calib_dup,
+            'laboratorio_responsavel': laboratorio_dup,
+            'motivo_calibracao': motivo_dup
+        }
+
+    # Mapeia campos principais procurando recursivamente ou usando defaults
+    # Campos que nao podem ser NULL recebem 'N/I' (Nao Informado)
+    nome = buscar_valor('nome', inst) or buscar_valor('instrumento', inst) or buscar_valor('titulo', inst) or 'N/I'
+    fabricante = buscar_valor('fabricante', inst) or 'N/I'
+    modelo = buscar_valor('modelo', inst) or 'N/I'
+    numero_serie = buscar_valor('numero_serie', inst) or buscar_valor('serie', inst) or 'N/I'
+    descricao = buscar_valor('descricao', inst) or json.dumps(inst, ensure_ascii=False)[:500]
+    periodicidade = buscar_valor('periodicidade', inst, 12)
+    departamento = buscar_valor('departamento', inst) or ''
+    responsavel = buscar_valor('responsavel', inst) or ''
+    # Default Status Instrumento: "Em Revisão"
+    status = normalizar_status(buscar_valor('status', inst)) or 'Em Revisão'
+    tipo_familia = buscar_valor('tipo_familia', inst) or buscar_valor('tipo_documento', inst) or 'N/I'
+    serie_desenv = buscar_valor('serie_desenv', inst) or buscar_valor('desenho', inst) or 'N/I'
+    criticidade = buscar_valor('criticidade', inst) or 'N/I'
+    motivo_calibracao = buscar_valor('motivo_calibracao', inst, 'Calibração Periódica') or 'Calibração Periódica'
+
+    data_calib = normalizar_data(buscar_valor('data_calibracao', inst))
+    # PRIORIDADE TOTAL para numero_certificado na calibração
+    numero_cert = _resolver_numero_certificado_extraido(inst, identificacao)
+    laboratorio = buscar_valor('laboratorio', inst) or buscar_valor('laboratorio_responsavel', inst) or 'N/I'
+    validade = normalizar_data(buscar_valor('validade', inst) or buscar_valor('data_proxima_calibracao', inst))
+    grandezas = _linhas_grandezas(inst)
+
+    cursor.execute(_SQL_INSERIR_INSTRUMENTO, (
+        identificacao, nome, fabricante, modelo, numero_serie, descricao,
+        periodicidade, departamento, responsavel, status, tipo_familia,
+        serie_desenv, criticidade, motivo_calibracao, 1,
+        user_id, user_id
+    ))
+    instrumento_id = cursor.lastrowid
+    escrita.add(_SQL_INSERIR_AUDITORIA, (
+        user_id, funcionario_id, 'criado', 'Instrumento', instrumento_id,
+        json.dumps({'identificacao': identificacao, 'nome': nome, 'status': status,
+                    'user_id': user_id, 'id': instrumento_id}, default=str)
+    ))
+
+    # Cria calibracao automaticamente (se falhar, o instrumento fica sem calibracao nenhuma)
+    chave = None
+    cursor.execute("SAVEPOINT calibracao_banco")
+    marca = escrita.mark()
+    try:
+        cursor.execute(_SQL_INSERIR_CALIBRACAO, (
+            user_id, user_id, instrumento_id,
+            numero_cert, '',
+            laboratorio, motivo_calibracao,
+            data_calib, validade,
+            'Em Revisão', status
+        ))
+        calibracao_id = cursor.lastrowid
+        chave = _chave_calibracao(instrumento_id, numero_cert, data_calib)
+        escrita.add(_SQL_INSERIR_AUDITORIA, (
+            user_id, funcionario_id, 'criado', 'Calibracao', calibracao_id,
+            json.dumps({'instrumento_id': instrumento_id, 'numero_calibracao': numero_cert,
+                        'status_calibracao': 'Em Revisão', 'user_id': user_id, 'id': calibracao_id}, default=str)
+        ))
+        # PDF fisico na tabela certificados (igual ao Gocal Laravel)
+        linha_cert = _linha_certificado(calibracao_id, inst)
+        if linha_cert:
+            escrita.add(_SQL_INSERIR_CERTIFICADO, linha_cert)
+    except Exception as e_cal:
+        cursor.execute("ROLLBACK TO SAVEPOINT calibracao_banco")
+        escrita.rollback_to(marca)
+        calibracao_id, chave = None, None
+        print(f"[AVISO] Erro ao criar calibracao para instrumento #{instrumento_id}: {e_cal}")
+
+    for linha in grandezas:
+        escrita.add(_SQL_INSERIR_GRANDEZA, (instrumento_id,) + linha)
+
+    existentes[ci_key(identificacao)] = instrumento_id
+    if chave:
+        calibracoes_existentes.add(chave)
+
+    return {
+        'status': 'inserido',
+        'instrumento_id': instrumento_id,
+        'calibracao_id': calibracao_id,
+        'numero_calibracao': numero_cert,
+        'data_calibracao': data_calib,
+        'laboratorio_responsavel': laboratorio,
+        'motivo_calibracao': motivo_calibracao,
+        'grandezas': len(grandezas)
+    }
+
+
 @app.route('/inserir-banco', methods=['POST'])
 def inserir_banco():
     """Insere instrumentos extraidos no MySQL"""
@@ -1680,348 +2791,120 @@ def inserir_banco():
         
         # Fallback para cache apenas se tiver sessao valida
         if not instrumentos and session_id:
-             instrumentos = extracted_cache.get(session_id, [])
+             # Copia decodificada: o loop abaixo altera os dicts
+             instrumentos = list(extracted_cache.get(session_id, []))
 
         if not instrumentos:
             return jsonify({'success': False, 'message': 'Nenhum instrumento para inserir.'}), 400
 
-        # Se veio task_id (lote), mescla o _pdf_base64 do cache do servidor
+        # Se veio task_id (lote), mescla o PDF guardado no JobStore
         task_id = data.get('task_id')
-        if task_id and task_id in processing_tasks:
-            cached_results = processing_tasks[task_id].get('results', [])
+        # A tarefa pode ter rodado em outro worker (ou no processo da pasta vigiada)
+        publicada = _tarefa_publicada(task_id) if task_id else None
+        if task_id and (publicada or task_id in processing_tasks):
+            import base64
+            if publicada:
+                cached_results, origem = publicada.get('results') or [], task_board
+            else:
+                cached_results, origem = processing_tasks.iter_results(task_id), processing_tasks
             for i, inst in enumerate(instrumentos):
                 if isinstance(inst, dict) and i < len(cached_results):
                     cached = cached_results[i]
                     if isinstance(cached, dict):
-                        if '_pdf_base64' in cached and '_pdf_base64' not in inst:
-                            inst['_pdf_base64'] = cached['_pdf_base64']
+                        if '_pdf_base64' not in inst:
+                            pdf_bytes = origem.get_pdf(task_id, i)
+                            if pdf_bytes:
+                                inst['_pdf_base64'] = base64.b64encode(pdf_bytes).decode('utf-8')
                         if '_pdf_filename' in cached and '_pdf_filename' not in inst:
                             inst['_pdf_filename'] = cached['_pdf_filename']
             print(f"[DB] PDFs base64 mesclados do cache da task {task_id}")
 
         print(f"[DB] Inserindo {len(instrumentos)} instrumento(s) (user_id={user_id})")
 
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-
-        total_inseridos = 0
-        total_ignorados = 0
-        total_grandezas = 0
-        total_calibracoes_adicionadas = 0
-        instrumentos_inseridos = []  # Para retornar IDs e dados de calibracao
-
-        for inst in instrumentos:
+        # JSON em string vira dict; a identificacao e resolvida uma vez por item
+        itens = []
+        for indice, inst in enumerate(instrumentos):
             if isinstance(inst, str):
                 try:
                     inst = json.loads(inst)
                 except:
                     print(f"[AVISO] Item ignorado nao e JSON valido: {inst}")
                     continue
-            
             if not isinstance(inst, dict):
                 continue
-
-            # Funcao auxiliar para buscar valor em qualquer nivel do JSON
-            def buscar_valor(chave, dados_json, default=None):
-                if isinstance(dados_json, dict):
-                    if chave in dados_json:
-                        return dados_json[chave]
-                    for v in dados_json.values():
-                        res = buscar_valor(chave, v, default=None)
-                        if res is not None:
-                            return res
-                return default
-
-            # Mantem os aliases antigos e acrescenta os desse layout de gabarito
-            identificacao = _resolver_identificacao_extraida(inst)
-
-            # Verifica se instrumento já existe
-            cursor.execute(
-                "SELECT id FROM instrumentos WHERE identificacao = %s AND user_id = %s LIMIT 1",
-                (identificacao, user_id)
-            )
-            existente = cursor.fetchone()
-            if existente:
-                instrumento_id_existente = existente[0]
-                # Extrai dados da calibração do PDF
-                data_calib_dup = buscar_valor('data_calibracao', inst)
-                # PRIORIDADE TOTAL para numero_certificado
-                numero_cert_dup = _resolver_numero_certificado_extraido(inst, identificacao)
-                
-                print(f"[DEBUG] Extraido para calibração: cert={numero_cert_dup}, tag={identificacao}")
-
-                laboratorio_dup = buscar_valor('laboratorio', inst) or buscar_valor('laboratorio_responsavel', inst) or 'N/I'
-                validade_dup = buscar_valor('validade', inst) or buscar_valor('data_proxima_calibracao', inst)
-                motivo_dup = buscar_valor('motivo_calibracao', inst, 'Calibração Periódica') or 'Calibração Periódica'
-                status_dup = normalizar_status(buscar_valor('status', inst)) or 'Em Revisão'
-
-                # Verifica se já existe calibração com mesmo número de certificado E mesma data
-                print(f"[DEBUG] Instrumento existente id={instrumento_id_existente}, numero_cert='{numero_cert_dup}', data_calib='{data_calib_dup}'")
-                cursor.execute(
-                    "SELECT id FROM calibracoes WHERE instrumento_id = %s AND numero_calibracao = %s AND data_calibracao = %s LIMIT 1",
-                    (instrumento_id_existente, numero_cert_dup, data_calib_dup)
-                )
-                dup_calib = cursor.fetchone()
-                print(f"[DEBUG] Calibracao duplicada encontrada: {dup_calib}")
-                if dup_calib:
-                    total_ignorados += 1
-                    continue
-
-                # Instrumento existe mas calibração é nova Ã¢â‚¬â€ insere só a calibração
-                try:
-                    sql_cal_dup = """
-                        INSERT INTO calibracoes (
-                            user_id, responsavel_cadastro_id, instrumento_id,
-                            numero_calibracao, sufixo,
-                            laboratorio_responsavel, motivo_calibracao,
-                            data_calibracao, data_proxima_calibracao,
-                            status_calibracao, status_instrumento,
-                            created_at, updated_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                    """
-                    cursor.execute(sql_cal_dup, (
-                        user_id, user_id, instrumento_id_existente,
-                        numero_cert_dup, '',
-                        laboratorio_dup, motivo_dup,
-                        normalizar_data(data_calib_dup), normalizar_data(validade_dup),
-                        'Em Revisão', status_dup
-                    ))
-                    calibracao_id_dup = cursor.lastrowid
-                    print(f"[DB] Calibracao #{calibracao_id_dup} adicionada ao instrumento existente #{instrumento_id_existente}")
-
-                    # Salva PDF se existir
-                    pdf_base64_dup = inst.get('_pdf_base64')
-                    pdf_filename_dup = inst.get('_pdf_filename', 'certificado.pdf')
-                    if calibracao_id_dup and pdf_base64_dup:
-                        try:
-                            import hashlib, time
-                            hash_name = hashlib.md5(f"{time.time()}_{pdf_filename_dup}".encode()).hexdigest()
-                            cursor.execute("""
-                                INSERT INTO certificados (
-                                    calibracao_id, arquivo_pdf, nome_original,
-                                    pdf_content, pdf_in_database,
-                                    created_at, updated_at
-                                ) VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
-                            """, (calibracao_id_dup, f"certificados/{hash_name}.pdf", pdf_filename_dup, pdf_base64_dup, 1))
-                        except Exception as e_pdf_dup:
-                            print(f"[AVISO] Erro ao salvar PDF para calibracao #{calibracao_id_dup}: {e_pdf_dup}")
-
-                    instrumentos_inseridos.append({
-                        'instrumento_id': instrumento_id_existente,
-                        'calibracao_id': calibracao_id_dup,
-                        'numero_calibracao': numero_cert_dup,
-                        'data_calibracao': data_calib_dup,
-                        'laboratorio_responsavel': laboratorio_dup,
-                        'motivo_calibracao': motivo_dup
-                    })
-                    total_calibracoes_adicionadas += 1
-                except Exception as e_cal_dup:
-                    print(f"[AVISO] Erro ao adicionar calibracao a instrumento existente: {e_cal_dup}")
-                    total_ignorados += 1
-                continue
-            
-            # Mapeia campos principais procurando recursivamente ou usando defaults
-            # Campos que nao podem ser NULL recebem 'N/I' (Nao Informado)
-            nome = buscar_valor('nome', inst) or buscar_valor('instrumento', inst) or buscar_valor('titulo', inst) or 'N/I'
-            fabricante = buscar_valor('fabricante', inst) or 'N/I'
-            modelo = buscar_valor('modelo', inst) or 'N/I'
-            numero_serie = buscar_valor('numero_serie', inst) or buscar_valor('serie', inst) or 'N/I'
-            descricao = buscar_valor('descricao', inst) or json.dumps(inst, ensure_ascii=False)[:500]
-            periodicidade = buscar_valor('periodicidade', inst, 12)
-            departamento = buscar_valor('departamento', inst) or ''
-            responsavel = buscar_valor('responsavel', inst) or ''
-            # Default Status Instrumento: "Em Revisão"
-            status = normalizar_status(buscar_valor('status', inst)) or 'Em Revisão'
-            tipo_familia = buscar_valor('tipo_familia', inst) or buscar_valor('tipo_documento', inst) or 'N/I'
-            serie_desenv = buscar_valor('serie_desenv', inst) or buscar_valor('desenho', inst) or 'N/I'
-            criticidade = buscar_valor('criticidade', inst) or 'N/I'
-            motivo_calibracao = buscar_valor('motivo_calibracao', inst, 'Calibração Periódica') or 'Calibração Periódica'
-            # quantidade = buscar_valor('quantidade', inst, 1)
-
-            sql = """
-                INSERT INTO instrumentos (
-                    identificacao, nome, fabricante, modelo, numero_serie, descricao,
-                    periodicidade, departamento, responsavel, status, tipo_familia,
-                    serie_desenv, criticidade, motivo_calibracao, quantidade,
-                    user_id, responsavel_cadastro_id, created_at, updated_at
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-            """
-
-            valores = (
-                identificacao, nome, fabricante, modelo, numero_serie, descricao,
-                periodicidade, departamento, responsavel, status, tipo_familia,
-                serie_desenv, criticidade, motivo_calibracao, 1,
-                user_id, user_id
-            )
-
-            cursor.execute(sql, valores)
-            instrumento_id = cursor.lastrowid
-            total_inseridos += 1
-            
-            # --- LOG AUDITORIA (Instrumento) ---
-            try:
-                sql_audit = """
-                    INSERT INTO logs_auditoria (
-                        user_id, funcionario_id, acao, modelo, modelo_id, depois, created_at, updated_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
-                """
-                # Serializa dados para JSON (depois)
-                dados_inst = {
-                    'identificacao': identificacao, 'nome': nome, 'status': status,
-                    'user_id': user_id, 'id': instrumento_id
-                }
-                cursor.execute(sql_audit, (
-                    user_id, funcionario_id, 'criado', 'Instrumento', instrumento_id, json.dumps(dados_inst, default=str)
-                ))
-            except Exception as e_audit:
-                print(f"[AVISO] Erro ao criar log auditoria instrumento: {e_audit}")
-
-            # Cria calibracao automaticamente
-            data_calib = normalizar_data(buscar_valor('data_calibracao', inst))
-            data_emissao = normalizar_data(buscar_valor('data_emissao', inst))
-            
-            # PRIORIDADE TOTAL para numero_certificado na calibração
-            numero_cert = _resolver_numero_certificado_extraido(inst, identificacao)
-            
-            print(f"[DEBUG] Nova calibração: cert={numero_cert}, inst={identificacao}")
-            laboratorio = buscar_valor('laboratorio', inst) or buscar_valor('laboratorio_responsavel', inst) or 'N/I'
-            validade = normalizar_data(buscar_valor('validade', inst) or buscar_valor('data_proxima_calibracao', inst))
-
-            try:
-                sql_cal = """
-                    INSERT INTO calibracoes (
-                        user_id, responsavel_cadastro_id, instrumento_id,
-                        numero_calibracao, sufixo,
-                        laboratorio_responsavel, motivo_calibracao,
-                        data_calibracao, data_proxima_calibracao,
-                        status_calibracao, status_instrumento,
-                        created_at, updated_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                """
-                valores_cal = (
-                    user_id, user_id, instrumento_id,
-                    numero_cert, '',
-                    laboratorio, motivo_calibracao,
-                    data_calib, validade,
-                    'Em Revisão', status
-                )
-                cursor.execute(sql_cal, valores_cal)
-                calibracao_id = cursor.lastrowid
-                print(f"[DB] Calibracao #{calibracao_id} criada para instrumento #{instrumento_id}")
-                
-                 # --- LOG AUDITORIA (Calibracao) ---
-                try:
-                    dados_cal = {
-                        'instrumento_id': instrumento_id, 'numero_calibracao': numero_cert,
-                        'status_calibracao': 'Em Revisão', 'user_id': user_id, 'id': calibracao_id
-                    }
-                    cursor.execute(sql_audit, (
-                        user_id, funcionario_id, 'criado', 'Calibracao', calibracao_id, json.dumps(dados_cal, default=str)
-                    ))
-                except Exception as e_audit:
-                    print(f"[AVISO] Erro ao criar log auditoria calibracao: {e_audit}")
-
-                # Salva o PDF fisico na tabela certificados (igual ao Gocal Laravel)
-                pdf_base64 = inst.get('_pdf_base64')
-                pdf_filename = inst.get('_pdf_filename', 'certificado.pdf')
-                if calibracao_id and pdf_base64:
+            itens.append((indice, inst, _resolver_identificacao_extraida(inst)))
+
+        resultados = []
+        total_lotes = 0
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            escrita = BatchWriter(cursor)
+
+            # Instrumentos ja cadastrados e suas calibracoes: uma consulta cada para o lote todo
+            existentes, calibracoes_existentes = _prebuscar_existentes(cursor, user_id, [i[2] for i in itens])
+
+            # Commit a cada INSERIR_BANCO_LOTE itens: transacoes curtas e falha restrita ao lote
+            for lote in chunked(itens, INSERIR_BANCO_LOTE):
+                total_lotes += 1
+                resultados_lote = []
+                for indice, inst, identificacao in lote:
+                    # Savepoint por item: o que um item com erro ja gravou nao entra no commit do lote
+                    cursor.execute("SAVEPOINT item_banco")
+                    marca = escrita.mark()
                     try:
-                        import hashlib, time
-                        hash_name = hashlib.md5(f"{time.time()}_{pdf_filename}".encode()).hexdigest()
-                        arquivo_path = f"certificados/{hash_name}.pdf"
-                        
-                        sql_cert = """
-                            INSERT INTO certificados (
-                                calibracao_id, arquivo_pdf, nome_original,
-                                pdf_content, pdf_in_database,
-                                created_at, updated_at
-                            ) VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
-                        """
-                        cursor.execute(sql_cert, (
-                            calibracao_id, arquivo_path, pdf_filename,
-                            pdf_base64, 1
-                        ))
-                        print(f"[DB] Certificado PDF salvo para calibracao #{calibracao_id} ({pdf_filename})")
-                    except Exception as e_pdf:
-                        print(f"[AVISO] Erro ao salvar PDF para calibracao #{calibracao_id}: {e_pdf}")
-                        
-            except Exception as e_cal:
-                calibracao_id = None
-                print(f"[AVISO] Erro ao criar calibracao para instrumento #{instrumento_id}: {e_cal}")
-
-            instrumentos_inseridos.append({
-                'instrumento_id': instrumento_id,
-                'calibracao_id': calibracao_id,
-                'numero_calibracao': numero_cert,
-                'data_calibracao': data_calib,
-                'laboratorio_responsavel': laboratorio,
-                'motivo_calibracao': motivo_calibracao
-            })
+                        resultado = _gravar_item_banco(
+                            cursor, escrita, inst, identificacao, user_id, funcionario_id,
+                            existentes, calibracoes_existentes
+                        )
+                    except Exception as e_item:
+                        print(f"[AVISO] Erro ao gravar item {indice} ({identificacao}): {e_item}")
+                        cursor.execute("ROLLBACK TO SAVEPOINT item_banco")
+                        escrita.rollback_to(marca)
+                        resultado = {'status': 'erro', 'erro': str(e_item)}
+                    resultado.update(indice=indice, identificacao=identificacao)
+                    resultados_lote.append(resultado)
 
-            # Busca grandezas (Simplificado como solicitado)
-            # Tenta pegar direto da chave 'grandezas' ou 'tabelas'
-            lista_grandezas = buscar_valor('grandezas', inst) or buscar_valor('tabelas', inst) or []
-            
-            if not isinstance(lista_grandezas, list):
-                lista_grandezas = []
-
-            for grandeza in lista_grandezas:
-                # Mapeia campos da grandeza 
-                def get_g(key, default=None):
-                    # Tenta direto, depois tenta recursivo se for dict
-                    val = grandeza.get(key)
-                    if val is None and isinstance(grandeza, dict):
-                         # Pequeno helper local para buscar em profundidade rasa
-                         for k, v in grandeza.items():
-                             if isinstance(v, dict) and key in v:
-                                 return v[key]
-                    return val or default
-
-                sql_g = """
-                    INSERT INTO grandezas (
-                        instrumento_id, servicos, tolerancia_processo, tolerancia_simetrica,
-                        unidade, resolucao, criterio_aceitacao, regra_decisao_id,
-                        faixa_nominal, classe_norma, classificacao, faixa_uso,
-                        created_at, updated_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                """
-                
-                tolerancia = get_g('tolerancia_processo') or get_g('tolerancia') or get_g('erro_maximo')
-                unidade = get_g('unidade')
-                resolucao = get_g('resolucao')
-                faixa_nominal = get_g('faixa_nominal') or get_g('faixa') or get_g('valor_nominal')
-
-                
-                valores_g = (
-                    instrumento_id,
-                    json.dumps(get_g('servicos', []) if isinstance(get_g('servicos'), list) else []),
-                    tolerancia,
-                    get_g('tolerancia_simetrica', True),
-                    unidade,
-                    resolucao,
-                    get_g('criterio_aceitacao'),
-                    get_g('regra_decisao_id', 1),
-                    faixa_nominal,
-                    get_g('classe_norma'),
-                    get_g('classificacao'),
-                    get_g('faixa_uso')
-                )
-                cursor.execute(sql_g, valores_g)
-                total_grandezas += 1
+                try:
+                    escrita.flush()
+                    conn.commit()
+                except Exception as e_lote:
+                    print(f"[ERRO] Lote {total_lotes} desfeito: {e_lote}")
+                    conn.rollback()
+                    escrita.discard()
+                    for r in resultados_lote:
+                        if r['status'] != 'ignorado':
+                            r.update(status='erro', erro=f'Lote desfeito: {e_lote}')
+                    # O rollback tambem desfaz o que a pre-busca registrou para esse lote
+                    existentes, calibracoes_existentes = _prebuscar_existentes(cursor, user_id, [i[2] for i in itens])
+                else:
+                    _atualizar_projecoes(conn, cursor, resultados_lote)
+                resultados.extend(resultados_lote)
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+            cursor.close()
 
         # Limpa cache
-        if session_id in extracted_cache:
-            del extracted_cache[session_id]
+        if session_id:
+            extracted_cache.delete(session_id)
+
+        total_inseridos = sum(1 for r in resultados if r['status'] == 'inserido')
+        total_calibracoes_adicionadas = sum(1 for r in resultados if r['status'] == 'calibracao_adicionada')
+        total_ignorados = sum(1 for r in resultados if r['status'] == 'ignorado')
+        total_grandezas = sum(r.get('grandezas', 0) for r in resultados if r['status'] == 'inserido')
+        erros = [{'indice': r['indice'], 'identificacao': r['identificacao'], 'erro': r['erro']}
+                 for r in resultados if r['status'] == 'erro']
+        instrumentos_inseridos = [
+            {k: r.get(k) for k in ('instrumento_id', 'calibracao_id', 'numero_calibracao', 'data_calibracao',
+                                   'laboratorio_responsavel', 'motivo_calibracao')}
+            for r in resultados if r['status'] in ('inserido', 'calibracao_adicionada')
+        ]
 
         msg = f'Inseridos {total_inseridos} instrumento(s)!'
         if total_calibracoes_adicionadas > 0:
             msg += f' ({total_calibracoes_adicionadas} calibração(ões) adicionada(s) a instrumento(s) existente(s))'
         if total_ignorados > 0:
             msg += f' ({total_ignorados} duplicata(s) ignorada(s))'
+        if erros:
+            msg += f' ({len(erros)} item(ns) com erro)'
 
         return jsonify({
             'success': True,
@@ -2030,7 +2913,9 @@ def inserir_banco():
             'ignorados': total_ignorados,
             'calibracoes_adicionadas': total_calibracoes_adicionadas,
             'grandezas': total_grandezas,
-            'instrumentos_inseridos': instrumentos_inseridos
+            'instrumentos_inseridos': instrumentos_inseridos,
+            'erros': erros,
+            'lotes': total_lotes
         })
 
     except mysql.connector.Error as e:
@@ -2042,71 +2927,222 @@ def inserir_banco():
         return jsonify({'success': False, 'message': f'Erro: {str(e)}'}), 500
 
 
+_LISTA_INSTRUMENTOS_MAX = 500
+
+
 @app.route('/listar-instrumentos', methods=['GET'])
 @app.route('/api/instrumentos', methods=['GET'])
 def listar_instrumentos():
-    """Lista instrumentos do banco de dados"""
+    """Lista instrumentos do banco de dados
+
+    Paginacao por chave: ?limite=N&cursor=<next_cursor da pagina anterior>.
+    limite vai ate _LISTA_INSTRUMENTOS_MAX: a resposta traz o limite aplicado
+    (e limite_maximo quando o pedido foi cortado) e next_cursor se ha mais.
+    ?ordenar=campo ou -campo (padrao -created_at), ?fields=id,nome,... limita
+    as colunas e ?total=1 devolve total_geral. Sempre 2 consultas por pagina
+    (instrumentos + primeira grandeza de todos eles), mais o COUNT se pedido.
+    """
     try:
         user_id = request.args.get('user_id', 1, type=int)
-        limite = request.args.get('limite', 100, type=int)
+        limite_pedido = request.args.get('limite', 100, type=int)
+        limite = max(1, min(limite_pedido, _LISTA_INSTRUMENTOS_MAX))
+        campos = parse_fields(request.args.get('fields', ''), LIST_FIELDS, LIST_FIELDS)
+        sql, params, campo_ordem, expr = instrument_list_query(
+            user_id, campos, request.args.get('ordenar', ''), limite, request.args.get('cursor', ''))
+
+        with db_pool.connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(sql, params)
+            instrumentos = cursor.fetchall()
+
+            total_geral = None
+            if is_truthy_filter(request.args.get('total')):
+                cursor.execute(LIST_COUNT_SQL, (user_id,))
+                total_geral = cursor.fetchone()['total']
+
+            tem_mais = len(instrumentos) > limite
+            instrumentos = instrumentos[:limite]
+            next_cursor = None
+            if tem_mais:
+                ultimo = instrumentos[-1]
+                valor = ultimo.get(expr)
+                if hasattr(valor, 'strftime'):
+                    valor = valor.strftime('%Y-%m-%d %H:%M:%S')
+                next_cursor = encode_cursor([campo_ordem, valor, ultimo['id']])
+
+            # Primeira grandeza de todos os instrumentos da pagina em uma consulta
+            grandezas = {}
+            if 'grandezas' in campos and instrumentos:
+                ids = [inst['id'] for inst in instrumentos]
+                cursor.execute(FIRST_GRANDEZA_SQL.format(marcadores=', '.join(['%s'] * len(ids))), ids)
+                for row in cursor.fetchall():
+                    grandezas[row.pop('instrumento_id')] = row
+
+            cursor.close()
 
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
+        for inst in instrumentos:
+            if expr not in campos:
+                inst.pop(expr, None)
+            criado = inst.get('created_at')
+            if 'created_at' in campos and criado:
+                inst['data_calibracao'] = criado.strftime('%d/%m/%Y')
+                inst['created_at'] = criado.strftime('%Y-%m-%d %H:%M:%S')
+            elif 'created_at' not in campos:
+                inst.pop('created_at', None)
+            if inst['id'] in grandezas:
+                inst['grandezas'] = [grandezas[inst['id']]]
+            if 'id' not in campos:
+                inst.pop('id', None)
+
+        resposta = {
+            'success': True,
+            'total': len(instrumentos),
+            'instrumentos': instrumentos,
+            'limite': limite,
+            'next_cursor': next_cursor
+        }
+        if limite_pedido > _LISTA_INSTRUMENTOS_MAX:
+            resposta['limite_maximo'] = _LISTA_INSTRUMENTOS_MAX
+        if total_geral is not None:
+            resposta['total_geral'] = total_geral
+        return jsonify(resposta)
+
+    except mysql.connector.Error as e:
+        return jsonify({'success': False, 'message': f'Erro MySQL: {str(e)}'}), 500
 
-        cursor.execute("""
-            SELECT id, identificacao, nome, fabricante, modelo, numero_serie,
-                   status, created_at, departamento, responsavel, periodicidade
-            FROM instrumentos
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-            LIMIT %s
-        """, (user_id, limite))
 
-        instrumentos = cursor.fetchall()
-        
-        # Busca a ultima calibracao para cada instrumento
-        # (Logica simplificada: assume data de hoje se status for aprovado, ou busca de outra tabela se existisse)
-        # Neste caso, vamos adicionar campos que o frontend espera
-        for inst in instrumentos:
-            if inst.get('created_at'):
-                inst['data_calibracao'] = inst['created_at'].strftime('%d/%m/%Y')
-                inst['created_at'] = inst['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+_EXPORTAR_GRANDEZA_CAMPOS = ('grandeza_id', 'unidade', 'resolucao', 'faixa_nominal', 'faixa_uso',
+                             'tolerancia_processo', 'criterio_aceitacao')
+_EXPORTAR_COLUNAS = ('id', 'identificacao', 'nome', 'fabricante', 'modelo', 'numero_serie',
+                     'departamento', 'responsavel', 'status', 'periodicidade', 'created_at',
+                     'numero_calibracao', 'laboratorio_responsavel', 'data_calibracao',
+                     'data_proxima_calibracao', 'status_calibracao', 'grandezas')
 
-            # Busca grandezas basicas para mostrar na lista
-            cursor.execute("SELECT unidade, resolucao, tolerancia_processo FROM grandezas WHERE instrumento_id = %s LIMIT 1", (inst['id'],))
-            grandeza = cursor.fetchone()
-            if grandeza:
-                inst['grandezas'] = [grandeza]
+EXPORT_FETCH_ROWS = max(1, int(os.getenv('EXPORT_FETCH_ROWS', 1000)))
+# Cada exportacao segura uma conexao do pool enquanto o cliente baixa
+_exportacoes_slots = threading.BoundedSemaphore(max(1, int(os.getenv('EXPORT_MAX_CONCURRENT', 2))))
+_exportacoes_lock = threading.Lock()
+_exportacoes_stats = {'started': 0, 'completed': 0, 'aborted': 0, 'rejected': 0, 'active': 0,
+                      'rows': 0, 'bytes': 0}
 
+
+def _contar_exportacao(**incrementos):
+    with _exportacoes_lock:
+        for chave, valor in incrementos.items():
+            _exportacoes_stats[chave] += valor
+
+
+def _grandezas_texto(grandezas):
+    """Grandezas em uma celula (CSV/XLSX): 'unidade resolucao faixa' separadas por ' | '"""
+    partes = []
+    for g in grandezas:
+        campos = [g.get('unidade'), g.get('resolucao'), g.get('faixa_nominal') or g.get('faixa_uso')]
+        partes.append(' '.join(str(v) for v in campos if v not in (None, '')))
+    return ' | '.join(p for p in partes if p)
+
+
+def _linhas_exportacao(user_id, formato, contador):
+    """Instrumentos do usuario lidos de um cursor sem buffer, um registro por instrumento"""
+    conn = db_pool.connect()
+    concluida = False
+    try:
+        # Sem buffer: o servidor envia conforme o fetchmany consome, a memoria fica em um bloco
+        cursor = conn.cursor(dictionary=True, buffered=False)
+        cursor.execute(EXPORT_SQL, (user_id,))
+        registros = group_consecutive(fetch_iter(cursor, EXPORT_FETCH_ROWS), 'id',
+                                      _EXPORTAR_GRANDEZA_CAMPOS, 'grandeza_id')
+        for registro in registros:
+            for grandeza in registro['grandezas']:
+                grandeza.pop('grandeza_id', None)
+            if formato != 'ndjson':
+                registro['grandezas'] = _grandezas_texto(registro['grandezas'])
+            contador['rows'] += 1
+            yield registro
         cursor.close()
-        conn.close()
+        concluida = True
+    finally:
+        if concluida:
+            conn.close()
+        else:
+            # Resultado sem buffer pela metade: devolver ao pool obrigaria a ler o resto
+            conn.discard()
 
-        return jsonify({
-            'success': True,
-            'total': len(instrumentos),
-            'instrumentos': instrumentos
-        })
 
-    except mysql.connector.Error as e:
-        return jsonify({'success': False, 'message': f'Erro MySQL: {str(e)}'}), 500
+@app.route('/api/instrumentos/exportar', methods=['GET'])
+def exportar_instrumentos():
+    """Exporta todos os instrumentos do usuario com a ultima calibracao e as grandezas
+
+    ?formato=csv|ndjson|xlsx (padrao csv). A resposta e gerada em fluxo a
+    partir de um cursor sem buffer: o download comeca na hora e a memoria
+    nao cresce com o tamanho do cadastro. CSV e NDJSON saem com gzip quando
+    o cliente aceita (Accept-Encoding); o XLSX ja e um zip.
+    """
+    user_id = request.args.get('user_id', 1, type=int)
+    formato = (request.args.get('formato') or 'csv').strip().lower()
+    if formato not in EXPORT_FORMATS:
+        return jsonify({'success': False,
+                        'message': f"Formato invalido. Use: {', '.join(EXPORT_FORMATS)}"}), 400
+    if not _exportacoes_slots.acquire(blocking=False):
+        _contar_exportacao(rejected=1)
+        return jsonify({'success': False, 'message': 'Muitas exportacoes em andamento, tente novamente'}), \
+            429, {'Retry-After': '30'}
+
+    comprimir = formato != 'xlsx' and accepts_gzip(request.headers.get('Accept-Encoding'))
+    contador = {'rows': 0, 'bytes': 0}
+    estado = {'fim': False, 'liberado': False}
+    _contar_exportacao(started=1, active=1)
+
+    def gerar():
+        registros = _linhas_exportacao(user_id, formato, contador)
+        pedacos = encode_stream(registros, make_encoder(formato, _EXPORTAR_COLUNAS, 'Instrumentos'))
+        if comprimir:
+            pedacos = gzip_stream(pedacos)
+        try:
+            for pedaco in pedacos:
+                if pedaco:
+                    contador['bytes'] += len(pedaco)
+                    yield pedaco
+            estado['fim'] = True
+        except Exception as e:
+            # O status 200 ja foi enviado: so resta registrar e encerrar a conexao
+            print(f"[EXPORTAR] Falha no meio da exportacao (user {user_id}): {e}")
+        finally:
+            registros.close()
+
+    def liberar():
+        if estado['liberado']:
+            return
+        estado['liberado'] = True
+        _exportacoes_slots.release()
+        _contar_exportacao(active=-1, rows=contador['rows'], bytes=contador['bytes'],
+                           **({'completed': 1} if estado['fim'] else {'aborted': 1}))
+
+    nome = f"instrumentos_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}"
+    headers = {'Content-Disposition': content_disposition(nome, inline=False),
+               'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no', 'Vary': 'Accept-Encoding'}
+    if comprimir:
+        headers['Content-Encoding'] = 'gzip'
+    resposta = Response(gerar(), mimetype=EXPORT_CONTENT_TYPES[formato], headers=headers)
+    # call_on_close roda mesmo se o gerador nunca comecar (cliente desistiu antes do primeiro byte)
+    resposta.call_on_close(liberar)
+    return resposta
 
 
 @app.route('/api/instrumentos/<int:instrumento_id>', methods=['DELETE'])
 def deletar_instrumento(instrumento_id):
     """Deleta um instrumento"""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
 
-        # Deleta grandezas primeiro (FK)
-        cursor.execute("DELETE FROM grandezas WHERE instrumento_id = %s", (instrumento_id,))
+            # Deleta grandezas primeiro (FK)
+            cursor.execute("DELETE FROM grandezas WHERE instrumento_id = %s", (instrumento_id,))
         
-        # Deleta instrumento
-        cursor.execute("DELETE FROM instrumentos WHERE id = %s", (instrumento_id,))
+            # Deleta instrumento
+            cursor.execute("DELETE FROM instrumentos WHERE id = %s", (instrumento_id,))
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
 
         return jsonify({'success': True, 'message': 'Instrumento deletado com sucesso'})
 
@@ -2118,39 +3154,38 @@ def deletar_instrumento(instrumento_id):
 def buscar_instrumento(instrumento_id):
     """Busca detalhes de um instrumento especifico com grandezas"""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
-
-        # Busca instrumento
-        cursor.execute("SELECT * FROM instrumentos WHERE id = %s", (instrumento_id,))
-        instrumento = cursor.fetchone()
-
-        if not instrumento:
-            return jsonify({'success': False, 'message': 'Instrumento nao encontrado'}), 404
+        with db_pool.connection() as conn:
+            cursor = conn.cursor(dictionary=True)
 
-        # Converte datetime
-        for key in ['created_at', 'updated_at']:
-            if instrumento.get(key):
-                instrumento[key] = instrumento[key].strftime('%Y-%m-%d %H:%M:%S')
+            # Busca instrumento
+            cursor.execute("SELECT * FROM instrumentos WHERE id = %s", (instrumento_id,))
+            instrumento = cursor.fetchone()
 
-        # Busca grandezas
-        cursor.execute("SELECT * FROM grandezas WHERE instrumento_id = %s", (instrumento_id,))
-        grandezas = cursor.fetchall()
+            if not instrumento:
+                return jsonify({'success': False, 'message': 'Instrumento nao encontrado'}), 404
 
-        for g in grandezas:
+            # Converte datetime
             for key in ['created_at', 'updated_at']:
-                if g.get(key):
-                    g[key] = g[key].strftime('%Y-%m-%d %H:%M:%S')
-            if g.get('servicos'):
-                try:
-                    g['servicos'] = json.loads(g['servicos'])
-                except:
-                    pass
+                if instrumento.get(key):
+                    instrumento[key] = instrumento[key].strftime('%Y-%m-%d %H:%M:%S')
+
+            # Busca grandezas
+            cursor.execute("SELECT * FROM grandezas WHERE instrumento_id = %s", (instrumento_id,))
+            grandezas = cursor.fetchall()
+
+            for g in grandezas:
+                for key in ['created_at', 'updated_at']:
+                    if g.get(key):
+                        g[key] = g[key].strftime('%Y-%m-%d %H:%M:%S')
+                if g.get('servicos'):
+                    try:
+                        g['servicos'] = json.loads(g['servicos'])
+                    except:
+                        pass
 
-        instrumento['grandezas'] = grandezas
+            instrumento['grandezas'] = grandezas
 
-        cursor.close()
-        conn.close()
+            cursor.close()
 
         return jsonify({'success': True, 'instrumento': instrumento})
 
@@ -2158,9 +3193,118 @@ def buscar_instrumento(instrumento_id):
         return jsonify({'success': False, 'message': f'Erro MySQL: {str(e)}'}), 500
 
 
+GERAR_SQL_LOTE = max(1, int(os.getenv('GERAR_SQL_LOTE', 500)))
+
+# Colunas do script (id, instrumento_id e datas sao preenchidos pelo proprio script)
+_GERAR_SQL_INSTRUMENTO = (
+    'identificacao', 'nome', 'fabricante', 'modelo', 'numero_serie', 'descricao',
+    'periodicidade', 'departamento', 'responsavel', 'status', 'tipo_familia',
+    'serie_desenv', 'criticidade', 'motivo_calibracao', 'quantidade',
+    'user_id', 'responsavel_cadastro_id',
+)
+_GERAR_SQL_GRANDEZA = (
+    'servicos', 'tolerancia_processo', 'tolerancia_simetrica',
+    'unidade', 'resolucao', 'criterio_aceitacao', 'regra_decisao_id',
+    'faixa_nominal', 'classe_norma', 'classificacao', 'faixa_uso',
+)
+_AGORA_SQL = SqlExpr('NOW()')
+
+
+def _linha_sql_instrumento(inst, user_id):
+    """Valores de _GERAR_SQL_INSTRUMENTO para um item extraido"""
+    dados_principais = inst.get('dados_principais', {})
+    return (
+        _resolver_identificacao_extraida(inst),
+        inst.get('nome') or dados_principais.get('instrumento') or inst.get('titulo'),
+        inst.get('fabricante') or dados_principais.get('fabricante'),
+        inst.get('modelo') or dados_principais.get('modelo'),
+        inst.get('numero_serie') or dados_principais.get('numero_serie'),
+        inst.get('descricao') or json.dumps(inst, ensure_ascii=False)[:500],
+        inst.get('periodicidade', 12),
+        inst.get('departamento') or dados_principais.get('cliente'),
+        inst.get('responsavel') or dados_principais.get('solicitante'),
+        inst.get('status', 'Sem Calibração'),
+        inst.get('tipo_familia') or inst.get('tipo_documento'),
+        inst.get('serie_desenv'),
+        inst.get('criticidade'),
+        inst.get('motivo_calibracao', 'Calibração Periódica'),
+        inst.get('quantidade', 1),
+        user_id,
+        user_id,
+    )
+
+
+def _cabecalho_script(total):
+    # Sem COMMIT ate o fim: um script cortado no meio nao grava nada.
+    # Os ids sao explicitos (@metron_base + ordem) para as grandezas acharem o instrumento
+    # sem LAST_INSERT_ID por linha; o LOCK TABLES impede que outro cliente use os mesmos ids.
+    return (
+        "-- Gerado pelo Metron\n"
+        f"-- Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"-- Instrumentos: {total}\n"
+        "USE instrumentos;\n"
+        "SET NAMES utf8mb4;\n"
+        "SET autocommit = 0;\n"
+        "LOCK TABLES instrumentos WRITE, grandezas WRITE;\n"
+        "SELECT COALESCE(MAX(id), 0) INTO @metron_base FROM instrumentos;\n\n"
+    )
+
+
+_RODAPE_SCRIPT = "COMMIT;\nUNLOCK TABLES;\n"
+
+
+def _script_sql_insert(instrumentos, user_id, lote):
+    """Script com INSERT de varias linhas: cada lote de instrumentos seguido das grandezas dele"""
+    yield _cabecalho_script(len(instrumentos))
+    for inicio in range(0, len(instrumentos), lote):
+        linhas_inst, linhas_grand = [], []
+        for ordem, inst in enumerate(instrumentos[inicio:inicio + lote], start=inicio + 1):
+            instrumento_id = SqlExpr(f'@metron_base + {ordem}')
+            linhas_inst.append((instrumento_id, *_linha_sql_instrumento(inst, user_id), _AGORA_SQL, _AGORA_SQL))
+            for grandeza in _linhas_grandezas(inst):
+                linhas_grand.append((instrumento_id, *grandeza, _AGORA_SQL, _AGORA_SQL))
+        yield from insert_statements('instrumentos', ('id', *_GERAR_SQL_INSTRUMENTO, 'created_at', 'updated_at'),
+                                     linhas_inst, lote)
+        yield from insert_statements('grandezas', ('instrumento_id', *_GERAR_SQL_GRANDEZA, 'created_at', 'updated_at'),
+                                     linhas_grand, lote)
+        yield "\n"
+    yield _RODAPE_SCRIPT
+
+
+def _script_load_data(total):
+    """load.sql do pacote TSV (rodar na pasta extraida: mysql --local-infile=1 < load.sql)"""
+    return (
+        _cabecalho_script(total)
+        + load_data_statement('instrumentos.tsv', 'instrumentos', ('@ordem', *_GERAR_SQL_INSTRUMENTO),
+                              'id = @metron_base + @ordem, created_at = NOW(), updated_at = NOW()')
+        + load_data_statement('grandezas.tsv', 'grandezas', ('@ordem', *_GERAR_SQL_GRANDEZA),
+                              'instrumento_id = @metron_base + @ordem, created_at = NOW(), updated_at = NOW()')
+        + _RODAPE_SCRIPT
+    )
+
+
+def _pacote_tsv(instrumentos, user_id, lote):
+    """ZIP com load.sql + instrumentos.tsv + grandezas.tsv (coluna 1 = ordem do instrumento no lote)"""
+    linhas_inst = ((ordem, *_linha_sql_instrumento(inst, user_id))
+                   for ordem, inst in enumerate(instrumentos, start=1))
+    linhas_grand = ((ordem, *grandeza)
+                    for ordem, inst in enumerate(instrumentos, start=1)
+                    for grandeza in _linhas_grandezas(inst))
+    return zip_stream([
+        ('load.sql', [_script_load_data(len(instrumentos))]),
+        ('instrumentos.tsv', tsv_lines(linhas_inst, lote)),
+        ('grandezas.tsv', tsv_lines(linhas_grand, lote)),
+    ])
+
+
 @app.route('/gerar-sql', methods=['POST'])
 def gerar_sql():
-    """Gera arquivo SQL com os dados inseridos"""
+    """Gera arquivo SQL com os dados inseridos
+
+    Gerado em fluxo, com INSERT de varias linhas em lotes de `lote` linhas
+    (padrao GERAR_SQL_LOTE). formato='tsv' devolve um ZIP para LOAD DATA
+    (load.sql + instrumentos.tsv + grandezas.tsv).
+    """
     try:
         data = request.get_json()
         instrumentos = data.get('instrumentos', [])
@@ -2168,95 +3312,33 @@ def gerar_sql():
         if not instrumentos:
             return jsonify({'success': False, 'message': 'Nenhum instrumento para gerar SQL.'}), 400
 
-        sql_lines = []
-        sql_lines.append("-- Gerado pelo Metron")
-        sql_lines.append(f"-- Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        sql_lines.append("USE instrumentos;")
-        sql_lines.append("")
-
         user_id = data.get('user_id', 1)
+        formato = str(data.get('formato') or 'sql').lower()
+        if formato not in ('sql', 'tsv'):
+            return jsonify({'success': False, 'message': "Formato invalido. Use 'sql' ou 'tsv'."}), 400
+        try:
+            lote = max(1, min(int(data.get('lote') or GERAR_SQL_LOTE), 10000))
+        except (TypeError, ValueError):
+            lote = GERAR_SQL_LOTE
 
-        def escape(val):
-            if val is None: return 'NULL'
-            if isinstance(val, (int, float)): return str(val)
-            if isinstance(val, bool): return 'TRUE' if val else 'FALSE'
-            return "'" + str(val).replace("'", "''").replace("\\", "\\\\") + "'"
-
-        for inst in instrumentos:
-            identificacao = _resolver_identificacao_extraida(
-                inst,
-                inst.get('dados_principais', {}).get('numero_certificado', 'n/i')
+        def gerar(pedacos):
+            try:
+                for pedaco in pedacos:
+                    yield pedaco
+            except Exception as e:
+                # Resposta ja iniciada: o script sai sem COMMIT e nao grava nada
+                print(f"[ERRO] SQL Gen: {e}")
+
+        if formato == 'tsv':
+            return Response(
+                gerar(_pacote_tsv(instrumentos, user_id, lote)),
+                mimetype="application/zip",
+                headers={"Content-disposition": "attachment; filename=instrumentos_load_data.zip"}
             )
-            
-            # Dados Principais
-            dados_principais = inst.get('dados_principais', {})
-            
-            # Mapeamento de campos
-            val_ident = escape(identificacao)
-            val_nome = escape(inst.get('nome') or dados_principais.get('instrumento') or inst.get('titulo'))
-            val_fab = escape(inst.get('fabricante') or dados_principais.get('fabricante'))
-            val_mod = escape(inst.get('modelo') or dados_principais.get('modelo'))
-            val_ns = escape(inst.get('numero_serie') or dados_principais.get('numero_serie'))
-            val_desc = escape(inst.get('descricao') or json.dumps(inst, ensure_ascii=False)[:500])
-            val_period = escape(inst.get('periodicidade', 12))
-            val_dep = escape(inst.get('departamento') or dados_principais.get('cliente'))
-            val_resp = escape(inst.get('responsavel') or dados_principais.get('solicitante'))
-            val_status = escape(inst.get('status', 'Sem Calibração'))
-            val_tipo = escape(inst.get('tipo_familia') or inst.get('tipo_documento'))
-            val_serie = escape(inst.get('serie_desenv'))
-            val_crit = escape(inst.get('criticidade'))
-            val_motivo = escape(inst.get('motivo_calibracao', 'Calibração Periódica'))
-            val_qtd = escape(inst.get('quantidade', 1))
-            val_uid = escape(user_id)
-
-            sql_lines.append(f"""
-INSERT INTO instrumentos (
-    identificacao, nome, fabricante, modelo, numero_serie, descricao,
-    periodicidade, departamento, responsavel, status, tipo_familia,
-    serie_desenv, criticidade, motivo_calibracao, quantidade,
-    user_id, responsavel_cadastro_id, created_at, updated_at
-) VALUES (
-    {val_ident}, {val_nome}, {val_fab}, {val_mod}, {val_ns}, {val_desc},
-    {val_period}, {val_dep}, {val_resp}, {val_status}, {val_tipo},
-    {val_serie}, {val_crit}, {val_motivo}, {val_qtd},
-    {val_uid}, {val_uid}, NOW(), NOW()
-);""")
-            
-            # Variavel para ID
-            sql_lines.append("SET @inst_id = LAST_INSERT_ID();")
-
-            # Grandezas
-            grandezas = inst.get('grandezas', []) or inst.get('tabelas', [])
-            if grandezas:
-                for grandeza in grandezas:
-                     val_servs = escape(json.dumps(grandeza.get('servicos', []) if isinstance(grandeza.get('servicos'), list) else []))
-                     val_tol = escape(grandeza.get('tolerancia_processo'))
-                     val_sim = 'TRUE' if grandeza.get('tolerancia_simetrica', True) else 'FALSE'
-                     val_uni = escape(grandeza.get('unidade'))
-                     val_res = escape(grandeza.get('resolucao'))
-                     val_crit_g = escape(grandeza.get('criterio_aceitacao'))
-                     val_regra = escape(grandeza.get('regra_decisao_id', 1))
-                     val_faixa = escape(grandeza.get('faixa_nominal'))
-                     val_classe = escape(grandeza.get('classe_norma'))
-                     val_classif = escape(grandeza.get('classificacao'))
-                     val_fuso = escape(grandeza.get('faixa_uso'))
-
-                     sql_lines.append(f"""INSERT INTO grandezas (
-    instrumento_id, servicos, tolerancia_processo, tolerancia_simetrica,
-    unidade, resolucao, criterio_aceitacao, regra_decisao_id,
-    faixa_nominal, classe_norma, classificacao, faixa_uso,
-    created_at, updated_at
-) VALUES (
-    @inst_id, {val_servs}, {val_tol}, {val_sim},
-    {val_uni}, {val_res}, {val_crit_g}, {val_regra},
-    {val_faixa}, {val_classe}, {val_classif}, {val_fuso},
-    NOW(), NOW()
-);""")
-            sql_lines.append("")
 
         # Retorna o arquivo
         return Response(
-            "\n".join(sql_lines),
+            gerar(_script_sql_insert(instrumentos, user_id, lote)),
             mimetype="application/sql",
             headers={"Content-disposition": "attachment; filename=instrumentos.sql"}
         )
@@ -2272,40 +3354,56 @@ INSERT INTO instrumentos (
 
 @app.route('/certificado-pdf/<int:calibracao_id>')
 def servir_certificado_pdf(calibracao_id):
-    """Serve o PDF do certificado direto do banco de dados pelo ID da calibracao"""
+    """Serve o PDF do certificado pelo ID da calibracao (blob store, banco ou storage do Laravel).
+    Entrega em blocos com Range e ETag: a tela de aprovacao revalida e recebe 304."""
     import base64
-    import io
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
+        with db_pool.connection() as conn:
+            cursor = conn.cursor(dictionary=True)
 
-        # Busca na tabela certificados (que tem o PDF in database)
-        cursor.execute(
-            'SELECT pdf_content, pdf_in_database, nome_original, arquivo_pdf FROM certificados WHERE calibracao_id = %s ORDER BY id DESC LIMIT 1',
-            (calibracao_id,)
-        )
-        cert = cursor.fetchone()
-        cursor.close()
-        conn.close()
+            # Sem pdf_content: o base64 so e lido se o PDF nao estiver no blob store
+            cursor.execute(CERTIFICATE_SQL, (calibracao_id,))
+            cert = cursor.fetchone()
+            cursor.close()
 
         if not cert:
             return jsonify({'error': 'Certificado nao encontrado'}), 404
 
-        # Se o PDF esta no banco (base64)
-        if cert['pdf_in_database'] and cert['pdf_content']:
+        nome = cert['nome_original'] or 'certificado.pdf'
+
+        # Enderecado por conteudo (gravado pelo inserir-banco ou pela migracao)
+        digest = digest_from_key(cert['arquivo_pdf'])
+        if digest:
+            resposta = _responder_blob(digest, nome, CACHE_REVALIDATE)
+            if resposta is not None:
+                return resposta
+
+        # pdf_content so e lido quando o PDF nao saiu do banco (ou o blob dele nao existe)
+        if cert['pdf_in_database']:
+            with db_pool.connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute(CERTIFICATE_CONTENT_SQL, (cert['id'],))
+                cert['pdf_content'] = (cursor.fetchone() or {}).get('pdf_content')
+                cursor.close()
+
+        # Se o PDF esta no banco (base64, ainda nao migrado)
+        if cert.get('pdf_content'):
             pdf_bytes = base64.b64decode(cert['pdf_content'])
-            return send_file(
-                io.BytesIO(pdf_bytes),
-                mimetype='application/pdf',
-                download_name=cert['nome_original'] or 'certificado.pdf'
-            )
+            return _responder_pdf(_abrir_bytes(pdf_bytes), len(pdf_bytes),
+                                  hashlib.sha256(pdf_bytes).hexdigest(), nome)
 
         # Se tem caminho de arquivo (storage do Laravel)
         if cert['arquivo_pdf']:
-            # Tenta no storage do Laravel
-            laravel_storage = os.path.join(os.getenv('LARAVEL_STORAGE', 'C:/xampp/htdocs/gocal/storage/app/public'), cert['arquivo_pdf'])
-            if os.path.exists(laravel_storage):
-                return send_file(laravel_storage, mimetype='application/pdf')
+            laravel_storage = os.path.join(LARAVEL_STORAGE, cert['arquivo_pdf'])
+            if os.path.isfile(laravel_storage):
+                # ETag pelo hash do nome (blob) ou por tamanho + mtime: nao le o arquivo a cada pedido
+                info = os.stat(laravel_storage)
+
+                def abrir(inicio, comprimento):
+                    f = open(laravel_storage, 'rb')
+                    f.seek(inicio)
+                    return f
+                return _responder_pdf(abrir, info.st_size, digest or file_validator(info), nome)
 
         return jsonify({'error': 'PDF nao disponivel'}), 404
 
@@ -2313,6 +3411,34 @@ def servir_certificado_pdf(calibracao_id):
         print(f"[ERRO] Servir PDF: {e}")
         return jsonify({'error': str(e)}), 500
 
+
+def _responder_blob(digest, nome, cache_control):
+    """PDF do blob store pelo SHA-256 (None se o blob nao existe)"""
+    chave = cert_blob_store.key(digest)
+    tamanho = cert_blob_store.size(chave)
+    if tamanho is None:
+        return None
+    return _responder_pdf(lambda inicio, comprimento: cert_blob_store.open(chave, inicio, comprimento),
+                          tamanho, digest, nome, cache_control)
+
+
+@app.route('/certificado-blob/<digest>.pdf')
+def servir_certificado_blob(digest):
+    """PDF pelo SHA-256 (URL enderecada por conteudo: cache imutavel no navegador)"""
+    if not re.fullmatch(r'[0-9a-f]{64}', digest or ''):
+        return jsonify({'error': 'Hash invalido'}), 400
+    if etag_matches(request.headers.get('If-None-Match'), strong_etag(digest)):
+        # Mesmo hash, mesmos bytes: nem consulta o store
+        return Response(status=304, headers={'ETag': strong_etag(digest), 'Cache-Control': CACHE_IMMUTABLE})
+    try:
+        resposta = _responder_blob(digest, request.args.get('nome') or f'{digest[:12]}.pdf', CACHE_IMMUTABLE)
+    except Exception as e:
+        print(f"[ERRO] Servir blob: {e}")
+        return jsonify({'error': str(e)}), 500
+    if resposta is None:
+        return jsonify({'error': 'PDF nao encontrado'}), 404
+    return resposta
+
 @app.route('/token-usage')
 def token_usage():
     """Retorna o uso acumulado de tokens da sessao"""
@@ -2320,6 +3446,28 @@ def token_usage():
         return jsonify(extractor.token_usage)
     return jsonify({'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0})
 
+@app.route('/metrics')
+def metrics():
+    """Gauges de memoria do processo (estado das tarefas em lote)"""
+    return jsonify({
+        'job_store': processing_tasks.stats(),
+        'scheduler': extraction_scheduler.stats(),
+        'single_flight': extraction_singleflight.stats(),
+        'hot_folder': hot_folder_watcher.stats() if hot_folder_watcher else None,
+        'task_inbox': task_inbox.stats(),
+        'url_fetch': url_fetcher.stats(),
+        'stage_timings': stage_histogram.stats(),
+        'session_store': extracted_cache.stats(),
+        'db_pool': db_pool.stats(),
+        'latest_calibration': latest_calibration_job.stats() if latest_calibration_job else None,
+        'search_index': search_index_job.stats() if search_index_job else None,
+        'lab_geo_index': lab_geo_index.stats(),
+        'lab_catalog': lab_catalog.stats(),
+        'cert_blob_store': {**cert_blob_store.stats(),
+                            'migration': cert_blob_job.stats() if cert_blob_job else None},
+        'exportacoes': dict(_exportacoes_stats)
+    })
+
 @app.route('/health')
 def health():
     """Health check"""
@@ -2330,6 +3478,13 @@ def health():
     })
 
 
+# Sob o reloader do Flask so o processo filho (o que atende) vigia as pastas
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    _iniciar_hot_folder()
+    _iniciar_jobs_banco()
+    lab_catalog.warm()
+
+
 # ============================================================
 # MAIN
 # ============================================================
@@ -2347,6 +3502,8 @@ if __name__ == '__main__':
     print("  GET  /visualizar            - Interface Web de Visualizacao")
     print("  GET  /listar-instrumentos  - Lista instrumentos")
     print("  GET  /buscar-instrumento/N - Detalhes do instrumento N")
+    print("  GET  /hot-folder/tarefas   - Lotes da pasta vigiada")
+    print("  GET  /metrics              - Gauges de memoria/filas")
     print("  GET  /health               - Health check")
     print("="*60 + "\n")
     app.run(host='0.0.0.0', port=5001, debug=True)
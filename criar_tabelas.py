@@ -1,105 +1,312 @@
 """
-Script para criar as tabelas no banco MySQL
+Script de migracao do banco MySQL
+
+Migracoes versionadas e idempotentes: cada versao aplicada fica registrada
+em schema_migrations e nao roda de novo. Os indices das consultas quentes
+sao conferidos a cada execucao (e recriados se alguem os removeu).
+
+Uso:
+    python criar_tabelas.py            # aplica as migracoes pendentes
+    python criar_tabelas.py --status   # lista versoes aplicadas/pendentes
+    python criar_tabelas.py --check    # EXPLAIN nas consultas quentes do app
 """
 
+import os
+import sys
+import argparse
+
 import mysql.connector
 
+try:
+    from dotenv import load_dotenv
+    load_dotenv(override=True)
+except ImportError:
+    pass
+
+from metron.latest_calibration import CREATE_TABLE_SQL as ULTIMA_CALIBRACAO_SQL, backfill_latest_calibrations
+from metron.instrument_search import CREATE_TABLE_SQL as BUSCA_INSTRUMENTOS_SQL
+from metron.hot_queries import check_queries
+
+DB_NAME = os.getenv('DB_DATABASE', 'instrumentos')
+
 DB_CONFIG = {
-    'host': '127.0.0.1',
-    'port': 3306,
-    'user': 'root',
-    'password': ''
+    'host': os.getenv('DB_HOST', '127.0.0.1'),
+    'port': int(os.getenv('DB_PORT', 3306)),
+    'user': os.getenv('DB_USERNAME', 'root'),
+    'password': os.getenv('DB_PASSWORD', '')
 }
 
-def criar_tabelas():
+# Indices das consultas quentes: (tabela, nome, colunas)
+INDICES = [
+    ('instrumentos', 'idx_instrumentos_user_identificacao', ('user_id', 'identificacao')),
+    # Ordenacoes da paginacao por chave (o InnoDB anexa o id a cada indice secundario)
+    ('instrumentos', 'idx_instrumentos_user_created', ('user_id', 'created_at')),
+    ('instrumentos', 'idx_instrumentos_user_nome', ('user_id', 'nome')),
+    ('calibracoes', 'idx_calibracoes_instrumento_data', ('instrumento_id', 'data_calibracao')),
+    ('calibracoes', 'idx_calibracoes_instrumento_numero_data', ('instrumento_id', 'numero_calibracao', 'data_calibracao')),
+    ('certificados', 'idx_certificados_calibracao', ('calibracao_id',)),
+    ('escopo_calibracao', 'idx_escopo_calibracao_laboratorio', ('laboratorio_id',)),
+]
+
+# ============================================================
+# MIGRACOES
+# ============================================================
+def _m001_tabelas_base(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS instrumentos (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            identificacao VARCHAR(255),
+            nome VARCHAR(255),
+            fabricante VARCHAR(255),
+            modelo VARCHAR(255),
+            numero_serie VARCHAR(255),
+            descricao TEXT,
+            periodicidade INT DEFAULT 12,
+            departamento VARCHAR(255),
+            responsavel VARCHAR(255),
+            status VARCHAR(50) DEFAULT 'Sem Calibração',
+            tipo_familia VARCHAR(255),
+            serie_desenv VARCHAR(255),
+            criticidade VARCHAR(100),
+            motivo_calibracao VARCHAR(255),
+            quantidade INT DEFAULT 1,
+            user_id INT NOT NULL DEFAULT 1,
+            responsavel_cadastro_id INT NOT NULL DEFAULT 1,
+            data_calibracao DATE,
+            data_emissao DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS grandezas (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            instrumento_id INT NOT NULL,
+            servicos JSON,
+            tolerancia_processo VARCHAR(255),
+            tolerancia_simetrica BOOLEAN DEFAULT TRUE,
+            unidade VARCHAR(50),
+            resolucao VARCHAR(100),
+            criterio_aceitacao TEXT,
+            regra_decisao_id INT DEFAULT 1,
+            faixa_nominal VARCHAR(255),
+            classe_norma VARCHAR(100),
+            classificacao VARCHAR(100),
+            faixa_uso VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (instrumento_id) REFERENCES instrumentos(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+def _m002_indices_consultas_quentes(cursor):
+    garantir_indices(cursor)
+
+
+def _m003_ultima_calibracao(cursor):
+    if _tabela_existe(cursor, 'calibracoes'):
+        cursor.execute(ULTIMA_CALIBRACAO_SQL)
+        _preencher_ultima_calibracao(cursor)
+    else:
+        print("[AVISO] Tabela 'calibracoes' nao existe; projecao da ultima calibracao adiada")
+
+
+def _preencher_ultima_calibracao(cursor):
+    """Carga inicial sincrona da projecao (sem esperar a reconciliacao do app)"""
+    cursor.execute("SELECT 1 FROM instrumento_ultima_calibracao LIMIT 1")
+    if cursor.fetchall():
+        return
+    total = backfill_latest_calibrations(cursor)
+    print(f"[OK] Ultima calibracao de {total} instrumento(s) projetada")
+
+
+def _m004_busca_instrumentos(cursor):
+    # O texto e preenchido pelo app (reconciliacao do indice de busca na partida)
+    cursor.execute(BUSCA_INSTRUMENTOS_SQL)
+
+
+# (versao, descricao, funcao) - nunca renumerar nem alterar uma versao ja publicada
+MIGRACOES = [
+    (1, 'tabelas instrumentos e grandezas', _m001_tabelas_base),
+    (2, 'indices das consultas quentes', _m002_indices_consultas_quentes),
+    (3, 'projecao instrumento_ultima_calibracao', _m003_ultima_calibracao),
+    (4, 'indice de busca instrumento_busca (FULLTEXT)', _m004_busca_instrumentos),
+]
+
+
+# ============================================================
+# RUNNER
+# ============================================================
+def _tabela_existe(cursor, tabela):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+        (tabela,)
+    )
+    return cursor.fetchone() is not None
+
+
+def _colunas_indexadas(cursor, tabela):
+    """{nome_indice: (colunas em ordem)}"""
+    cursor.execute("""
+        SELECT index_name, column_name
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+        ORDER BY index_name, seq_in_index
+    """, (tabela,))
+    indices = {}
+    for nome, coluna in cursor.fetchall():
+        indices.setdefault(nome, []).append(coluna)
+    return {nome: tuple(cols) for nome, cols in indices.items()}
+
+
+def garantir_indices(cursor):
+    """Cria os indices que faltam. Um indice existente que comece pelas mesmas colunas ja serve."""
+    faltando = []
+    for tabela, nome, colunas in INDICES:
+        if not _tabela_existe(cursor, tabela):
+            print(f"[AVISO] Tabela '{tabela}' nao existe; indice {nome} ignorado")
+            faltando.append(nome)
+            continue
+        existentes = _colunas_indexadas(cursor, tabela)
+        if any(cols[:len(colunas)] == colunas for cols in existentes.values()):
+            print(f"[OK] {tabela}({', '.join(colunas)})")
+            continue
+        print(f"[INFO] Criando indice {nome} em {tabela}({', '.join(colunas)})...")
+        cursor.execute(f"CREATE INDEX {nome} ON {tabela} ({', '.join(colunas)})")
+        print(f"[OK] Indice {nome} criado")
+    return faltando
+
+
+def _versoes_aplicadas(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _conectar():
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{DB_NAME}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+    cursor.execute(f"USE `{DB_NAME}`")
+    return conn, cursor
+
+
+def migrar():
     print("="*60)
-    print("CRIANDO TABELAS NO BANCO DE DADOS")
+    print("MIGRANDO BANCO DE DADOS")
     print("="*60)
 
+    conn, cursor = _conectar()
     try:
-        # Conecta ao MySQL (sem especificar database)
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-
-        # Cria o banco se não existir
-        print("\n[INFO] Criando banco 'instrumentos' se nao existir...")
-        cursor.execute("CREATE DATABASE IF NOT EXISTS instrumentos CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
-        cursor.execute("USE instrumentos")
-        print("[OK] Banco selecionado")
-
-        # Cria tabela instrumentos
-        print("\n[INFO] Criando tabela 'instrumentos'...")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS instrumentos (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                identificacao VARCHAR(255),
-                nome VARCHAR(255),
-                fabricante VARCHAR(255),
-                modelo VARCHAR(255),
-                numero_serie VARCHAR(255),
-                descricao TEXT,
-                periodicidade INT DEFAULT 12,
-                departamento VARCHAR(255),
-                responsavel VARCHAR(255),
-                status VARCHAR(50) DEFAULT 'Sem Calibração',
-                tipo_familia VARCHAR(255),
-                serie_desenv VARCHAR(255),
-                criticidade VARCHAR(100),
-                motivo_calibracao VARCHAR(255),
-                quantidade INT DEFAULT 1,
-                user_id INT NOT NULL DEFAULT 1,
-                responsavel_cadastro_id INT NOT NULL DEFAULT 1,
-                data_calibracao DATE,
-                data_emissao DATE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-        """)
-        print("[OK] Tabela 'instrumentos' criada")
-
-        # Cria tabela grandezas
-        print("\n[INFO] Criando tabela 'grandezas'...")
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS grandezas (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                instrumento_id INT NOT NULL,
-                servicos JSON,
-                tolerancia_processo VARCHAR(255),
-                tolerancia_simetrica BOOLEAN DEFAULT TRUE,
-                unidade VARCHAR(50),
-                resolucao VARCHAR(100),
-                criterio_aceitacao TEXT,
-                regra_decisao_id INT DEFAULT 1,
-                faixa_nominal VARCHAR(255),
-                classe_norma VARCHAR(100),
-                classificacao VARCHAR(100),
-                faixa_uso VARCHAR(255),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                FOREIGN KEY (instrumento_id) REFERENCES instrumentos(id) ON DELETE CASCADE
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-        """)
-        print("[OK] Tabela 'grandezas' criada")
+        aplicadas = _versoes_aplicadas(cursor)
+        pendentes = [m for m in MIGRACOES if m[0] not in aplicadas]
+        for versao, descricao, funcao in pendentes:
+            print(f"\n[INFO] Aplicando {versao:03d}: {descricao}...")
+            # DDL no MySQL faz commit implicito: cada passo precisa ser idempotente
+            funcao(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (versao, descricao)
+            )
+            conn.commit()
+            print(f"[OK] Versao {versao:03d} aplicada")
+
+        if not pendentes:
+            print("\n[OK] Nenhuma migracao pendente")
 
+        # Conferidos sempre: tabelas do Laravel podem surgir depois das versoes 002/003
+        print("\n[INFO] Conferindo indices das consultas quentes...")
+        faltando = garantir_indices(cursor)
+        if _tabela_existe(cursor, 'calibracoes'):
+            cursor.execute(ULTIMA_CALIBRACAO_SQL)
+            _preencher_ultima_calibracao(cursor)
         conn.commit()
 
         print("\n" + "="*60)
-        print("TABELAS CRIADAS COM SUCESSO!")
+        print("BANCO ATUALIZADO" + (f" ({len(faltando)} indice(s) aguardando tabela)" if faltando else ""))
         print("="*60)
-        print("\nProximo passo:")
-        print("  python inserir_banco.py")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
 
-    except Exception as e:
-        print(f"\n[ERRO] Falha ao criar tabelas: {e}")
-        import traceback
-        traceback.print_exc()
 
+def status():
+    conn, cursor = _conectar()
+    try:
+        aplicadas = _versoes_aplicadas(cursor)
+        for versao, descricao, _ in MIGRACOES:
+            marca = 'OK' if versao in aplicadas else 'PENDENTE'
+            print(f"[{marca}] {versao:03d} {descricao}")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def checar():
+    """
+    EXPLAIN nas consultas quentes, montadas pelos mesmos construtores e
+    constantes que o app executa; retorna 1 se alguma fizer varredura completa
+    """
+    print("="*60)
+    print("EXPLAIN DAS CONSULTAS QUENTES")
+    print("="*60)
+
+    conn, _ = _conectar()
+    cursor = conn.cursor(dictionary=True)
+    varreduras = 0
+    try:
+        for nome, sql, params in check_queries():
+            try:
+                cursor.execute("EXPLAIN " + sql, params)
+                plano = cursor.fetchall()
+            except mysql.connector.Error as e:
+                print(f"\n[AVISO] {nome}: {e.msg}")
+                continue
+            completas = [p for p in plano if (p.get('type') or '').upper() == 'ALL']
+            varreduras += len(completas)
+            print(f"\n[{'SCAN' if completas else 'OK'}] {nome}")
+            for p in plano:
+                print(f"    {p.get('table')}: type={p.get('type')} key={p.get('key')} rows={p.get('rows')}")
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        cursor.close()
+        conn.close()
+
+    print("\n" + "="*60)
+    print(f"{varreduras} varredura(s) completa(s)" if varreduras else "NENHUMA VARREDURA COMPLETA")
+    print("="*60)
+    return 1 if varreduras else 0
+
+
+def criar_tabelas():
+    """Mantido para quem chama o nome antigo: aplica as migracoes"""
+    return migrar()
 
 
 if __name__ == "__main__":
-    criar_tabelas()
+    parser = argparse.ArgumentParser(description='Migracoes do banco do Metron')
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument('--status', action='store_true', help='lista versoes aplicadas e pendentes')
+    grupo.add_argument('--check', action='store_true', help='EXPLAIN nas consultas quentes e aponta varreduras completas')
+    args = parser.parse_args()
+
+    try:
+        if args.status:
+            sys.exit(status())
+        elif args.check:
+            sys.exit(checar())
+        else:
+            sys.exit(migrar())
+    except Exception as e:
+        print(f"\n[ERRO] Falha na migracao: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
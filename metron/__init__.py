@@ -0,0 +1,99 @@
+"""
+Metron Core
+Infraestrutura de suporte ao app: estado das tarefas de extracao em lote
+(com copia legivel por todos os workers) e fila de extracao com prioridade, coalescencia de extracoes identicas,
+upload retomavel em partes, caixa de entrada do worker dono de cada
+tarefa, leitura de ZIPs de certificados, pasta vigiada, download de PDFs
+por URL, tempo por etapa da extracao e documentos extraidos
+por sessao compartilhados entre workers (guardados comprimidos), pool de
+conexoes MySQL, gravacao em lote, exportacao em fluxo (CSV, NDJSON, XLSX,
+scripts SQL com INSERT de varias linhas e TSV para LOAD DATA), PDFs de
+certificado enderecados por hash (entregues em blocos com Range e ETag),
+cursor de paginacao por chave e projecao da ultima calibracao de cada
+instrumento, busca textual de instrumentos, consultas quentes (as mesmas
+que o --check do criar_tabelas.py explica), indice espacial e catalogo de
+servicos dos laboratorios
+"""
+
+from .job_store import JobStore, TaskBoard
+from .scheduler import ExtractionScheduler, PRIORIDADE_INTERATIVA, PRIORIDADE_LOTE
+from .singleflight import SingleFlight
+from .chunked_upload import ChunkedUploadManager, ChunkedUploadError
+from .task_inbox import TaskInbox
+from .zip_ingest import iter_zip_pdfs
+from .hot_folder import HotFolderWatcher, acquire_single_instance_lock
+from .url_fetch import UrlFetcher, UrlFetchError
+from .session_store import (
+    SessionStore, MemoryBackend, SQLiteBackend, RedisBackend, create_session_store,
+)
+from .db_pool import ConnectionPool, PooledConnection, DBPoolError
+from .bulk_write import BatchWriter, chunked, ci_key, fetch_in
+from .blob_store import (
+    FilesystemBlobStore, S3BlobStore, BlobStoreError, CertificateBlobMigrator, create_blob_store,
+    blob_key, blob_digest, digest_from_key, migrate_certificate_blobs, check_migration_target,
+)
+from .http_delivery import (
+    RangeNotSatisfiable, strong_etag, file_validator, etag_matches, if_range_allows, parse_range, iter_stream,
+    content_disposition, CACHE_IMMUTABLE, CACHE_REVALIDATE,
+)
+from .export_stream import (
+    FORMATS as EXPORT_FORMATS, CONTENT_TYPES as EXPORT_CONTENT_TYPES, fetch_iter, group_consecutive,
+    make_encoder, encode_stream, gzip_stream, accepts_gzip, zip_stream,
+)
+from .sql_dump import (
+    SqlExpr, sql_literal, insert_statements, tsv_field, tsv_lines, load_data_statement, chunked_iter,
+)
+from .pagination import (
+    encode_cursor, decode_cursor, parse_fields, parse_sort, keyset_order, keyset_predicate,
+)
+from .latest_calibration import (
+    LatestCalibrationReconciler, LATEST_CALIBRATION_JOIN, ensure_latest_calibration_table,
+    refresh_latest_calibrations, reconcile_latest_calibrations, backfill_latest_calibrations,
+)
+from .periodic import PeriodicDbJob
+from .instrument_search import (
+    SearchIndexReconciler, SEARCH_JOIN, fold_text, build_search_text, search_predicate,
+    ensure_search_table, refresh_search_index, reconcile_search_index,
+)
+from .hot_queries import (
+    is_truthy_filter, normalize_filter_date, apply_instrument_filters, instrument_page_query,
+    instrument_list_query, check_queries, SEARCH_FIELDS, SEARCH_DEFAULT_FIELDS, SEARCH_SORTS,
+    LIST_FIELDS, LIST_SORTS, LIST_COUNT_SQL, FIRST_GRANDEZA_SQL, EXISTING_INSTRUMENTS_SQL,
+    EXISTING_CALIBRATIONS_SQL, EXPORT_SQL, CERTIFICATE_SQL, CERTIFICATE_CONTENT_SQL,
+)
+from .geo_index import LabGeoIndex, haversine_km
+from .lab_catalog import LabCatalog
+from .compact_docs import LazyDocs, pack_doc, unpack_doc, compact_json
+from .timing import (
+    StageHistogram, medir_etapa, registrar_etapa, registrar_bytes, resumir_etapas, percentil,
+)
+
+__all__ = [
+    'JobStore', 'TaskBoard', 'ExtractionScheduler', 'PRIORIDADE_INTERATIVA', 'PRIORIDADE_LOTE',
+    'SingleFlight', 'ChunkedUploadManager', 'ChunkedUploadError', 'TaskInbox', 'iter_zip_pdfs',
+    'HotFolderWatcher', 'acquire_single_instance_lock', 'UrlFetcher', 'UrlFetchError',
+    'StageHistogram', 'medir_etapa', 'registrar_etapa', 'registrar_bytes', 'resumir_etapas', 'percentil',
+    'SessionStore', 'MemoryBackend', 'SQLiteBackend', 'RedisBackend', 'create_session_store',
+    'LazyDocs', 'pack_doc', 'unpack_doc', 'compact_json',
+    'ConnectionPool', 'PooledConnection', 'DBPoolError',
+    'BatchWriter', 'chunked', 'ci_key', 'fetch_in',
+    'FilesystemBlobStore', 'S3BlobStore', 'BlobStoreError', 'CertificateBlobMigrator', 'create_blob_store',
+    'blob_key', 'blob_digest', 'digest_from_key', 'migrate_certificate_blobs', 'check_migration_target',
+    'RangeNotSatisfiable', 'strong_etag', 'file_validator', 'etag_matches', 'if_range_allows', 'parse_range', 'iter_stream',
+    'content_disposition', 'CACHE_IMMUTABLE', 'CACHE_REVALIDATE',
+    'EXPORT_FORMATS', 'EXPORT_CONTENT_TYPES', 'fetch_iter', 'group_consecutive', 'make_encoder',
+    'encode_stream', 'gzip_stream', 'accepts_gzip', 'zip_stream',
+    'SqlExpr', 'sql_literal', 'insert_statements', 'tsv_field', 'tsv_lines', 'load_data_statement',
+    'chunked_iter',
+    'encode_cursor', 'decode_cursor', 'parse_fields', 'parse_sort', 'keyset_order', 'keyset_predicate',
+    'LatestCalibrationReconciler', 'LATEST_CALIBRATION_JOIN', 'ensure_latest_calibration_table',
+    'refresh_latest_calibrations', 'reconcile_latest_calibrations', 'backfill_latest_calibrations',
+    'PeriodicDbJob',
+    'SearchIndexReconciler', 'SEARCH_JOIN', 'fold_text', 'build_search_text', 'search_predicate',
+    'ensure_search_table', 'refresh_search_index', 'reconcile_search_index',
+    'is_truthy_filter', 'normalize_filter_date', 'apply_instrument_filters', 'instrument_page_query',
+    'instrument_list_query', 'check_queries', 'SEARCH_FIELDS', 'SEARCH_DEFAULT_FIELDS', 'SEARCH_SORTS',
+    'LIST_FIELDS', 'LIST_SORTS', 'LIST_COUNT_SQL', 'FIRST_GRANDEZA_SQL', 'EXISTING_INSTRUMENTS_SQL',
+    'EXISTING_CALIBRATIONS_SQL', 'EXPORT_SQL', 'CERTIFICATE_SQL', 'CERTIFICATE_CONTENT_SQL',
+    'LabGeoIndex', 'haversine_km', 'LabCatalog',
+]
@@ -0,0 +1,375 @@
+"""
+Blob Store
+PDFs de certificado enderecados pelo SHA-256 do conteudo: o mesmo arquivo
+enviado para varias calibracoes e guardado uma vez. Backend em disco (pode
+ser o storage do Laravel) ou object store compativel com S3, sem SDK
+"""
+
+import os
+import re
+import hmac
+import time
+import hashlib
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+from typing import BinaryIO, Dict, Optional
+
+from .periodic import PeriodicDbJob
+
+DEFAULT_PREFIX = 'certificados'
+
+_CHAVE_BLOB = re.compile(r'^[^/]+(?:/[^/]+)*/([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})\.pdf$')
+_SHA256_VAZIO = hashlib.sha256(b'').hexdigest()
+
+
+class BlobStoreError(Exception):
+    """Falha de leitura/gravacao no backend de blobs"""
+
+
+def blob_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_key(digest: str, prefix: str = DEFAULT_PREFIX) -> str:
+    """Caminho relativo do blob: certificados/ab/cd/abcd....pdf (gravado em certificados.arquivo_pdf)"""
+    return f"{prefix}/{digest[:2]}/{digest[2:4]}/{digest}.pdf"
+
+
+def digest_from_key(chave: Optional[str]) -> Optional[str]:
+    """SHA-256 de um caminho gerado por blob_key (None para nomes antigos, ex.: MD5 de timestamp)"""
+    if not chave:
+        return None
+    achado = _CHAVE_BLOB.match(chave)
+    if not achado or not achado.group(3).startswith(achado.group(1) + achado.group(2)):
+        return None
+    return achado.group(3)
+
+
+class _BaseBlobStore:
+    """Contadores comuns; subclasses implementam _existe, _gravar, _tamanho e _abrir"""
+
+    name = 'base'
+
+    def __init__(self, prefix: str = DEFAULT_PREFIX):
+        self.prefix = prefix.strip('/') or DEFAULT_PREFIX
+        self._lock = threading.Lock()
+        self._stats = {'puts': 0, 'dedup_hits': 0, 'bytes_written': 0, 'reads': 0, 'errors': 0}
+
+    def key(self, digest: str) -> str:
+        return blob_key(digest, self.prefix)
+
+    def put(self, data: bytes) -> str:
+        """Grava o conteudo (se ainda nao existir) e retorna a chave relativa"""
+        digest = blob_digest(data)
+        chave = self.key(digest)
+        try:
+            if self._existe(chave):
+                with self._lock:
+                    self._stats['dedup_hits'] += 1
+                return chave
+            self._gravar(chave, data, digest)
+        except BlobStoreError:
+            self._contar_erro()
+            raise
+        except Exception as e:
+            self._contar_erro()
+            raise BlobStoreError(f"Falha ao gravar {chave}: {e}") from e
+        with self._lock:
+            self._stats['puts'] += 1
+            self._stats['bytes_written'] += len(data)
+        return chave
+
+    def available(self) -> bool:
+        """Backend pronto para gravar (em disco: a pasta raiz existe)"""
+        return True
+
+    def exists(self, chave: str) -> bool:
+        return self._existe(chave)
+
+    def size(self, chave: str) -> Optional[int]:
+        return self._tamanho(chave)
+
+    def open(self, chave: str, start: int = 0, length: Optional[int] = None) -> BinaryIO:
+        """Stream binario do blob a partir de `start` (ate `length` bytes; None = ate o fim)"""
+        with self._lock:
+            self._stats['reads'] += 1
+        try:
+            return self._abrir(chave, start, length)
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            self._contar_erro()
+            raise BlobStoreError(f"Falha ao ler {chave}: {e}") from e
+
+    def read(self, chave: str) -> bytes:
+        with self.open(chave) as f:
+            return f.read()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'backend': self.name, 'prefix': self.prefix, **self._stats}
+
+    def _contar_erro(self):
+        with self._lock:
+            self._stats['errors'] += 1
+
+
+class FilesystemBlobStore(_BaseBlobStore):
+    """Blobs em <root>/<chave>; gravacao atomica (arquivo temporario + rename)"""
+
+    name = 'filesystem'
+
+    def __init__(self, root: str, prefix: str = DEFAULT_PREFIX):
+        super().__init__(prefix)
+        self.root = root
+
+    def path(self, chave: str) -> str:
+        return os.path.join(self.root, *chave.split('/'))
+
+    def _existe(self, chave: str) -> bool:
+        return os.path.isfile(self.path(chave))
+
+    def _tamanho(self, chave: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.path(chave))
+        except OSError:
+            return None
+
+    def available(self) -> bool:
+        return os.path.isdir(self.root)
+
+    def _gravar(self, chave: str, data: bytes, digest: str):
+        if not self.available():
+            # Nunca cria a raiz: um caminho de outro sistema (C:/xampp/...) viraria pasta relativa
+            raise BlobStoreError(f"Pasta do blob store nao existe: {self.root}")
+        destino = self.path(chave)
+        pasta = os.path.dirname(destino)
+        os.makedirs(pasta, exist_ok=True)
+        fd, temporario = tempfile.mkstemp(prefix='.blob-', dir=pasta)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporario, destino)
+        except BaseException:
+            try:
+                os.unlink(temporario)
+            except OSError:
+                pass
+            raise
+
+    def _abrir(self, chave: str, start: int, length: Optional[int]) -> BinaryIO:
+        f = open(self.path(chave), 'rb')
+        if start:
+            f.seek(start)
+        return f if length is None else _Limitado(f, length)
+
+
+class S3BlobStore(_BaseBlobStore):
+    """Object store compativel com S3 (AWS, MinIO, R2...), path-style, assinatura SigV4"""
+
+    name = 's3'
+
+    def __init__(self, bucket: str, endpoint: str, access_key: str, secret_key: str,
+                 region: str = 'us-east-1', prefix: str = DEFAULT_PREFIX, timeout: float = 30.0):
+        super().__init__(prefix)
+        self.bucket = bucket
+        self.endpoint = endpoint.rstrip('/')
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.timeout = timeout
+
+    def _existe(self, chave: str) -> bool:
+        return self._tamanho(chave) is not None
+
+    def _tamanho(self, chave: str) -> Optional[int]:
+        try:
+            with self._requisicao('HEAD', chave) as resp:
+                return int(resp.headers.get('Content-Length') or 0)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def _gravar(self, chave: str, data: bytes, digest: str):
+        with self._requisicao('PUT', chave, data=data, payload_hash=digest,
+                              headers={'Content-Type': 'application/pdf'}):
+            pass
+
+    def _abrir(self, chave: str, start: int, length: Optional[int]) -> BinaryIO:
+        headers = {}
+        if start or length is not None:
+            fim = '' if length is None else str(start + length - 1)
+            headers['Range'] = f'bytes={start}-{fim}'
+        try:
+            return self._requisicao('GET', chave, headers=headers)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise FileNotFoundError(chave) from e
+            raise
+
+    def _requisicao(self, metodo: str, chave: str, data: Optional[bytes] = None,
+                    payload_hash: str = _SHA256_VAZIO, headers: Optional[Dict] = None):
+        caminho = urllib.parse.quote(f"/{self.bucket}/{chave}", safe='/~')
+        agora = datetime.now(timezone.utc)
+        amz_date = agora.strftime('%Y%m%dT%H%M%SZ')
+        dia = agora.strftime('%Y%m%d')
+        assinados = {
+            'host': urllib.parse.urlparse(self.endpoint).netloc,
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+            **{k.lower(): v for k, v in (headers or {}).items()},
+        }
+        nomes = ';'.join(sorted(assinados))
+        canonico = '\n'.join([
+            metodo, caminho, '',
+            ''.join(f"{k}:{str(assinados[k]).strip()}\n" for k in sorted(assinados)),
+            nomes, payload_hash,
+        ])
+        escopo = f"{dia}/{self.region}/s3/aws4_request"
+        a_assinar = '\n'.join(['AWS4-HMAC-SHA256', amz_date, escopo,
+                               hashlib.sha256(canonico.encode()).hexdigest()])
+        chave_hmac = ('AWS4' + self.secret_key).encode()
+        for parte in (dia, self.region, 's3', 'aws4_request'):
+            chave_hmac = hmac.new(chave_hmac, parte.encode(), hashlib.sha256).digest()
+        assinatura = hmac.new(chave_hmac, a_assinar.encode(), hashlib.sha256).hexdigest()
+        assinados['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{escopo}, "
+                                      f"SignedHeaders={nomes}, Signature={assinatura}")
+        req = urllib.request.Request(self.endpoint + caminho, data=data, method=metodo, headers=assinados)
+        return urllib.request.urlopen(req, timeout=self.timeout)
+
+
+class _Limitado:
+    """Le no maximo `restante` bytes de um arquivo (faixa de um Range)"""
+
+    def __init__(self, f: BinaryIO, restante: int):
+        self._f = f
+        self._restante = max(0, restante)
+
+    def read(self, n: int = -1) -> bytes:
+        if self._restante <= 0:
+            return b''
+        n = self._restante if n is None or n < 0 else min(n, self._restante)
+        dados = self._f.read(n)
+        self._restante -= len(dados)
+        return dados
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def create_blob_store(location: str, prefix: str = DEFAULT_PREFIX, endpoint: str = '',
+                      access_key: str = '', secret_key: str = '', region: str = 'us-east-1'):
+    """
+    Monta o blob store a partir da configuracao
+
+    Args:
+        location: Pasta raiz (ou file:///pasta) ou s3://bucket
+        prefix: Primeiro nivel das chaves (certificados/...)
+        endpoint: URL do object store (ex.: https://s3.sa-east-1.amazonaws.com)
+    """
+    if location.startswith('s3://'):
+        bucket = location[len('s3://'):].strip('/')
+        return S3BlobStore(bucket, endpoint or f'https://s3.{region}.amazonaws.com', access_key, secret_key,
+                           region=region, prefix=prefix)
+    if location.startswith('file://'):
+        location = location[len('file://'):]
+    return FilesystemBlobStore(location, prefix=prefix)
+
+
+def check_migration_target(store):
+    """
+    Confere se o store pode receber os PDFs que hoje estao no banco
+
+    A migracao apaga certificados.pdf_content e o Laravel passa a ler o PDF
+    de arquivo_pdf no storage dele: so vale para um store em disco que ja
+    existe (a pasta do storage do Laravel).
+
+    Raises:
+        BlobStoreError: store remoto ou pasta raiz inexistente
+    """
+    if not isinstance(store, FilesystemBlobStore):
+        raise BlobStoreError("Migracao recusada: o Laravel nao le arquivo_pdf de um object store")
+    if not store.available():
+        raise BlobStoreError(f"Migracao recusada: pasta do blob store nao existe ({store.root})")
+
+
+def migrate_certificate_blobs(pool, store, batch_size: int = 200) -> Dict:
+    """
+    Move certificados.pdf_content (base64) para o blob store
+
+    Cada lote: le os PDFs ainda no banco, grava no store, le de volta e
+    confere o SHA-256, e so entao troca a linha para arquivo_pdf = chave,
+    pdf_content = NULL, pdf_in_database = 0. Linhas com base64 invalido ou
+    blob que nao confere ficam no banco ('invalid' / 'unverified').
+    """
+    import base64
+    import binascii
+
+    check_migration_target(store)
+    inicio = time.perf_counter()
+    ultimo_id, movidos, bytes_movidos, invalidos, nao_conferidos = 0, 0, 0, 0, 0
+    while True:
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, pdf_content FROM certificados
+                WHERE id > %s AND pdf_in_database = 1 AND pdf_content IS NOT NULL
+                ORDER BY id LIMIT %s
+            """, (ultimo_id, batch_size))
+            linhas = cursor.fetchall()
+            trocas = []
+            for cert_id, conteudo in linhas:
+                ultimo_id = cert_id
+                try:
+                    pdf_bytes = base64.b64decode(conteudo, validate=False)
+                except (binascii.Error, ValueError, TypeError):
+                    invalidos += 1
+                    continue
+                if not pdf_bytes:
+                    invalidos += 1
+                    continue
+                digest = blob_digest(pdf_bytes)
+                chave = store.put(pdf_bytes)
+                try:
+                    conferido = blob_digest(store.read(chave)) == digest
+                except (BlobStoreError, OSError):
+                    conferido = False
+                if not conferido:
+                    print(f"[CERT-BLOB] Certificado #{cert_id}: blob {chave} nao confere, mantido no banco")
+                    nao_conferidos += 1
+                    continue
+                trocas.append((chave, cert_id))
+                bytes_movidos += len(pdf_bytes)
+            if trocas:
+                cursor.executemany("""
+                    UPDATE certificados SET arquivo_pdf = %s, pdf_content = NULL, pdf_in_database = 0
+                    WHERE id = %s
+                """, trocas)
+                movidos += len(trocas)
+            conn.commit()
+            cursor.close()
+        if len(linhas) < batch_size:
+            break
+    return {'moved': movidos, 'bytes': bytes_movidos, 'invalid': invalidos, 'unverified': nao_conferidos,
+            'seconds': round(time.perf_counter() - inicio, 3)}
+
+
+class CertificateBlobMigrator(PeriodicDbJob):
+    """Migracao periodica dos PDFs que ainda estao em certificados.pdf_content"""
+
+    def __init__(self, pool, store, interval: float = 3600.0, batch_size: int = 200):
+        super().__init__(pool, lambda p, b: migrate_certificate_blobs(p, store, b),
+                         name='metron-certificados-blob', interval=interval, batch_size=batch_size)
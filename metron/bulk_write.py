@@ -0,0 +1,102 @@
+"""
+Bulk Write
+Gravacao em lote no MySQL: linhas acumuladas por comando e enviadas com
+executemany (o mysql-connector junta INSERT ... VALUES em um unico INSERT de
+varias linhas) e consultas IN fatiadas para pre-buscar um lote inteiro
+"""
+
+import unicodedata
+from typing import Dict, Iterable, Iterator, List, Sequence
+
+# Maximo de valores em um IN (...) ou de linhas em um INSERT de varias linhas
+MAX_IN = 1000
+
+
+def chunked(itens: Sequence, size: int) -> Iterator[List]:
+    """Fatias consecutivas de ate `size` itens"""
+    size = max(1, int(size))
+    for inicio in range(0, len(itens), size):
+        yield list(itens[inicio:inicio + size])
+
+
+def ci_key(valor) -> str:
+    """Chave de comparacao como a collation utf8mb4_*_ci: sem caixa, sem acento, sem espaco no fim"""
+    if valor is None:
+        return ''
+    decomposto = unicodedata.normalize('NFKD', str(valor))
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold().rstrip()
+
+
+def fetch_in(cursor, sql: str, valores: Iterable, params: Sequence = (), size: int = MAX_IN) -> List:
+    """
+    Roda `sql` com {marcadores} trocado por fatias de `valores`
+
+    Args:
+        sql: Consulta com "IN ({marcadores})"
+        valores: Valores do IN (repetidos sao descartados)
+        params: Parametros que vem antes do IN na consulta
+    """
+    unicos = list(dict.fromkeys(v for v in valores if v is not None))
+    linhas = []
+    for fatia in chunked(unicos, size):
+        cursor.execute(sql.format(marcadores=', '.join(['%s'] * len(fatia))), tuple(params) + tuple(fatia))
+        linhas.extend(cursor.fetchall())
+    return linhas
+
+
+class BatchWriter:
+    """Acumula linhas por comando SQL e grava tudo com executemany no flush().
+
+    Os comandos sao gravados na ordem em que apareceram pela primeira vez,
+    em executemany de ate `max_rows` linhas. Nada vai ao banco antes do
+    flush(), entao um erro ali pertence ao lote inteiro.
+    """
+
+    def __init__(self, cursor, max_rows: int = MAX_IN):
+        self.cursor = cursor
+        self.max_rows = max_rows
+        self._pendentes: Dict[str, List[Sequence]] = {}
+        self.rows_written = 0
+        self.statements = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(linhas) for linhas in self._pendentes.values())
+
+    def add(self, sql: str, row: Sequence):
+        self._pendentes.setdefault(sql, []).append(row)
+
+    def flush(self) -> int:
+        """Grava o que esta pendente; retorna quantas linhas foram gravadas"""
+        total = 0
+        while self._pendentes:
+            sql = next(iter(self._pendentes))
+            linhas = self._pendentes.pop(sql)
+            for fatia in chunked(linhas, self.max_rows):
+                self._gravar(sql, fatia)
+            total += len(linhas)
+        return total
+
+    def discard(self):
+        """Descarta o pendente (apos rollback)"""
+        self._pendentes.clear()
+
+    def mark(self) -> Dict[str, int]:
+        """Posicao atual do pendente, para rollback_to() (par de um SAVEPOINT)"""
+        return {sql: len(linhas) for sql, linhas in self._pendentes.items()}
+
+    def rollback_to(self, marca: Dict[str, int]):
+        """Descarta as linhas acumuladas depois de mark()"""
+        for sql in list(self._pendentes):
+            manter = marca.get(sql, 0)
+            if manter:
+                del self._pendentes[sql][manter:]
+            else:
+                del self._pendentes[sql]
+
+    def _gravar(self, sql: str, linhas: List[Sequence]):
+        if not linhas:
+            return
+        self.cursor.executemany(sql, linhas)
+        self.rows_written += len(linhas)
+        self.statements += 1
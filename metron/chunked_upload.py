@@ -0,0 +1,365 @@
+"""
+Chunked Upload
+Upload retomavel em partes: init -> PUT das partes por offset -> finalize.
+Cada arquivo (PDF ou ZIP de PDFs) e validado e tem o SHA-256 calculado
+conforme as partes chegam.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import threading
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+
+class ChunkedUploadError(Exception):
+    """Erro de protocolo do upload em partes (offset, tamanho, conteudo)"""
+
+    def __init__(self, message: str, status: int = 400, expected_offset: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.expected_offset = expected_offset
+
+
+class ChunkedUploadManager:
+    """Recebe arquivos grandes em partes sequenciais.
+
+    O estado de cada upload fica num arquivo JSON ao lado das partes e e
+    sempre relido do disco (com `received` recalculado pelo tamanho das
+    partes), entao qualquer worker, ou o mesmo depois de reiniciar, continua
+    um upload de onde parou: o cliente consulta `status()` e reenvia a partir
+    de `received`. Cada upload tem a sua trava (thread + arquivo); o lock do
+    gerenciador so protege os dicionarios internos, nunca I/O de partes.
+    """
+
+    PDF_MAGIC = b'%PDF-'
+    ZIP_MAGIC = b'PK\x03\x04'
+
+    def __init__(self, base_dir: Optional[str] = None, max_file_bytes: int = 100 * 1024 * 1024,
+                 ttl_seconds: int = 24 * 3600):
+        """
+        Inicializa o gerenciador
+
+        Args:
+            base_dir: Diretorio das partes (padrao: temp/metron_chunked)
+            max_file_bytes: Tamanho maximo aceito por arquivo
+            ttl_seconds: Uploads nao finalizados expiram apos este tempo sem atividade
+        """
+        self.base_dir = base_dir or os.path.join(tempfile.gettempdir(), 'metron_chunked')
+        self.max_file_bytes = max_file_bytes
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._upload_locks = {}  # {upload_id: threading.Lock}
+        self._hashers = {}       # {(upload_id, file_id): (hashlib.sha256, bytes ja somados)}
+
+    # ------------------------------------------------------------------
+    # Protocolo
+    # ------------------------------------------------------------------
+    def init_upload(self, files: List[Dict], owner: str = '', task_id: str = '') -> Dict:
+        """
+        Abre um upload
+
+        Args:
+            files: [{'name', 'size', 'sha256' (opcional)}]
+            owner: Sessao dona do upload
+            task_id: Tarefa de extracao que recebera os arquivos completos
+
+        Returns:
+            Estado publico do upload (upload_id e file_id de cada arquivo)
+        """
+        if not files:
+            raise ChunkedUploadError('Nenhum arquivo informado')
+
+        self._sweep_expired()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.base_dir, upload_id), exist_ok=True)
+
+        entries = []
+        for i, f in enumerate(files):
+            size = int(f.get('size') or 0)
+            if size <= 0 or size > self.max_file_bytes:
+                raise ChunkedUploadError(f"Tamanho invalido para '{f.get('name')}': {size} bytes")
+            entries.append({
+                'file_id': str(i),
+                'name': f.get('name') or f'arquivo_{i + 1}.pdf',
+                'size': size,
+                'sha256_expected': (f.get('sha256') or '').lower() or None,
+                'received': 0,
+                'complete': False,
+                'sha256': None,
+            })
+
+        state = {
+            'upload_id': upload_id,
+            'owner': owner,
+            'task_id': task_id,
+            'files': entries,
+            'finalized': False,
+            'updated_at': time.time(),
+        }
+        with self._travado(upload_id):
+            self._persist(state)
+        return self._public(state)
+
+    def write_chunk(self, upload_id: str, file_id: str, offset: int, data: bytes) -> Tuple[Dict, Optional[Dict]]:
+        """
+        Grava uma parte de um arquivo
+
+        Args:
+            upload_id: ID do upload
+            file_id: ID do arquivo dentro do upload
+            offset: Posicao da parte no arquivo (deve ser igual ao ja recebido)
+            data: Bytes da parte
+
+        Returns:
+            (estado publico do arquivo, dados do arquivo completo ou None).
+            Os dados do arquivo completo trazem 'path', 'name' e 'sha256'.
+        """
+        with self._travado(upload_id):
+            state = self._load(upload_id)
+            entry = self._entry(state, file_id)
+            if state['finalized']:
+                raise ChunkedUploadError('Upload ja finalizado', status=409)
+            if entry['complete']:
+                return self._public_entry(entry), None
+            if offset != entry['received']:
+                raise ChunkedUploadError('Offset fora de ordem', status=409,
+                                         expected_offset=entry['received'])
+            if entry['received'] + len(data) > entry['size']:
+                raise ChunkedUploadError('Parte excede o tamanho declarado do arquivo', status=413)
+            if offset == 0 and not data.startswith(self._magic(entry['name'])):
+                raise ChunkedUploadError(f"'{entry['name']}' nao e um PDF ou ZIP valido", status=415)
+
+            path = self._part_path(upload_id, file_id)
+            hasher = self._hasher(upload_id, file_id, path, entry['received'])
+            with open(path, 'ab') as f:
+                f.write(data)
+            hasher.update(data)
+            entry['received'] += len(data)
+            self._hashers_set(upload_id, file_id, hasher, entry['received'])
+            state['updated_at'] = time.time()
+
+            concluido = None
+            if entry['received'] == entry['size']:
+                digest = hasher.hexdigest()
+                self._hashers_pop(upload_id, file_id)
+                if entry['sha256_expected'] and entry['sha256_expected'] != digest:
+                    # Descarta o arquivo corrompido para o cliente reenviar do zero
+                    entry['received'] = 0
+                    self._remove_file(path)
+                    self._persist(state)
+                    raise ChunkedUploadError(f"SHA-256 nao confere para '{entry['name']}'",
+                                             status=422, expected_offset=0)
+                entry['complete'] = True
+                entry['sha256'] = digest
+                # Extensao final para o leitor de PDF (ou ZIP) reconhecer o arquivo
+                final_path = path[:-len('.part')] + ('.zip' if self._is_zip(entry['name']) else '.pdf')
+                os.replace(path, final_path)
+                concluido = {'path': final_path, 'name': entry['name'], 'sha256': digest}
+
+            self._persist(state)
+            return self._public_entry(entry), concluido
+
+    def status(self, upload_id: str) -> Dict:
+        with self._travado(upload_id):
+            return self._public(self._load(upload_id))
+
+    def owner_of(self, upload_id: str) -> str:
+        with self._travado(upload_id):
+            return self._load(upload_id).get('owner', '')
+
+    def reopen(self, upload_id: str, file_id: str) -> Dict:
+        """Volta um arquivo completo para 'nao recebido' (o cliente reenvia do offset 0)"""
+        with self._travado(upload_id):
+            state = self._load(upload_id)
+            entry = self._entry(state, file_id)
+            base = self._part_path(upload_id, entry['file_id'])[:-len('.part')]
+            for ext in ('.part', '.pdf', '.zip'):
+                self._remove_file(base + ext)
+            self._hashers_pop(upload_id, entry['file_id'])
+            entry.update(received=0, complete=False, sha256=None)
+            state['updated_at'] = time.time()
+            self._persist(state)
+            return self._public_entry(entry)
+
+    def finalize(self, upload_id: str) -> Dict:
+        """Fecha o upload; arquivos incompletos sao descartados"""
+        with self._travado(upload_id):
+            state = self._load(upload_id)
+            state['finalized'] = True
+            for entry in state['files']:
+                if not entry['complete']:
+                    self._hashers_pop(upload_id, entry['file_id'])
+                    self._remove_file(self._part_path(upload_id, entry['file_id']))
+            self._persist(state)
+            return self._public(state)
+
+    def discard(self, upload_id: str):
+        """Remove o estado e as partes de um upload"""
+        with self._travado(upload_id):
+            with self._lock:
+                for key in [k for k in self._hashers if k[0] == upload_id]:
+                    self._hashers.pop(key, None)
+            pasta = os.path.join(self.base_dir, upload_id)
+            if os.path.isdir(pasta):
+                for nome in os.listdir(pasta):
+                    if nome != 'upload.lock':
+                        self._remove_file(os.path.join(pasta, nome))
+        # A trava sai por ultimo (um worker esperando nela acha o upload sem manifesto: 404)
+        self._remove_file(self._lock_path(upload_id))
+        try:
+            os.rmdir(os.path.join(self.base_dir, upload_id))
+        except OSError:
+            pass
+        with self._lock:
+            self._upload_locks.pop(upload_id, None)
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _is_zip(name: str) -> bool:
+        return (name or '').lower().endswith('.zip')
+
+    def _magic(self, name: str) -> bytes:
+        return self.ZIP_MAGIC if self._is_zip(name) else self.PDF_MAGIC
+
+    def _part_path(self, upload_id: str, file_id: str) -> str:
+        return os.path.join(self.base_dir, upload_id, f'{file_id}.part')
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.base_dir, upload_id, 'upload.json')
+
+    def _lock_path(self, upload_id: str) -> str:
+        return os.path.join(self.base_dir, upload_id, 'upload.lock')
+
+    @contextmanager
+    def _travado(self, upload_id: str):
+        """Trava do upload: entre threads deste processo e entre workers (trava de arquivo)"""
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
+            raise ChunkedUploadError('Upload nao encontrado', status=404)
+        with self._lock:
+            trava = self._upload_locks.setdefault(upload_id, threading.Lock())
+        with trava:
+            try:
+                f = open(self._lock_path(upload_id), 'a+')
+            except FileNotFoundError:
+                raise ChunkedUploadError('Upload nao encontrado', status=404)
+            with f:
+                _travar_arquivo(f)
+                try:
+                    yield
+                finally:
+                    _destravar_arquivo(f)
+
+    def _persist(self, state: Dict):
+        # Gravacao atomica: outro worker pode estar lendo o manifesto
+        meta = self._meta_path(state['upload_id'])
+        temporario = f"{meta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temporario, meta)
+
+    def _load(self, upload_id: str) -> Dict:
+        """Estado do disco (fonte da verdade entre workers); chamar com a trava do upload"""
+        meta = self._meta_path(upload_id)
+        if not os.path.exists(meta):
+            raise ChunkedUploadError('Upload nao encontrado', status=404)
+        with open(meta, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        for entry in state['files']:
+            path = self._part_path(upload_id, entry['file_id'])
+            if not entry['complete']:
+                entry['received'] = os.path.getsize(path) if os.path.exists(path) else 0
+        return state
+
+    @staticmethod
+    def _entry(state: Dict, file_id: str) -> Dict:
+        for entry in state['files']:
+            if entry['file_id'] == str(file_id):
+                return entry
+        raise ChunkedUploadError('Arquivo nao encontrado no upload', status=404)
+
+    def _hasher(self, upload_id: str, file_id: str, path: str, received: int):
+        with self._lock:
+            hasher, somados = self._hashers.get((upload_id, file_id), (None, -1))
+        if hasher is None or somados != received:
+            # Sem hash em memoria (retomada, ou partes gravadas por outro worker):
+            # recalcula sobre o que ja esta em disco
+            hasher = hashlib.sha256()
+            if received and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                        hasher.update(bloco)
+        return hasher
+
+    def _hashers_set(self, upload_id: str, file_id: str, hasher, somados: int):
+        with self._lock:
+            self._hashers[(upload_id, file_id)] = (hasher, somados)
+
+    def _hashers_pop(self, upload_id: str, file_id: str):
+        with self._lock:
+            self._hashers.pop((upload_id, file_id), None)
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _sweep_expired(self):
+        # Pelo manifesto em disco: vale para uploads abertos por qualquer worker
+        agora = time.time()
+        try:
+            nomes = os.listdir(self.base_dir)
+        except OSError:
+            return
+        for uid in nomes:
+            try:
+                parado = agora - os.path.getmtime(self._meta_path(uid)) > self.ttl_seconds
+            except OSError:
+                continue
+            if parado:
+                try:
+                    self.discard(uid)
+                except ChunkedUploadError:
+                    pass
+
+    @staticmethod
+    def _public_entry(entry: Dict) -> Dict:
+        return {k: entry[k] for k in ('file_id', 'name', 'size', 'received', 'complete', 'sha256')}
+
+    def _public(self, state: Dict) -> Dict:
+        return {
+            'upload_id': state['upload_id'],
+            'task_id': state.get('task_id'),
+            'finalized': state['finalized'],
+            'files': [self._public_entry(e) for e in state['files']],
+        }
+
+
+def _travar_arquivo(f):
+    try:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    except ImportError:
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _destravar_arquivo(f):
+    try:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    except ImportError:
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
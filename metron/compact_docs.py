@@ -0,0 +1,75 @@
+"""
+Compact Docs
+Representacao compacta dos documentos extraidos em cache: cada documento
+vira o JSON compacto comprimido com zlib e so e decodificado quando lido
+"""
+
+import json
+import zlib
+from collections.abc import Sequence
+from typing import Dict, List
+
+COMPRESS_LEVEL = 6
+
+
+def pack_doc(doc) -> bytes:
+    """Documento -> JSON compacto comprimido"""
+    texto = json.dumps(doc, ensure_ascii=False, separators=(',', ':'), default=str)
+    return zlib.compress(texto.encode('utf-8'), COMPRESS_LEVEL)
+
+
+def unpack_json(blob: bytes) -> str:
+    """Blob -> JSON compacto (sem montar os objetos Python)"""
+    return zlib.decompress(blob).decode('utf-8')
+
+
+def unpack_doc(blob: bytes):
+    return json.loads(unpack_json(blob))
+
+
+def compact_json(docs) -> str:
+    """JSON compacto de uma lista de documentos (LazyDocs ou lista comum)"""
+    if isinstance(docs, LazyDocs):
+        return docs.compact_json()
+    return json.dumps(list(docs or []), ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class LazyDocs(Sequence):
+    """Lista somente-leitura de documentos guardados comprimidos.
+
+    Cada item so e decodificado quando acessado, e cada acesso devolve uma
+    copia nova (alterar o dict nao altera o cache). compact_json() monta o
+    JSON da lista inteira direto dos blobs, sem criar os dicts, para o
+    contexto do prompt do chat; o texto fica guardado no objeto.
+    """
+
+    __slots__ = ('_blobs', '_json')
+
+    def __init__(self, blobs: List[bytes]):
+        self._blobs = list(blobs)
+        self._json = None
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self._blobs)))]
+        return unpack_doc(self._blobs[idx])
+
+    def to_list(self) -> List[Dict]:
+        """Todos os documentos decodificados (copias, podem ser alteradas)"""
+        return [unpack_doc(b) for b in self._blobs]
+
+    def compact_json(self) -> str:
+        if self._json is None:
+            self._json = '[' + ','.join(unpack_json(b) for b in self._blobs) + ']'
+        return self._json
+
+    @property
+    def blobs(self) -> List[bytes]:
+        return list(self._blobs)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(b) for b in self._blobs)
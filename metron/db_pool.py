@@ -0,0 +1,266 @@
+"""
+DB Pool
+Pool de conexoes MySQL por processo: conexoes reaproveitadas entre rotas,
+teste de saude na retirada, reconexao automatica e cursores com contexto
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from .timing import percentil
+
+
+class DBPoolError(Exception):
+    """Nenhuma conexao livre dentro do tempo de espera"""
+
+
+class PooledConnection:
+    """Conexao emprestada do pool.
+
+    Repassa tudo para a conexao do mysql.connector; close() devolve a
+    conexao ao pool em vez de fecha-la (pode ser chamado mais de uma vez).
+    """
+
+    __slots__ = ('_pool', '_raw', '_ativa')
+
+    def __init__(self, pool: 'ConnectionPool', raw):
+        self._pool = pool
+        self._raw = raw
+        self._ativa = True
+
+    def __getattr__(self, nome):
+        return getattr(self._raw, nome)
+
+    def close(self):
+        if self._ativa:
+            self._ativa = False
+            self._pool._devolver(self._raw)
+
+    def discard(self):
+        """Fecha a conexao em vez de devolver (ex.: leitura sem buffer abandonada no meio)"""
+        if self._ativa:
+            self._ativa = False
+            self._pool._descartar(self._raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            try:
+                self._raw.rollback()
+            except Exception:
+                pass
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """Conexoes MySQL reaproveitadas pelas rotas e helpers do app.
+
+    Cada worker (processo) tem o seu pool; depois de um fork o pool herdado
+    e descartado e recriado. Conexoes paradas ha mais de `health_check_after`
+    segundos sao testadas com ping na retirada e reabertas se cairam. Toda
+    conexao devolvida recebe rollback, para nao carregar transacao aberta
+    (nem o snapshot de leitura do REPEATABLE READ) para o proximo uso.
+    """
+
+    def __init__(self, config: Dict, size: int = 5, checkout_timeout: float = 10.0,
+                 health_check_after: float = 30.0, connect: Optional[Callable] = None):
+        """
+        Inicializa o pool (as conexoes sao abertas sob demanda)
+
+        Args:
+            config: Parametros de mysql.connector.connect
+            size: Conexoes simultaneas por processo
+            checkout_timeout: Espera maxima por uma conexao livre (segundos)
+            health_check_after: Conexoes ociosas ha mais que isso levam ping na retirada
+            connect: Fabrica de conexoes (padrao mysql.connector.connect(**config))
+        """
+        self.config = dict(config)
+        self.size = max(1, size)
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self._ociosas = deque()  # [(conexao, devolvida_em)]
+        self._abertas = 0
+        self._em_uso = 0
+        self._esperas_ms = deque(maxlen=1000)
+        self._stats = {'checkouts': 0, 'created': 0, 'reconnects': 0, 'discarded': 0,
+                       'waits': 0, 'timeouts': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0}
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def connect(self) -> PooledConnection:
+        """Retira uma conexao; o chamador deve chamar close() (ou usar `with`)"""
+        self._checar_fork()
+        inicio = time.perf_counter()
+        with self._cond:
+            esperou = False
+            while not self._ociosas and self._abertas >= self.size:
+                esperou = True
+                restante = self.checkout_timeout - (time.perf_counter() - inicio)
+                if restante <= 0:
+                    self._stats['timeouts'] += 1
+                    raise DBPoolError(f'Nenhuma conexao livre em {self.checkout_timeout:g}s '
+                                      f'(pool com {self.size})')
+                self._cond.wait(restante)
+            if self._ociosas:
+                raw, devolvida_em = self._ociosas.pop()
+            else:
+                raw, devolvida_em = None, 0.0
+                self._abertas += 1  # reserva a vaga antes de conectar fora do lock
+            self._em_uso += 1
+            espera_ms = (time.perf_counter() - inicio) * 1000.0
+            self._stats['checkouts'] += 1
+            self._stats['wait_ms_total'] += espera_ms
+            self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'], espera_ms)
+            self._esperas_ms.append(espera_ms)
+            if esperou:
+                self._stats['waits'] += 1
+
+        try:
+            if raw is None:
+                raw = self._abrir()
+            elif time.time() - devolvida_em > self.health_check_after and not self._saudavel(raw):
+                self._fechar(raw)
+                raw = self._abrir()
+                with self._cond:
+                    self._stats['reconnects'] += 1
+        except Exception:
+            with self._cond:
+                self._abertas -= 1
+                self._em_uso -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw)
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ... (rollback se der erro, devolve sempre)"""
+        conn = self.connect()
+        with conn:
+            yield conn
+
+    @contextmanager
+    def cursor(self, dictionary: bool = False, commit: bool = False):
+        """
+        Cursor com conexao do pool, fechados/devolvidos ao sair do bloco
+
+        Args:
+            dictionary: Linhas como dict
+            commit: Faz commit ao sair sem erro
+        """
+        with self.connection() as conn:
+            cur = conn.cursor(dictionary=dictionary)
+            try:
+                yield cur
+                if commit:
+                    conn.commit()
+            finally:
+                try:
+                    cur.close()
+                except Exception:
+                    pass
+
+    def stats(self) -> Dict:
+        with self._cond:
+            esperas = list(self._esperas_ms)
+            checkouts = self._stats['checkouts']
+            return {
+                'size': self.size,
+                'open': self._abertas,
+                'in_use': self._em_uso,
+                'idle': len(self._ociosas),
+                'utilization': round(self._em_uso / self.size, 3),
+                'wait_ms_avg': round(self._stats['wait_ms_total'] / checkouts, 3) if checkouts else 0.0,
+                'wait_ms_p95': percentil(esperas, 95),
+                **{k: (round(v, 3) if isinstance(v, float) else v) for k, v in self._stats.items()},
+            }
+
+    def close_all(self):
+        """Fecha as conexoes ociosas (as emprestadas fecham ao voltar)"""
+        with self._cond:
+            ociosas = [raw for raw, _ in self._ociosas]
+            self._ociosas.clear()
+            self._abertas -= len(ociosas)
+            self._cond.notify_all()
+        for raw in ociosas:
+            self._fechar(raw)
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+    def _abrir(self):
+        if self._connect is not None:
+            raw = self._connect()
+        else:
+            import mysql.connector
+            raw = mysql.connector.connect(**self.config)
+        with self._cond:
+            self._stats['created'] += 1
+        return raw
+
+    def _devolver(self, raw):
+        if os.getpid() != self._pid:
+            # Emprestada antes do fork: os contadores ja foram zerados
+            return
+        reaproveitar = True
+        try:
+            raw.rollback()
+        except Exception:
+            reaproveitar = False
+        with self._cond:
+            self._em_uso -= 1
+            if reaproveitar:
+                self._ociosas.append((raw, time.time()))
+            else:
+                self._abertas -= 1
+                self._stats['discarded'] += 1
+            self._cond.notify()
+        if not reaproveitar:
+            self._fechar(raw)
+
+    def _descartar(self, raw):
+        if os.getpid() == self._pid:
+            with self._cond:
+                self._em_uso -= 1
+                self._abertas -= 1
+                self._stats['discarded'] += 1
+                self._cond.notify()
+        self._fechar(raw)
+
+    @staticmethod
+    def _saudavel(raw) -> bool:
+        try:
+            raw.ping(reconnect=True, attempts=1, delay=0)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _fechar(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _checar_fork(self):
+        # Conexoes herdadas do processo pai nao podem ser usadas pelo filho
+        if os.getpid() == self._pid:
+            return
+        with self._cond:
+            if os.getpid() == self._pid:
+                return
+            self._pid = os.getpid()
+            self._ociosas.clear()
+            self._abertas = 0
+            self._em_uso = 0
+            self._cond.notify_all()
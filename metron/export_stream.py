@@ -0,0 +1,302 @@
+"""
+Export Stream
+Exportacao em fluxo (CSV, NDJSON, XLSX): linhas lidas do cursor em blocos,
+agrupadas sem guardar o resultado e escritas em pedacos, com gzip opcional,
+para a memoria ficar constante qualquer que seja o tamanho da exportacao
+"""
+
+import io
+import re
+import csv
+import json
+import math
+import zlib
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+FORMATS = ('csv', 'ndjson', 'xlsx')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Bytes acumulados antes de entregar um pedaco ao servidor
+FLUSH_BYTES = 64 * 1024
+
+
+def fetch_iter(cursor, size: int = 1000) -> Iterator:
+    """Linhas de um cursor sem buffer (mysql.connector: o servidor manda conforme le)"""
+    while True:
+        linhas = cursor.fetchmany(size)
+        if not linhas:
+            return
+        yield from linhas
+
+
+def group_consecutive(rows: Iterable[Dict], key: str, child_fields: Sequence[str],
+                      child_key: str, children: str = 'grandezas') -> Iterator[Dict]:
+    """
+    Junta linhas consecutivas com o mesmo `key` (resultado de um LEFT JOIN
+    ordenado pelo pai) em um registro com a lista dos filhos
+
+    Args:
+        key: Coluna que identifica o pai
+        child_fields: Colunas que pertencem ao filho (saem do registro do pai)
+        child_key: Coluna do filho que vem NULL quando o pai nao tem filhos
+        children: Nome da lista de filhos no registro
+    """
+    atual, filhos = None, []
+    for row in rows:
+        if atual is None or row[key] != atual[key]:
+            if atual is not None:
+                atual[children] = filhos
+                yield atual
+            atual = {k: v for k, v in row.items() if k not in child_fields}
+            filhos = []
+        if row.get(child_key) is not None:
+            filhos.append({k: row.get(k) for k in child_fields})
+    if atual is not None:
+        atual[children] = filhos
+        yield atual
+
+
+def _texto(valor) -> str:
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(valor, date):
+        return valor.strftime('%Y-%m-%d')
+    return str(valor)
+
+
+def _json_default(valor):
+    if isinstance(valor, (datetime, date)):
+        return _texto(valor)
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (bytes, bytearray)):
+        return valor.decode('utf-8', 'replace')
+    return str(valor)
+
+
+class CsvEncoder:
+    """CSV com BOM UTF-8 e ';' (abre direto no Excel em pt-BR)"""
+
+    def __init__(self, columns: Sequence[str], delimiter: str = ';'):
+        self.columns = list(columns)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, delimiter=delimiter, lineterminator='\r\n')
+
+    def header(self) -> bytes:
+        self._writer.writerow(self.columns)
+        return '\ufeff'.encode('utf-8') + self._drenar()
+
+    def row(self, record: Dict) -> bytes:
+        self._writer.writerow([_texto(record.get(c)) for c in self.columns])
+        return self._drenar()
+
+    def footer(self) -> bytes:
+        return b''
+
+    def _drenar(self) -> bytes:
+        dados = self._buffer.getvalue().encode('utf-8')
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return dados
+
+
+class NdjsonEncoder:
+    """Um objeto JSON por linha (campos aninhados, como grandezas, ficam como lista)"""
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = list(columns)
+
+    def header(self) -> bytes:
+        return b''
+
+    def row(self, record: Dict) -> bytes:
+        saida = {c: record.get(c) for c in self.columns}
+        return (json.dumps(saida, ensure_ascii=False, default=_json_default) + '\n').encode('utf-8')
+
+    def footer(self) -> bytes:
+        return b''
+
+
+_XML_INVALIDO = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xml(texto: str) -> str:
+    texto = _XML_INVALIDO.sub('', texto)
+    return texto.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+class _Dreno:
+    """Destino sem seek para o zipfile: acumula bytes ate o gerador retirar"""
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+
+    def write(self, dados) -> int:
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def retirar(self) -> bytes:
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+class XlsxEncoder:
+    """XLSX minimo (uma planilha, strings inline) escrito em fluxo, sem openpyxl.
+
+    O zip e gravado com descritores de dados (destino sem seek), entao cada
+    linha sai comprimida assim que o deflate libera bytes.
+    """
+
+    _CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    )
+    _RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>'
+    )
+    _WORKBOOK_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/></Relationships>'
+    )
+
+    def __init__(self, columns: Sequence[str], sheet_name: str = 'Dados'):
+        self.columns = list(columns)
+        self.sheet_name = sheet_name
+        self._dreno = _Dreno()
+        self._zip = zipfile.ZipFile(self._dreno, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._planilha = None
+
+    def header(self) -> bytes:
+        self._zip.writestr('[Content_Types].xml', self._CONTENT_TYPES)
+        self._zip.writestr('_rels/.rels', self._RELS)
+        self._zip.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{_xml(self.sheet_name)[:31]}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+        ))
+        self._zip.writestr('xl/_rels/workbook.xml.rels', self._WORKBOOK_RELS)
+        self._planilha = self._zip.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True)
+        self._planilha.write((
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        ).encode('utf-8'))
+        self._planilha.write(self._linha(self.columns))
+        return self._dreno.retirar()
+
+    def row(self, record: Dict) -> bytes:
+        self._planilha.write(self._linha([record.get(c) for c in self.columns]))
+        return self._dreno.retirar()
+
+    def footer(self) -> bytes:
+        self._planilha.write(b'</sheetData></worksheet>')
+        self._planilha.close()
+        self._zip.close()
+        return self._dreno.retirar()
+
+    @staticmethod
+    def _linha(valores) -> bytes:
+        celulas = []
+        for valor in valores:
+            if isinstance(valor, bool) or valor is None:
+                celulas.append(f'<c t="inlineStr"><is><t>{_xml(_texto(valor))}</t></is></c>')
+            elif isinstance(valor, (int, float, Decimal)):
+                # NaN/Infinito nao sao numero valido no XLSX: celula vazia, como o NULL do tsv_field/sql_literal
+                celulas.append(f'<c><v>{valor}</v></c>' if math.isfinite(valor) else '<c/>')
+            else:
+                celulas.append(f'<c t="inlineStr"><is><t xml:space="preserve">{_xml(_texto(valor))}</t></is></c>')
+        return ('<row>' + ''.join(celulas) + '</row>').encode('utf-8')
+
+
+def make_encoder(fmt: str, columns: Sequence[str], sheet_name: str = 'Dados'):
+    if fmt == 'csv':
+        return CsvEncoder(columns)
+    if fmt == 'ndjson':
+        return NdjsonEncoder(columns)
+    if fmt == 'xlsx':
+        return XlsxEncoder(columns, sheet_name=sheet_name)
+    raise ValueError(f"Formato de exportacao desconhecido: {fmt}")
+
+
+def encode_stream(records: Iterable[Dict], encoder, flush_bytes: int = FLUSH_BYTES) -> Iterator[bytes]:
+    """Registros -> pedacos de ~flush_bytes (o cabecalho sai na hora, antes da primeira linha)"""
+    yield encoder.header()
+    pendente, tamanho = [], 0
+    for record in records:
+        dados = encoder.row(record)
+        if dados:
+            pendente.append(dados)
+            tamanho += len(dados)
+        if tamanho >= flush_bytes:
+            yield b''.join(pendente)
+            pendente, tamanho = [], 0
+    pendente.append(encoder.footer())
+    yield b''.join(pendente)
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip em fluxo; cada pedaco e liberado (Z_SYNC_FLUSH) para o download nao travar"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if chunk:
+            dados = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if dados:
+                yield dados
+    yield compressor.flush(zlib.Z_FINISH)
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Accept-Encoding aceita gzip (q=0 recusa)"""
+    for parte in (accept_encoding or '').split(','):
+        nome, _, params = parte.strip().partition(';')
+        if nome.strip().lower() in ('gzip', '*'):
+            q = params.strip()
+            return not (q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'))
+    return False
+
+
+def zip_stream(entries: Iterable[Tuple[str, Iterable]]) -> Iterator[bytes]:
+    """
+    Zip gerado em fluxo (descritores de dados, sem seek)
+
+    Args:
+        entries: (nome, pedacos) - pedacos str ou bytes, um arquivo consumido por vez
+    """
+    dreno = _Dreno()
+    with zipfile.ZipFile(dreno, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for nome, pedacos in entries:
+            with zf.open(nome, 'w', force_zip64=True) as destino:
+                for pedaco in pedacos:
+                    destino.write(pedaco.encode('utf-8') if isinstance(pedaco, str) else pedaco)
+                    dados = dreno.retirar()
+                    if dados:
+                        yield dados
+    yield dreno.retirar()
@@ -0,0 +1,198 @@
+"""
+Geo Index
+Indice espacial em memoria das coordenadas dos laboratorios (grade de
+celulas lat/lon) para "laboratorio mais proximo" sem trigonometria no SQL
+"""
+
+import math
+import time
+import heapq
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia em km entre dois pontos (graus; aceita Decimal vindo do MySQL)"""
+    p1, p2 = math.radians(float(lat1)), math.radians(float(lat2))
+    dp = p2 - p1
+    dl = math.radians(float(lon2) - float(lon1))
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class LabGeoIndex:
+    """Coordenadas dos laboratorios em celulas de `cell_deg` graus.
+
+    As localizacoes mudam raramente: o indice e carregado uma vez e
+    recarregado em background a cada `refresh_seconds` (quem consulta
+    continua usando a versao anterior enquanto a nova carrega).
+
+    Com candidatos (laboratorios que atendem o servico) so eles tem a
+    distancia calculada; sem candidatos a busca percorre aneis de celulas a
+    partir do ponto e para quando nenhuma celula restante pode ter algo
+    mais perto que o k-esimo ja encontrado.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[Tuple[int, float, float]]],
+                 refresh_seconds: float = 900.0, cell_deg: float = 1.0):
+        """
+        Inicializa o indice (a carga acontece na primeira consulta)
+
+        Args:
+            loader: Retorna (lab_id, latitude, longitude) de todos os laboratorios com coordenadas
+            refresh_seconds: Idade maxima do indice antes de recarregar
+            cell_deg: Tamanho da celula da grade em graus
+        """
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds
+        self.cell_deg = cell_deg
+        self._lock = threading.Lock()
+        self._recarregando = False
+        self._snapshot = None  # (coords {id: (lat, lon)}, celulas {(i, j): [id]}, cos_min, carregado_em)
+        self._stats = {'loads': 0, 'load_errors': 0, 'last_load_ms': None, 'queries': 0, 'distance_evals': 0}
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def coords(self, lab_id: int) -> Optional[Tuple[float, float]]:
+        return self._atual()[0].get(lab_id)
+
+    def distance_km(self, lab_id: int, lat: float, lon: float) -> Optional[float]:
+        ponto = self.coords(lab_id)
+        return haversine_km(lat, lon, ponto[0], ponto[1]) if ponto else None
+
+    def nearest(self, lat: float, lon: float, k: int = 8,
+                candidates: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """k laboratorios mais proximos: [(lab_id, km)] em ordem de distancia"""
+        coords, celulas, cos_min, _ = self._atual()
+        if candidates is not None:
+            return heapq.nsmallest(k, self._distancias(coords, lat, lon, candidates), key=lambda t: t[1])
+
+        if not coords or k <= 0:
+            return []
+        ci, cj = self._celula(lat, lon)
+        melhores = []  # heap de (-km, id) com os k melhores
+        raio_max = self._raio_maximo(celulas, ci, cj)
+        for r in range(raio_max + 1):
+            # Qualquer ponto no anel r esta a pelo menos (r - 1) celulas de distancia
+            if len(melhores) >= k and self._limite_inferior_km(r, cos_min) > -melhores[0][0]:
+                break
+            for lab_id, km in self._distancias(coords, lat, lon, self._anel(celulas, ci, cj, r)):
+                if len(melhores) < k:
+                    heapq.heappush(melhores, (-km, lab_id))
+                elif km < -melhores[0][0]:
+                    heapq.heapreplace(melhores, (-km, lab_id))
+        return sorted(((lab_id, -neg) for neg, lab_id in melhores), key=lambda t: t[1])
+
+    def within(self, lat: float, lon: float, radius_km: float,
+               candidates: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """Laboratorios a ate radius_km: [(lab_id, km)] em ordem de distancia"""
+        coords, celulas, cos_min, _ = self._atual()
+        if candidates is None:
+            ci, cj = self._celula(lat, lon)
+            aneis = int(radius_km / (self.cell_deg * KM_PER_DEG_LAT * cos_min)) + 1
+            candidates = (lab_id for r in range(min(aneis, self._raio_maximo(celulas, ci, cj)) + 1)
+                          for lab_id in self._anel(celulas, ci, cj, r))
+        dentro = [(lab_id, km) for lab_id, km in self._distancias(coords, lat, lon, candidates) if km <= radius_km]
+        return sorted(dentro, key=lambda t: t[1])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            snapshot = self._snapshot
+            return {
+                'labs': len(snapshot[0]) if snapshot else 0,
+                'cells': len(snapshot[1]) if snapshot else 0,
+                'age_seconds': round(time.time() - snapshot[3], 1) if snapshot else None,
+                **self._stats,
+            }
+
+    def refresh(self):
+        """Recarrega agora (sincrono)"""
+        inicio = time.perf_counter()
+        try:
+            pontos = list(self.loader())
+        except Exception as e:
+            print(f"[GEO-INDEX] Falha ao carregar coordenadas: {e}")
+            with self._lock:
+                self._stats['load_errors'] += 1
+                self._recarregando = False
+            raise
+        coords, celulas, max_lat = {}, {}, 0.0
+        for lab_id, lat, lon in pontos:
+            if lat is None or lon is None:
+                continue
+            lat, lon = float(lat), float(lon)
+            coords[lab_id] = (lat, lon)
+            celulas.setdefault(self._celula(lat, lon), []).append(lab_id)
+            max_lat = max(max_lat, abs(lat))
+        cos_min = max(0.01, math.cos(math.radians(min(89.0, max_lat + self.cell_deg))))
+        with self._lock:
+            self._snapshot = (coords, celulas, cos_min, time.time())
+            self._recarregando = False
+            self._stats['loads'] += 1
+            self._stats['last_load_ms'] = round((time.perf_counter() - inicio) * 1000.0, 1)
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+    def _atual(self):
+        with self._lock:
+            snapshot = self._snapshot
+            self._stats['queries'] += 1
+            vencido = snapshot is not None and time.time() - snapshot[3] > self.refresh_seconds
+            disparar = vencido and not self._recarregando
+            if disparar:
+                self._recarregando = True
+        if snapshot is None:
+            self.refresh()
+            with self._lock:
+                return self._snapshot
+        if disparar:
+            threading.Thread(target=self._refresh_silencioso, name='metron-geo-index', daemon=True).start()
+        return snapshot
+
+    def _refresh_silencioso(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass
+
+    def _distancias(self, coords, lat, lon, ids):
+        saida, avaliados = [], 0
+        for lab_id in ids:
+            ponto = coords.get(lab_id)
+            if ponto is None:
+                continue
+            avaliados += 1
+            saida.append((lab_id, haversine_km(lat, lon, ponto[0], ponto[1])))
+        with self._lock:
+            self._stats['distance_evals'] += avaliados
+        return saida
+
+    def _celula(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    @staticmethod
+    def _anel(celulas, ci: int, cj: int, r: int) -> List[int]:
+        if r == 0:
+            return list(celulas.get((ci, cj), ()))
+        ids = []
+        for dj in range(-r, r + 1):
+            ids.extend(celulas.get((ci - r, cj + dj), ()))
+            ids.extend(celulas.get((ci + r, cj + dj), ()))
+        for di in range(-r + 1, r):
+            ids.extend(celulas.get((ci + di, cj - r), ()))
+            ids.extend(celulas.get((ci + di, cj + r), ()))
+        return ids
+
+    @staticmethod
+    def _raio_maximo(celulas, ci: int, cj: int) -> int:
+        if not celulas:
+            return 0
+        return max(max(abs(i - ci), abs(j - cj)) for i, j in celulas)
+
+    def _limite_inferior_km(self, r: int, cos_min: float) -> float:
+        return max(0, r - 1) * self.cell_deg * KM_PER_DEG_LAT * cos_min
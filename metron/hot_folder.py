@@ -0,0 +1,334 @@
+"""
+Hot Folder
+Vigia diretorios onde os laboratorios depositam certificados escaneados e
+entrega os PDFs novos (ou alterados) ja estaveis para a extracao
+"""
+
+import os
+import json
+import time
+import errno
+import select
+import struct
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Mascaras do inotify (linux/inotify.h)
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _Inotify:
+    """inotify via ctypes (sem dependencia externa). Levanta OSError fora do Linux."""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        nome = ctypes.util.find_library('c')
+        if not nome:
+            raise OSError(errno.ENOSYS, 'libc nao encontrada')
+        self._libc = ctypes.CDLL(nome, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify indisponivel')
+        self.fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 falhou')
+        self._ctypes = ctypes
+        self._dirs = {}  # {wd: diretorio}
+
+    def add_watch(self, directory: str):
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_MODIFY
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(self._ctypes.get_errno(), f'inotify_add_watch falhou em {directory}')
+        self._dirs[wd] = directory
+
+    def read(self, timeout: float) -> Tuple[List[str], bool]:
+        """Espera eventos ate timeout. Retorna (caminhos alterados, houve overflow)."""
+        prontos, _, _ = select.select([self.fd], [], [], timeout)
+        if not prontos:
+            return [], False
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return [], False
+        caminhos, overflow, pos = [], False, 0
+        while pos + _EVENT_HEADER.size <= len(buf):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buf, pos)
+            pos += _EVENT_HEADER.size
+            nome = buf[pos:pos + length].rstrip(b'\0')
+            pos += length
+            if mask & _IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            pasta = self._dirs.get(wd)
+            if pasta and nome:
+                caminhos.append(os.path.join(pasta, os.fsdecode(nome)))
+        return caminhos, overflow
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+class HotFolderWatcher:
+    """Detecta PDFs novos ou alterados nos diretorios configurados.
+
+    Usa inotify quando disponivel e varredura periodica como alternativa (e
+    tambem como rede de seguranca: compartilhamentos de rede nao geram
+    eventos inotify para escritas feitas por outras maquinas). Um arquivo so
+    e entregue depois de ficar `settle_seconds` sem mudar de tamanho/mtime.
+    O SHA-256 de cada arquivo entregue fica registrado em `state_path`, de
+    modo que o mesmo conteudo nao e processado duas vezes, nem apos reinicio.
+    """
+
+    def __init__(self, directories: List[str], on_batch: Callable[[List[Dict]], int],
+                 settle_seconds: float = 5.0, poll_interval: float = 10.0,
+                 state_path: Optional[str] = None, use_inotify: bool = True):
+        """
+        Inicializa o watcher
+
+        Args:
+            directories: Diretorios vigiados (nao recursivo)
+            on_batch: Recebe [{'path', 'name', 'sha256', 'size'}] dos arquivos
+                prontos e retorna quantos foram aceitos (os primeiros N)
+            settle_seconds: Tempo sem alteracao para considerar a escrita concluida
+            poll_interval: Intervalo da varredura completa dos diretorios
+            state_path: Arquivo JSON com os hashes ja processados
+            use_inotify: Tenta inotify antes de cair para varredura
+        """
+        self.directories = [os.path.abspath(d) for d in directories if d]
+        self.on_batch = on_batch
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.state_path = state_path
+        self.use_inotify = use_inotify
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._candidatos = {}  # {path: (size, mtime, visto_em)}
+        self._assinaturas = {}  # {path: (size, mtime)} ja avaliados (evita re-hash)
+        self._processados = self._carregar_estado()  # {sha256: {'name', 'at'}}
+        self._mode = 'stopped'
+        self._stats = {'submitted': 0, 'duplicates': 0, 'errors': 0, 'scans': 0}
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def start(self) -> bool:
+        if self._thread is not None or not self.directories:
+            return False
+        for d in self.directories:
+            os.makedirs(d, exist_ok=True)
+        self._thread = threading.Thread(target=self._loop, name='metron-hotfolder', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'mode': self._mode,
+                'directories': list(self.directories),
+                'pending_settle': len(self._candidatos),
+                'processed_hashes': len(self._processados),
+                **self._stats,
+            }
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+    def _loop(self):
+        notify = None
+        if self.use_inotify:
+            try:
+                notify = _Inotify()
+                for d in self.directories:
+                    notify.add_watch(d)
+                self._mode = 'inotify'
+            except (OSError, AttributeError) as e:
+                print(f"[HOT-FOLDER] inotify indisponivel ({e}), usando varredura")
+                if notify:
+                    notify.close()
+                notify = None
+        if notify is None:
+            self._mode = 'polling'
+
+        proxima_varredura = 0.0
+        try:
+            while not self._stop.is_set():
+                agora = time.time()
+                if agora >= proxima_varredura:
+                    self._varrer()
+                    proxima_varredura = agora + self.poll_interval
+
+                # Com candidatos esperando estabilizar, acorda mais cedo
+                espera = min(self.poll_interval, max(0.5, self.settle_seconds / 2)) \
+                    if self._candidatos else self.poll_interval
+                espera = min(espera, max(0.0, proxima_varredura - time.time()))
+                if notify is not None:
+                    caminhos, overflow = notify.read(espera)
+                    for path in caminhos:
+                        self._observar(path)
+                    if overflow:
+                        proxima_varredura = 0.0
+                else:
+                    self._stop.wait(espera)
+
+                self._entregar_estaveis()
+        except Exception as e:
+            print(f"[HOT-FOLDER] Erro no watcher: {e}")
+            with self._lock:
+                self._mode = 'error'
+        finally:
+            if notify is not None:
+                notify.close()
+
+    def _varrer(self):
+        for d in self.directories:
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            self._observar(entry.path)
+            except OSError as e:
+                print(f"[HOT-FOLDER] Falha ao ler {d}: {e}")
+        with self._lock:
+            self._stats['scans'] += 1
+
+    @staticmethod
+    def _elegivel(path: str) -> bool:
+        nome = os.path.basename(path)
+        return nome.lower().endswith('.pdf') and not nome.startswith(('.', '~$'))
+
+    def _observar(self, path: str):
+        if not self._elegivel(path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._candidatos.pop(path, None)
+                self._assinaturas.pop(path, None)
+            return
+        assinatura = (st.st_size, st.st_mtime)
+        with self._lock:
+            if self._assinaturas.get(path) == assinatura:
+                return
+            atual = self._candidatos.get(path)
+            if atual is None or atual[:2] != assinatura:
+                self._candidatos[path] = (st.st_size, st.st_mtime, time.time())
+
+    def _entregar_estaveis(self):
+        agora = time.time()
+        with self._lock:
+            candidatos = list(self._candidatos.items())
+
+        prontos = []
+        for path, (size, mtime, visto_em) in candidatos:
+            try:
+                st = os.stat(path)
+            except OSError:
+                with self._lock:
+                    self._candidatos.pop(path, None)
+                continue
+            if (st.st_size, st.st_mtime) != (size, mtime):
+                with self._lock:
+                    self._candidatos[path] = (st.st_size, st.st_mtime, agora)
+                continue
+            if agora - visto_em < self.settle_seconds or size == 0:
+                continue
+
+            with self._lock:
+                self._candidatos.pop(path, None)
+                self._assinaturas[path] = (size, mtime)
+            try:
+                digest = self._sha256(path)
+            except OSError:
+                with self._lock:
+                    self._stats['errors'] += 1
+                    self._assinaturas.pop(path, None)
+                continue
+            with self._lock:
+                repetido = digest in self._processados or any(p['sha256'] == digest for p in prontos)
+                if repetido:
+                    self._stats['duplicates'] += 1
+            if not repetido:
+                prontos.append({'path': path, 'name': os.path.basename(path), 'sha256': digest, 'size': size})
+
+        if not prontos:
+            return
+        try:
+            aceitos = self.on_batch(prontos)
+        except Exception as e:
+            print(f"[HOT-FOLDER] Falha ao enfileirar lote: {e}")
+            aceitos = 0
+        with self._lock:
+            for item in prontos[:aceitos]:
+                self._processados[item['sha256']] = {'name': item['name'], 'at': int(time.time())}
+            for item in prontos[aceitos:]:
+                # Nao aceitos voltam a ser avaliados na proxima varredura
+                self._assinaturas.pop(item['path'], None)
+                self._stats['errors'] += 1
+            self._stats['submitted'] += aceitos
+            self._salvar_estado()
+
+    @staticmethod
+    def _sha256(path: str) -> str:
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(bloco)
+        return hasher.hexdigest()
+
+    def _carregar_estado(self) -> Dict:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('processed', {})
+        except (OSError, ValueError):
+            return {}
+
+    def _salvar_estado(self):
+        if not self.state_path:
+            return
+        tmp = self.state_path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'processed': self._processados}, f)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"[HOT-FOLDER] Falha ao salvar estado: {e}")
+
+
+def acquire_single_instance_lock(path: str):
+    """Trava de arquivo para que so um processo (de varios workers) rode o watcher.
+
+    Returns:
+        O arquivo travado (manter aberto enquanto o watcher rodar) ou None se
+        outro processo ja tem a trava
+    """
+    f = open(path, 'a+')
+    try:
+        try:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except ImportError:
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
@@ -0,0 +1,345 @@
+"""
+Hot Queries
+Consultas quentes do app (busca, listagem, pre-busca do inserir-banco,
+exportacao, certificado) montadas em um so lugar: o app executa estas e o
+`criar_tabelas.py --check` roda EXPLAIN nelas mesmas, sem copias a mao
+"""
+
+import re
+from typing import Dict, List, Sequence, Tuple
+
+from .pagination import encode_cursor, decode_cursor, parse_sort, keyset_order, keyset_predicate
+from .latest_calibration import LATEST_CALIBRATION_JOIN, REFRESH_SQL, DELETE_WITHOUT_CALIBRATION_SQL
+from .instrument_search import SEARCH_JOIN, search_predicate
+
+
+# ------------------------------------------------------------------
+# Busca de instrumentos (/buscar-instrumentos e a IA)
+# ------------------------------------------------------------------
+
+# Campos aceitos em ?fields= -> expressao SQL
+SEARCH_FIELDS = {
+    'id': 'i.id',
+    'identificacao': 'i.identificacao',
+    'nome': 'i.nome',
+    'status': 'i.status',
+    'departamento': 'i.departamento',
+    'responsavel': 'i.responsavel',
+    'created_at': 'i.created_at',
+    'data_calibracao': 'c.data_calibracao',
+    'data_proxima_calibracao': 'c.data_proxima_calibracao',
+    'status_calibracao': 'c.status_calibracao',
+    'laboratorio_responsavel': 'c.laboratorio_responsavel',
+}
+SEARCH_DEFAULT_FIELDS = (
+    'id', 'identificacao', 'nome', 'status', 'data_calibracao', 'data_proxima_calibracao',
+    'status_calibracao', 'laboratorio_responsavel',
+)
+# ?ordenar= -> expressao (cada uma apoiada em indice: ver INDICES em criar_tabelas.py);
+# 'relevancia' entra quando ha termo e e o padrao nesse caso
+SEARCH_SORTS = {
+    'identificacao': 'i.identificacao',
+    'nome': 'i.nome',
+    'created_at': 'i.created_at',
+    'proxima_calibracao': 'uc.data_proxima_calibracao',
+}
+
+
+def is_truthy_filter(value) -> bool:
+    """Normaliza flags de filtro vindas do frontend/IA."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'sim', 'yes', 'on')
+    return False
+
+
+def normalize_filter_date(value) -> str:
+    """Aceita apenas YYYY-MM-DD para filtros de data."""
+    if not value:
+        return ''
+    text = str(value).strip()
+    if re.match(r'^\d{4}-\d{2}-\d{2}$', text):
+        return text
+    return ''
+
+
+def apply_instrument_filters(sql: str, params: List, filtros: Dict) -> Tuple[str, List]:
+    """Aplica filtros de monitoramento ao SQL sem remover os existentes.
+
+    Espera o SQL com LATEST_CALIBRATION_JOIN (aliases uc e c) e SEARCH_JOIN (alias ib)."""
+    termo = (filtros.get('termo') or '').strip()
+    status = (filtros.get('status') or '').strip()
+    identificacao = (filtros.get('identificacao') or '').strip()
+    instrumento = (filtros.get('instrumento') or '').strip()
+    responsavel = (filtros.get('responsavel') or '').strip()
+    departamento = (filtros.get('departamento') or '').strip()
+    data_inicio = normalize_filter_date(filtros.get('data_inicio'))
+    data_fim = normalize_filter_date(filtros.get('data_fim'))
+    filtro_vencidos = is_truthy_filter(filtros.get('filtro_vencidos'))
+    filtro_a_vencer = is_truthy_filter(filtros.get('filtro_a_vencer'))
+
+    if termo:
+        # Texto sem acento ja gravado em instrumento_busca (FULLTEXT), nada de COLLATE por linha
+        predicado, params_busca, _, _ = search_predicate(termo)
+        if predicado:
+            sql += f" AND {predicado}"
+            params += params_busca
+
+    if identificacao:
+        sql += " AND i.identificacao COLLATE utf8mb4_general_ci LIKE %s"
+        params.append(f'%{identificacao}%')
+
+    if instrumento:
+        sql += " AND i.descricao COLLATE utf8mb4_general_ci LIKE %s"
+        params.append(f'%{instrumento}%')
+
+    if responsavel:
+        sql += " AND i.responsavel COLLATE utf8mb4_general_ci LIKE %s"
+        params.append(f'%{responsavel}%')
+
+    if departamento:
+        sql += " AND i.departamento COLLATE utf8mb4_general_ci LIKE %s"
+        params.append(f'%{departamento}%')
+
+    if status:
+        sql += " AND i.status = %s"
+        params.append(status)
+
+    if data_inicio:
+        sql += """
+            AND EXISTS (
+                SELECT 1
+                FROM calibracoes cdt_ini
+                WHERE cdt_ini.instrumento_id = i.id
+                  AND DATE(cdt_ini.data_proxima_calibracao) >= %s
+            )
+        """
+        params.append(data_inicio)
+
+    if data_fim:
+        sql += """
+            AND EXISTS (
+                SELECT 1
+                FROM calibracoes cdt_fim
+                WHERE cdt_fim.instrumento_id = i.id
+                  AND DATE(cdt_fim.data_proxima_calibracao) <= %s
+            )
+        """
+        params.append(data_fim)
+
+    if filtro_vencidos:
+        sql += """
+            AND (
+                uc.data_proxima_calibracao <= CURDATE()
+                OR
+                (uc.instrumento_id IS NULL AND i.periodicidade IS NOT NULL
+                    AND DATE_ADD(DATE(i.created_at), INTERVAL i.periodicidade MONTH) <= CURDATE())
+            )
+        """
+
+    if filtro_a_vencer:
+        sql += """
+            AND (
+                uc.data_proxima_calibracao <= DATE_ADD(CURDATE(), INTERVAL 30 DAY)
+                OR
+                (uc.instrumento_id IS NULL AND i.periodicidade IS NOT NULL
+                    AND DATE_ADD(DATE(i.created_at), INTERVAL i.periodicidade MONTH) <= DATE_ADD(CURDATE(), INTERVAL 30 DAY))
+            )
+        """
+
+    return sql, params
+
+
+def instrument_page_query(user_id: int, filtros: Dict, campos: Sequence[str] = SEARCH_DEFAULT_FIELDS,
+                          ordenar: str = '', limite: int = 50,
+                          token: str = '') -> Tuple[str, List, str, List, str]:
+    """
+    Consulta de uma pagina da busca por keyset (le limite + 1 para saber se ha mais)
+
+    Cada linha traz `_ordem` (valor da ordenacao) e `id` para o proximo
+    cursor; cursor de outra ordenacao ou invalido recomeca da primeira pagina.
+
+    Returns:
+        (sql, params, sql do COUNT com os mesmos filtros, params do COUNT, campo de ordenacao)
+    """
+    _, _, relevancia, rel_params = search_predicate((filtros.get('termo') or '').strip())
+    ordenacoes = dict(SEARCH_SORTS)
+    if relevancia:
+        ordenacoes['relevancia'] = relevancia
+    campo_ordem, desc = parse_sort(ordenar, ordenacoes, '-relevancia' if relevancia else 'identificacao')
+    expr = ordenacoes[campo_ordem]
+    expr_params = rel_params if campo_ordem == 'relevancia' else []
+
+    base = f"""
+        FROM instrumentos i
+        {LATEST_CALIBRATION_JOIN}
+        {SEARCH_JOIN}
+        WHERE i.user_id = %s
+    """
+    base, params_base = apply_instrument_filters(base, [user_id], filtros)
+
+    colunas = ''.join(f", {SEARCH_FIELDS[c]} AS {c}" for c in campos if c != 'id')
+    sql = f"SELECT i.id AS id, {expr} AS _ordem{colunas}" + base
+    params = list(expr_params) + params_base
+
+    posicao = decode_cursor(token, 3)
+    if posicao and posicao[0] == campo_ordem:
+        predicado, params_pos = keyset_predicate(expr, desc, posicao[1], posicao[2], 'i.id', expr_params)
+        sql += f" AND {predicado}"
+        params += params_pos
+    sql += keyset_order(expr, desc, 'i.id') + " LIMIT %s"
+    params += list(expr_params) + [limite + 1]
+    return sql, params, "SELECT COUNT(*) AS total" + base, params_base, campo_ordem
+
+
+# ------------------------------------------------------------------
+# Listagem (/listar-instrumentos)
+# ------------------------------------------------------------------
+
+# Campos aceitos em ?fields= ('grandezas' = primeira grandeza de cada instrumento)
+LIST_FIELDS = (
+    'id', 'identificacao', 'nome', 'fabricante', 'modelo', 'numero_serie', 'status',
+    'created_at', 'departamento', 'responsavel', 'periodicidade', 'grandezas',
+)
+# ?ordenar= da listagem (indices user_id + coluna; o id desempata)
+LIST_SORTS = {
+    'created_at': 'created_at',
+    'identificacao': 'identificacao',
+    'nome': 'nome',
+}
+LIST_COUNT_SQL = "SELECT COUNT(*) AS total FROM instrumentos WHERE user_id = %s"
+# Primeira grandeza de cada instrumento da pagina, com "IN ({marcadores})"
+FIRST_GRANDEZA_SQL = """
+    SELECT g.instrumento_id, g.unidade, g.resolucao, g.tolerancia_processo
+    FROM grandezas g
+    JOIN (
+        SELECT MIN(id) AS id FROM grandezas
+        WHERE instrumento_id IN ({marcadores})
+        GROUP BY instrumento_id
+    ) primeira ON primeira.id = g.id
+"""
+
+
+def instrument_list_query(user_id: int, campos: Sequence[str] = LIST_FIELDS, ordenar: str = '',
+                          limite: int = 100, token: str = '') -> Tuple[str, List, str, str]:
+    """
+    Consulta de uma pagina da listagem por keyset (le limite + 1 para saber se ha mais)
+
+    id e a coluna de ordenacao sempre vem do banco: sao a chave da paginacao.
+
+    Returns:
+        (sql, params, campo de ordenacao, coluna de ordenacao)
+    """
+    campo_ordem, desc = parse_sort(ordenar, LIST_SORTS, '-created_at')
+    expr = LIST_SORTS[campo_ordem]
+    posicao = decode_cursor(token, 3)
+
+    colunas = ['id', expr] + [c for c in campos if c not in ('id', expr, 'grandezas')]
+    sql = f"SELECT {', '.join(colunas)} FROM instrumentos WHERE user_id = %s"
+    params = [user_id]
+    if posicao and posicao[0] == campo_ordem:
+        predicado, params_pos = keyset_predicate(expr, desc, posicao[1], posicao[2], 'id')
+        sql += f" AND {predicado}"
+        params += params_pos
+    sql += keyset_order(expr, desc, 'id') + " LIMIT %s"
+    params.append(limite + 1)
+    return sql, params, campo_ordem, expr
+
+
+# ------------------------------------------------------------------
+# Inserir no banco, exportacao e certificado
+# ------------------------------------------------------------------
+
+# Pre-busca do lote (fetch_in troca {marcadores} por fatias do IN)
+EXISTING_INSTRUMENTS_SQL = (
+    "SELECT identificacao, MIN(id) FROM instrumentos "
+    "WHERE user_id = %s AND identificacao IN ({marcadores}) GROUP BY identificacao"
+)
+EXISTING_CALIBRATIONS_SQL = (
+    "SELECT instrumento_id, numero_calibracao, data_calibracao FROM calibracoes "
+    "WHERE instrumento_id IN ({marcadores})"
+)
+
+# Exportacao completa: instrumentos + ultima calibracao + grandezas (uma linha por grandeza,
+# agrupadas em fluxo). Ordem pelo indice (user_id, identificacao): o MySQL entrega a primeira
+# linha sem ordenar a tabela inteira antes.
+EXPORT_SQL = f"""
+    SELECT i.id, i.identificacao, i.nome, i.fabricante, i.modelo, i.numero_serie,
+           i.departamento, i.responsavel, i.status, i.periodicidade, i.created_at,
+           c.numero_calibracao, c.laboratorio_responsavel, c.data_calibracao,
+           c.data_proxima_calibracao, c.status_calibracao,
+           g.id AS grandeza_id, g.unidade, g.resolucao, g.faixa_nominal, g.faixa_uso,
+           g.tolerancia_processo, g.criterio_aceitacao
+    FROM instrumentos i
+    {LATEST_CALIBRATION_JOIN}
+    LEFT JOIN grandezas g ON g.instrumento_id = i.id
+    WHERE i.user_id = %s
+    ORDER BY i.identificacao, i.id, g.id
+"""
+
+# Certificado mais recente da calibracao (sem o pdf_content, lido a parte so quando preciso)
+CERTIFICATE_SQL = (
+    "SELECT id, pdf_in_database, nome_original, arquivo_pdf FROM certificados "
+    "WHERE calibracao_id = %s ORDER BY id DESC LIMIT 1"
+)
+CERTIFICATE_CONTENT_SQL = "SELECT pdf_content FROM certificados WHERE id = %s"
+
+
+def _cursor_exemplo(campo: str, valor, ultimo_id: int = 1000) -> str:
+    return encode_cursor([campo, valor, ultimo_id])
+
+
+def _em(sql: str, valores: Sequence, params: Sequence = ()) -> Tuple[str, Tuple]:
+    """SQL com {marcadores} preenchido como o fetch_in faria para os valores de exemplo"""
+    return sql.format(marcadores=', '.join(['%s'] * len(valores))), tuple(params) + tuple(valores)
+
+
+def check_queries(user_id: int = 1) -> List[Tuple[str, str, Tuple]]:
+    """
+    Consultas quentes com parametros de exemplo, montadas pelos mesmos
+    construtores que o app usa (para EXPLAIN no criar_tabelas.py --check)
+
+    Returns:
+        [(nome, sql, params)]
+    """
+    consultas = []
+
+    def adicionar(nome, sql, params):
+        consultas.append((nome, sql, tuple(params)))
+
+    sql, params, _, _ = instrument_list_query(user_id)
+    adicionar('listar_instrumentos', sql, params)
+    sql, params, _, _ = instrument_list_query(user_id, ordenar='nome',
+                                              token=_cursor_exemplo('nome', 'M'))
+    adicionar('listar_instrumentos (pagina seguinte, por nome)', sql, params)
+    adicionar('listar_instrumentos (total)', LIST_COUNT_SQL, (user_id,))
+    adicionar('listar_instrumentos (grandezas)', *_em(FIRST_GRANDEZA_SQL, (1, 2)))
+
+    paginas = (
+        ('buscar_instrumentos', {}, '', ''),
+        ('buscar_instrumentos (pagina seguinte, proxima calibracao)', {}, 'proxima_calibracao',
+         _cursor_exemplo('proxima_calibracao', '2026-01-01')),
+        ('buscar_instrumentos (termo)', {'termo': 'paquimetro digital'}, '', ''),
+        ('buscar_instrumentos (termo, pagina seguinte)', {'termo': 'paquimetro'}, '',
+         _cursor_exemplo('relevancia', 1.0)),
+        ('buscar_instrumentos (vencidos, status)', {'filtro_vencidos': True, 'status': 'Ativo'}, '', ''),
+        ('buscar_instrumentos (periodo)', {'data_inicio': '2026-01-01', 'data_fim': '2026-12-31'}, '', ''),
+    )
+    for nome, filtros, ordenar, token in paginas:
+        sql, params, _, _, _ = instrument_page_query(user_id, filtros, ordenar=ordenar, token=token)
+        adicionar(nome, sql, params)
+    _, _, sql_total, params_total, _ = instrument_page_query(user_id, {'termo': 'paquimetro'})
+    adicionar('buscar_instrumentos (total)', sql_total, params_total)
+
+    adicionar('inserir_banco (instrumentos existentes)',
+              *_em(EXISTING_INSTRUMENTS_SQL, ('X-1', 'X-2'), (user_id,)))
+    adicionar('inserir_banco (calibracoes existentes)', *_em(EXISTING_CALIBRATIONS_SQL, (1, 2)))
+    adicionar('ultima calibracao (atualizacao)', *_em(REFRESH_SQL, (1, 2)))
+    adicionar('ultima calibracao (remocao)', *_em(DELETE_WITHOUT_CALIBRATION_SQL, (1, 2)))
+    adicionar('exportar_instrumentos', EXPORT_SQL, (user_id,))
+    adicionar('servir_certificado_pdf', CERTIFICATE_SQL, (1,))
+    adicionar('servir_certificado_pdf (conteudo)', CERTIFICATE_CONTENT_SQL, (1,))
+    return consultas
@@ -0,0 +1,120 @@
+"""
+HTTP Delivery
+Entrega de arquivos em blocos: Range de um intervalo (PDF.js carrega por
+partes), ETag forte a partir do SHA-256 do conteudo e GET condicional
+"""
+
+import unicodedata
+import urllib.parse
+from typing import BinaryIO, Callable, Iterator, Optional, Tuple
+
+CHUNK_SIZE = 64 * 1024
+
+# URL enderecada por conteudo: o mesmo endereco nunca muda de bytes
+CACHE_IMMUTABLE = 'private, max-age=31536000, immutable'
+# URL por id (a calibracao pode ganhar outro certificado): sempre revalida, 304 se nada mudou
+CACHE_REVALIDATE = 'private, no-cache'
+
+
+class RangeNotSatisfiable(Exception):
+    """Range fora do arquivo (responder 416 com Content-Range: bytes */tamanho)"""
+
+
+def strong_etag(digest: str) -> str:
+    return f'"{digest}"'
+
+
+def file_validator(stat) -> str:
+    """Validador de um arquivo sem ler o conteudo: tamanho e mtime (ns) do os.stat, em hex"""
+    return f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match casa com o ETag (comparacao fraca, como manda a RFC 9110 para esse cabecalho)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    alvo = etag[2:] if etag.startswith('W/') else etag
+    for candidato in if_none_match.split(','):
+        candidato = candidato.strip()
+        if candidato.startswith('W/'):
+            candidato = candidato[2:]
+        if candidato == alvo:
+            return True
+    return False
+
+
+def if_range_allows(if_range: Optional[str], etag: str) -> bool:
+    """Sem If-Range, ou If-Range igual (forte) ao ETag atual: o Range vale. Datas nao sao aceitas."""
+    if not if_range:
+        return True
+    return if_range.strip() == etag and not etag.startswith('W/')
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Intervalo pedido em "Range: bytes=..."
+
+    Returns:
+        (inicio, fim) inclusivo, ou None para responder o arquivo inteiro
+        (sem Range, sintaxe invalida ou varios intervalos)
+
+    Raises:
+        RangeNotSatisfiable: intervalo valido que comeca depois do fim do arquivo
+    """
+    if not header:
+        return None
+    unidade, _, especificacao = header.strip().partition('=')
+    if unidade.strip().lower() != 'bytes' or not especificacao or ',' in especificacao:
+        return None
+    inicio_txt, traco, fim_txt = especificacao.strip().partition('-')
+    if not traco:
+        return None
+    inicio_txt, fim_txt = inicio_txt.strip(), fim_txt.strip()
+    if (inicio_txt and not inicio_txt.isdigit()) or (fim_txt and not fim_txt.isdigit()):
+        return None
+
+    if not inicio_txt:
+        # Sufixo: os ultimos N bytes
+        if not fim_txt:
+            return None
+        sufixo = int(fim_txt)
+        if sufixo == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - sufixo), size - 1
+
+    inicio = int(inicio_txt)
+    fim = int(fim_txt) if fim_txt else size - 1
+    if fim_txt and fim < inicio:
+        return None
+    if inicio >= size:
+        raise RangeNotSatisfiable()
+    return inicio, min(fim, size - 1)
+
+
+def iter_stream(abrir: Callable[[], BinaryIO], length: int, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Le `length` bytes em blocos; o arquivo so e aberto na primeira leitura e sempre fechado"""
+    f = abrir()
+    try:
+        restante = length
+        while restante > 0:
+            bloco = f.read(min(chunk_size, restante))
+            if not bloco:
+                break
+            restante -= len(bloco)
+            yield bloco
+    finally:
+        f.close()
+
+
+def content_disposition(nome: str, inline: bool = True) -> str:
+    """Content-Disposition com nome ASCII e filename* UTF-8 quando o nome tem acento"""
+    tipo = 'inline' if inline else 'attachment'
+    nome = nome or 'documento.pdf'
+    simples = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii')
+    simples = simples.replace('"', '').replace('\\', '').strip() or 'documento.pdf'
+    valor = f'{tipo}; filename="{simples}"'
+    if simples != nome:
+        valor += f"; filename*=UTF-8''{urllib.parse.quote(nome, safe='')}"
+    return valor
@@ -0,0 +1,182 @@
+"""
+Instrument Search
+Busca textual de instrumentos: texto sem acentos e em minusculas gravado uma
+vez por instrumento (tabela instrumento_busca com indice FULLTEXT), consulta
+em modo booleano com prefixo e ordenacao por relevancia
+"""
+
+import re
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .periodic import PeriodicDbJob
+
+TABLE = 'instrumento_busca'
+
+# Colunas de instrumentos que entram no texto de busca
+SEARCH_COLUMNS = ('identificacao', 'nome', 'descricao', 'responsavel', 'departamento')
+
+# Tamanho minimo de termo do FULLTEXT do InnoDB (innodb_ft_min_token_size)
+MIN_TOKEN = 3
+
+# Palavras que o FULLTEXT ignora ou que so atrapalham o "+termo" obrigatorio
+STOPWORDS = frozenset({'a', 'o', 'e', 'de', 'da', 'do', 'em', 'na', 'no', 'com', 'para', 'das', 'dos', 'por', 'the', 'and'})
+
+CREATE_TABLE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        instrumento_id BIGINT UNSIGNED NOT NULL PRIMARY KEY,
+        user_id BIGINT UNSIGNED NOT NULL,
+        texto TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        KEY idx_ib_user (user_id),
+        FULLTEXT KEY ft_ib_texto (texto)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# Alias ib: junte com instrumentos i
+SEARCH_JOIN = f"LEFT JOIN {TABLE} ib ON ib.instrumento_id = i.id"
+
+_NAO_ALFANUM = re.compile(r'[^a-z0-9]+')
+
+
+def fold_text(texto) -> str:
+    """Minusculas, sem acentos, so letras/digitos separados por espaco"""
+    if texto is None:
+        return ''
+    decomposto = unicodedata.normalize('NFKD', str(texto).lower())
+    sem_acento = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return _NAO_ALFANUM.sub(' ', sem_acento).strip()
+
+
+def build_search_text(row: Dict) -> str:
+    """Texto indexado de um instrumento (identificacao tambem sem separadores: PAQ-001 -> paq001)"""
+    partes = [fold_text(row.get(col)) for col in SEARCH_COLUMNS]
+    ident = partes[0]
+    if ' ' in ident:
+        partes.append(ident.replace(' ', ''))
+    return ' ' + ' '.join(p for p in partes if p) + ' '
+
+
+def search_predicate(termo: str) -> Tuple[str, List, Optional[str], List]:
+    """
+    Predicado de busca sobre o alias ib
+
+    Returns:
+        (sql do WHERE, params, sql da relevancia ou None, params da relevancia).
+        Termos curtos demais para o FULLTEXT viram LIKE de inicio de palavra
+        sobre o texto ja normalizado (sem COLLATE por linha).
+    """
+    tokens = [t for t in fold_text(termo).split() if t not in STOPWORDS]
+    if not tokens:
+        return '', [], None, []
+    longos = [t for t in tokens if len(t) >= MIN_TOKEN]
+    curtos = [t for t in tokens if len(t) < MIN_TOKEN]
+
+    clausulas, params = [], []
+    relevancia, rel_params = None, []
+    if longos:
+        consulta = ' '.join(f'+{t}*' for t in longos)
+        clausulas.append('MATCH(ib.texto) AGAINST (%s IN BOOLEAN MODE)')
+        params.append(consulta)
+        relevancia = 'MATCH(ib.texto) AGAINST (%s IN BOOLEAN MODE)'
+        rel_params = [consulta]
+    for t in curtos:
+        clausulas.append('ib.texto LIKE %s')
+        params.append(f'% {t}%')
+    return ' AND '.join(clausulas), params, relevancia, rel_params
+
+
+def ensure_search_table(cursor):
+    cursor.execute(CREATE_TABLE_SQL)
+
+
+def refresh_search_index(cursor, instrumento_ids: Iterable[int]) -> int:
+    """
+    Atualiza o texto de busca dos instrumentos informados (na transacao do chamador)
+
+    So grava as linhas cujo texto (ou dono) mudou: cada escrita e uma remocao
+    mais uma insercao no indice FULLTEXT, que cresce ate um OPTIMIZE. Linhas
+    de instrumentos que nao existem mais sao apagadas.
+
+    Returns:
+        Quantidade de linhas gravadas ou apagadas
+    """
+    ids = sorted({int(i) for i in instrumento_ids if i})
+    if not ids:
+        return 0
+    marcadores = ', '.join(['%s'] * len(ids))
+    colunas_i = ', '.join(f'i.{c}' for c in SEARCH_COLUMNS)
+    cursor.execute(f"""
+        SELECT i.id, i.user_id, {colunas_i}, ib.user_id AS ib_user_id, ib.texto AS ib_texto
+        FROM instrumentos i
+        {SEARCH_JOIN}
+        WHERE i.id IN ({marcadores})
+    """, ids)
+    colunas = [d[0] for d in cursor.description]
+    linhas = [dict(zip(colunas, r)) if not isinstance(r, dict) else r for r in cursor.fetchall()]
+
+    mudou = []
+    for r in linhas:
+        texto, dono = build_search_text(r), r['user_id'] or 0
+        if r['ib_texto'] != texto or r['ib_user_id'] != dono:
+            mudou.append((r['id'], dono, texto))
+    if mudou:
+        cursor.executemany(f"""
+            INSERT INTO {TABLE} (instrumento_id, user_id, texto) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE user_id = VALUES(user_id), texto = VALUES(texto)
+        """, mudou)
+
+    apagados, removidos = sorted(set(ids) - {r['id'] for r in linhas}), 0
+    if apagados:
+        cursor.execute(
+            f"DELETE FROM {TABLE} WHERE instrumento_id IN ({', '.join(['%s'] * len(apagados))})",
+            apagados
+        )
+        removidos = max(cursor.rowcount or 0, 0)
+    return len(mudou) + removidos
+
+
+def reconcile_search_index(pool, batch_size: int = 1000) -> Dict:
+    """Confere o indice inteiro em lotes (pega edicoes feitas pelo Gocal Laravel) e so grava o que mudou"""
+    inicio = time.perf_counter()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        ensure_search_table(cursor)
+        cursor.close()
+    ultimo_id, total, gravados = 0, 0, 0
+    while True:
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM instrumentos WHERE id > %s ORDER BY id LIMIT %s",
+                           (ultimo_id, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if ids:
+                gravados += refresh_search_index(cursor, ids)
+                total += len(ids)
+                ultimo_id = ids[-1]
+            conn.commit()
+            cursor.close()
+        if len(ids) < batch_size:
+            break
+    # Linhas de instrumentos apagados
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            DELETE ib FROM {TABLE} ib
+            LEFT JOIN instrumentos i ON i.id = ib.instrumento_id
+            WHERE i.id IS NULL
+        """)
+        removidos = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    return {'instruments': total, 'written': gravados, 'deleted': max(removidos or 0, 0),
+            'seconds': round(time.perf_counter() - inicio, 3)}
+
+
+class SearchIndexReconciler(PeriodicDbJob):
+    """Reconciliacao periodica do indice de busca"""
+
+    def __init__(self, pool, interval: float = 600.0, batch_size: int = 1000):
+        super().__init__(pool, reconcile_search_index, name='metron-busca-instrumentos',
+                         interval=interval, batch_size=batch_size)
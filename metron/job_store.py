@@ -0,0 +1,426 @@
+"""
+Job Store
+Estado das tarefas assincronas (/upload-async) com TTL, orcamento de memoria
+e despejo dos PDFs grandes em disco, e a copia publicada para os outros workers
+"""
+
+import io
+import os
+import re
+import json
+import hashlib
+import time
+import threading
+import tempfile
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+class JobStore:
+    """Guarda o estado das tarefas de extracao com limite de bytes e LRU.
+
+    - Tarefas finalizadas expiram apos `ttl_seconds`.
+    - Quando o total estimado passa de `max_bytes`, os PDFs em memoria das
+      tarefas menos usadas vao para disco e, se ainda faltar espaco, as
+      tarefas finalizadas menos usadas sao removidas.
+    - PDFs maiores que `spill_threshold` vao direto para disco.
+    - Tarefas em andamento nunca sao removidas.
+    """
+
+    FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl_seconds: int = 2 * 3600,
+                 spill_threshold: int = 2 * 1024 * 1024, spill_dir: Optional[str] = None):
+        """
+        Inicializa o store
+
+        Args:
+            max_bytes: Orcamento global de memoria (estimado) para todas as tarefas
+            ttl_seconds: Tempo de vida de uma tarefa apos finalizar
+            spill_threshold: Tamanho a partir do qual o PDF vai direto para disco
+            spill_dir: Diretorio dos PDFs despejados (padrao: temp/metron_jobs)
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir or os.path.join(tempfile.gettempdir(), 'metron_jobs')
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._jobs = OrderedDict()   # {task_id: estado}
+        self._pdfs = {}              # {task_id: {idx: bytes | caminho em disco}}
+        self._pdf_info = {}          # {task_id: {idx: (sha256, tamanho)}} para ETag/Range
+        self._job_bytes = {}         # {task_id: bytes em memoria}
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._spills = 0
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+    def create(self, task_id: str, state: Dict) -> Dict:
+        """Registra uma nova tarefa e retorna o estado armazenado"""
+        with self._lock:
+            self._sweep_expired()
+            state.setdefault('files', {})
+            state.setdefault('results', [])
+            state.setdefault('completed', 0)
+            state['created_at'] = time.time()
+            self._jobs[task_id] = state
+            self._pdfs[task_id] = {}
+            self._pdf_info[task_id] = {}
+            self._job_bytes[task_id] = 0
+            self._account(task_id, self._estimate(state))
+            return state
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        """Retorna o estado da tarefa (marca como usada recentemente)"""
+        with self._lock:
+            self._sweep_expired()
+            state = self._jobs.get(task_id)
+            if state is not None:
+                self._jobs.move_to_end(task_id)
+            return state
+
+    def __contains__(self, task_id) -> bool:
+        return self.get(task_id) is not None
+
+    def snapshot(self, task_id: str) -> Optional[Dict]:
+        """Copia rasa do estado, segura para serializar enquanto a tarefa roda"""
+        with self._lock:
+            state = self.get(task_id)
+            if state is None:
+                return None
+            data = dict(state)
+            data['files'] = dict(state.get('files') or {})
+            data['results'] = list(state.get('results') or [])
+            if 'file_errors' in state:
+                data['file_errors'] = dict(state['file_errors'])
+            if 'timings' in state:
+                data['timings'] = dict(state['timings'])
+            return data
+
+    def find(self, **criteria) -> List[Tuple[str, Dict]]:
+        """Tarefas cujos campos batem com os criterios (copia rasa, sem resultados)"""
+        with self._lock:
+            self._sweep_expired()
+            return [(tid, {k: v for k, v in st.items() if k != 'results'})
+                    for tid, st in self._jobs.items()
+                    if all(st.get(k) == v for k, v in criteria.items())]
+
+    def iter_results(self, task_id: str) -> List[Dict]:
+        """Lista (copia) dos resultados de uma tarefa"""
+        with self._lock:
+            state = self._jobs.get(task_id)
+            return list(state.get('results') or []) if state else []
+
+    def update(self, task_id: str, **fields):
+        with self._lock:
+            state = self._jobs.get(task_id)
+            if state is not None:
+                state.update(fields)
+
+    def increment(self, task_id: str, field: str, delta: int = 1):
+        with self._lock:
+            state = self._jobs.get(task_id)
+            if state is not None:
+                state[field] = state.get(field, 0) + delta
+
+    def set_file_status(self, task_id: str, filename: str, status: str, error: Optional[str] = None):
+        with self._lock:
+            state = self._jobs.get(task_id)
+            if state is not None:
+                state['files'][filename] = status
+                if error:
+                    state.setdefault('file_errors', {})[filename] = error
+
+    def set_file_timings(self, task_id: str, filename: str, timings: Dict):
+        """Guarda o tempo/bytes por etapa de um arquivo ({etapa: {'ms', 'bytes'}})"""
+        with self._lock:
+            state = self._jobs.get(task_id)
+            if state is not None:
+                state.setdefault('timings', {})[filename] = timings
+
+    def add_result(self, task_id: str, result: Dict, pdf_bytes: Optional[bytes] = None) -> int:
+        """
+        Anexa um resultado a tarefa
+
+        Args:
+            task_id: ID da tarefa
+            result: Dados extraidos (sem o PDF)
+            pdf_bytes: Conteudo do PDF original, guardado a parte
+
+        Returns:
+            Indice do resultado na lista da tarefa (-1 se a tarefa nao existe)
+        """
+        with self._lock:
+            state = self._jobs.get(task_id)
+            if state is None:
+                return -1
+            state['results'].append(result)
+            idx = len(state['results']) - 1
+            added = self._estimate(result)
+            if pdf_bytes:
+                self._pdf_info[task_id][idx] = (hashlib.sha256(pdf_bytes).hexdigest(), len(pdf_bytes))
+                if len(pdf_bytes) >= self.spill_threshold:
+                    self._pdfs[task_id][idx] = self._spill(task_id, idx, pdf_bytes)
+                else:
+                    self._pdfs[task_id][idx] = pdf_bytes
+                    added += len(pdf_bytes)
+            self._account(task_id, added)
+            self._enforce_budget()
+            return idx
+
+    def finish(self, task_id: str, status: str = 'completed'):
+        """Marca a tarefa como finalizada; o TTL passa a contar daqui"""
+        with self._lock:
+            state = self._jobs.get(task_id)
+            if state is not None:
+                state['status'] = status
+                state['finished_at'] = time.time()
+            self._enforce_budget()
+
+    def discard(self, task_id: str):
+        with self._lock:
+            self._remove(task_id)
+
+    # ------------------------------------------------------------------
+    # PDFs
+    # ------------------------------------------------------------------
+    def get_pdf(self, task_id: str, idx: int) -> Optional[bytes]:
+        """Retorna os bytes do PDF de um item da tarefa (memoria ou disco)"""
+        with self._lock:
+            if task_id in self._jobs:
+                self._jobs.move_to_end(task_id)
+            payload = self._pdfs.get(task_id, {}).get(idx)
+        if payload is None:
+            return None
+        if isinstance(payload, bytes):
+            return payload
+        try:
+            with open(payload, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def pdf_info(self, task_id: str, idx: int) -> Optional[Tuple[str, int]]:
+        """(sha256, tamanho) do PDF de um item, sem ler o conteudo"""
+        with self._lock:
+            return self._pdf_info.get(task_id, {}).get(idx)
+
+    def open_pdf(self, task_id: str, idx: int):
+        """PDF de um item como arquivo binario (memoria ou disco), para entregar em blocos"""
+        with self._lock:
+            payload = self._pdfs.get(task_id, {}).get(idx)
+        if payload is None:
+            return None
+        if isinstance(payload, bytes):
+            return io.BytesIO(payload)
+        try:
+            return open(payload, 'rb')
+        except OSError:
+            return None
+
+    # ------------------------------------------------------------------
+    # Metricas
+    # ------------------------------------------------------------------
+    def stats(self) -> Dict:
+        with self._lock:
+            self._sweep_expired()
+            return {
+                'jobs': len(self._jobs),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'disk_bytes': self._disk_bytes,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'spills': self._spills,
+            }
+
+    # ------------------------------------------------------------------
+    # Internos (chamados com o lock adquirido)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _estimate(obj) -> int:
+        try:
+            return len(json.dumps(obj, ensure_ascii=False, default=str))
+        except Exception:
+            return 0
+
+    def _account(self, task_id: str, delta: int):
+        self._job_bytes[task_id] = self._job_bytes.get(task_id, 0) + delta
+        self._bytes += delta
+
+    def _spill(self, task_id: str, idx: int, pdf_bytes: bytes) -> str:
+        path = os.path.join(self.spill_dir, f"{task_id}_{idx}.pdf")
+        with open(path, 'wb') as f:
+            f.write(pdf_bytes)
+        self._disk_bytes += len(pdf_bytes)
+        self._spills += 1
+        return path
+
+    def _is_finished(self, state: Dict) -> bool:
+        return state.get('status') in self.FINISHED_STATUSES and 'finished_at' in state
+
+    def _sweep_expired(self):
+        now = time.time()
+        expirados = [tid for tid, st in self._jobs.items()
+                     if self._is_finished(st) and now - st['finished_at'] > self.ttl_seconds]
+        for tid in expirados:
+            self._remove(tid)
+            self._expirations += 1
+
+    def _enforce_budget(self):
+        if self._bytes <= self.max_bytes:
+            return
+
+        # 1. Despeja em disco os PDFs em memoria, das tarefas menos usadas primeiro
+        for tid in list(self._jobs.keys()):
+            for idx, payload in list(self._pdfs.get(tid, {}).items()):
+                if isinstance(payload, bytes):
+                    self._pdfs[tid][idx] = self._spill(tid, idx, payload)
+                    self._account(tid, -len(payload))
+                    if self._bytes <= self.max_bytes:
+                        return
+
+        # 2. Remove tarefas finalizadas, da menos usada para a mais usada
+        for tid in list(self._jobs.keys()):
+            if self._bytes <= self.max_bytes:
+                return
+            if self._is_finished(self._jobs[tid]):
+                self._remove(tid)
+                self._evictions += 1
+                print(f"[JOB-STORE] Tarefa {tid[:8]}... removida (orcamento de memoria)")
+
+    def _remove(self, task_id: str):
+        self._jobs.pop(task_id, None)
+        self._bytes -= self._job_bytes.pop(task_id, 0)
+        self._pdf_info.pop(task_id, None)
+        for payload in (self._pdfs.pop(task_id, None) or {}).values():
+            if isinstance(payload, str):
+                try:
+                    self._disk_bytes -= os.path.getsize(payload)
+                    os.remove(payload)
+                except OSError:
+                    pass
+
+
+class TaskBoard:
+    """Copia em disco do estado das tarefas, legivel por todos os workers.
+
+    O JobStore e a fila sao do processo que abriu a tarefa; ele publica aqui
+    o estado, os resultados e os PDFs, e qualquer outro worker le daqui
+    (status, PDFs do lote, gravacao no banco, tarefas da pasta vigiada).
+    O diretorio precisa ser comum aos workers.
+    """
+
+    _ID = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+    def __init__(self, directory: str, ttl_seconds: int = 2 * 3600):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._varrido_em = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def publish(self, task_id: str, state: Dict, pdf_info: Optional[Dict[int, Tuple[str, int]]] = None):
+        """Grava o estado da tarefa (troca atomica; leitores nunca veem meio arquivo)"""
+        if not self._valido(task_id):
+            return
+        if time.time() - self._varrido_em > 60:
+            self._sweep_expired()
+        dados = dict(state)
+        dados['pdf_info'] = {str(idx): list(info) for idx, info in (pdf_info or {}).items() if info}
+        caminho = self._estado(task_id)
+        tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(dados, f, ensure_ascii=False, default=str)
+            os.replace(tmp, caminho)
+        except OSError as e:
+            print(f"[JOB-BOARD] Falha ao publicar tarefa {task_id[:8]}...: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def publish_pdf(self, task_id: str, idx: int, pdf_bytes: bytes):
+        if not self._valido(task_id) or not pdf_bytes:
+            return
+        caminho = self._pdf(task_id, idx)
+        try:
+            with open(caminho + '.tmp', 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(caminho + '.tmp', caminho)
+        except OSError as e:
+            print(f"[JOB-BOARD] Falha ao publicar PDF {task_id[:8]}.../{idx}: {e}")
+
+    def load(self, task_id: str) -> Optional[Dict]:
+        """Estado publicado (com resultados e pdf_info) ou None"""
+        if not self._valido(task_id):
+            return None
+        try:
+            with open(self._estado(task_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def find(self, **criteria) -> List[Tuple[str, Dict]]:
+        """Tarefas publicadas cujos campos batem com os criterios (sem resultados)"""
+        self._sweep_expired()
+        tarefas = []
+        for nome in os.listdir(self.directory):
+            task_id = nome[:-5]
+            if not nome.endswith('.json') or not self._valido(task_id):
+                continue
+            estado = self.load(task_id)
+            if estado and all(estado.get(k) == v for k, v in criteria.items()):
+                tarefas.append((task_id, {k: v for k, v in estado.items() if k not in ('results', 'pdf_info')}))
+        return tarefas
+
+    def pdf_info(self, state: Dict, idx: int) -> Optional[Tuple[str, int]]:
+        info = (state.get('pdf_info') or {}).get(str(idx))
+        return tuple(info) if info else None
+
+    def open_pdf(self, task_id: str, idx: int):
+        if not self._valido(task_id):
+            return None
+        try:
+            return open(self._pdf(task_id, idx), 'rb')
+        except OSError:
+            return None
+
+    def get_pdf(self, task_id: str, idx: int) -> Optional[bytes]:
+        f = self.open_pdf(task_id, idx)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def _valido(self, task_id) -> bool:
+        return bool(task_id) and self._ID.fullmatch(str(task_id)) is not None
+
+    def _estado(self, task_id: str) -> str:
+        return os.path.join(self.directory, f"{task_id}.json")
+
+    def _pdf(self, task_id: str, idx: int) -> str:
+        return os.path.join(self.directory, f"{task_id}_{int(idx)}.pdf")
+
+    def _sweep_expired(self):
+        """Remove tarefas finalizadas ha mais de ttl_seconds (estado e PDFs)"""
+        agora = self._varrido_em = time.time()
+        for nome in os.listdir(self.directory):
+            if not nome.endswith('.json'):
+                continue
+            task_id = nome[:-5]
+            estado = self.load(task_id)
+            fim = (estado or {}).get('finished_at')
+            if not fim or agora - float(fim) <= self.ttl_seconds:
+                continue
+            for arquivo in os.listdir(self.directory):
+                if arquivo == nome or arquivo.startswith(task_id + '_'):
+                    try:
+                        os.remove(os.path.join(self.directory, arquivo))
+                    except OSError:
+                        pass
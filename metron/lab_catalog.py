@@ -0,0 +1,200 @@
+"""
+Lab Catalog
+Catalogo em memoria dos laboratorios e do escopo de calibracao: indice
+invertido dos termos de servico (sem acentos, expandidos pelos aliases de
+instrumento) para responder "quem calibra X" sem LIKE no banco
+"""
+
+import time
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from .instrument_search import STOPWORDS, fold_text
+
+# Colunas de laboratorio devolvidas junto com cada servico encontrado
+LAB_FIELDS = ('id', 'nome_laboratorio', 'uf', 'cidade', 'situacao', 'telefone', 'email', 'acreditacao_num')
+SCOPE_FIELDS = ('descricao_servico', 'grupo', 'cmc')
+LEGACY_SEARCH_FIELDS = ('nome', 'contato', 'email', 'cidade', 'estado')
+
+
+class LabCatalog:
+    """Laboratorios, escopo de calibracao e a tabela legada `laboratorios` em memoria.
+
+    O loader devolve {'labs': [...], 'scopes': [...], 'legacy': [...]} (linhas
+    como dict). A carga acontece na primeira consulta (ou em warm()) e se
+    repete em background a cada `refresh_seconds`; as consultas usam a versao
+    anterior enquanto a nova carrega.
+
+    Termos de servico casam por prefixo de palavra ("paquimetro" acha
+    "Paquimetros"); um termo que e alias de instrumento tambem busca as
+    grandezas associadas (multimetro -> tensao, corrente, ...).
+    """
+
+    def __init__(self, loader: Callable[[], Dict[str, List[Dict]]],
+                 aliases: Optional[Dict[str, Iterable[str]]] = None, refresh_seconds: float = 900.0):
+        """
+        Inicializa o catalogo
+
+        Args:
+            loader: Carrega as tabelas (ver docstring da classe)
+            aliases: {instrumento: [termos de servico]} (ex.: _INSTRUMENTO_ALIASES)
+            refresh_seconds: Idade maxima antes de recarregar
+        """
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds
+        self.aliases = {}
+        for chave, termos in (aliases or {}).items():
+            self.aliases.setdefault(fold_text(chave), set()).update(fold_text(t) for t in termos if fold_text(t))
+        self._lock = threading.Lock()
+        self._recarregando = False
+        self._snapshot = None
+        self._stats = {'loads': 0, 'load_errors': 0, 'last_load_ms': None, 'lookups': 0}
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def find_capabilities(self, termo: str, active_only: bool = True) -> List[Dict]:
+        """
+        Servicos que casam com o termo, um dict por (laboratorio, servico)
+
+        Cada palavra do termo casa por prefixo e pelos aliases; ficam os
+        servicos que casam com mais palavras.
+        """
+        snap = self._atual()
+        tokens = [t for t in fold_text(termo).split() if t not in STOPWORDS]
+        if not tokens:
+            return []
+        pontos = {}
+        for token in tokens:
+            for idx in self._postings(snap, token):
+                pontos[idx] = pontos.get(idx, 0) + 1
+        if not pontos:
+            return []
+        melhor = max(pontos.values())
+        vistos, saida = set(), []
+        for idx in sorted(i for i, p in pontos.items() if p == melhor):
+            escopo = snap['scopes'][idx]
+            lab = snap['labs'].get(escopo['laboratorio_id'])
+            if lab is None or (active_only and lab.get('situacao') != 'Ativo'):
+                continue
+            linha = {**{k: lab.get(k) for k in LAB_FIELDS}, **{k: escopo.get(k) for k in SCOPE_FIELDS}}
+            chave = tuple(linha.values())
+            if chave not in vistos:
+                vistos.add(chave)
+                saida.append(linha)
+        return saida
+
+    def search_legacy(self, termo: str = '', limit: int = 50) -> List[Dict]:
+        """Tabela legada `laboratorios`: trecho do termo em nome/contato/email/cidade/estado, por nome"""
+        snap = self._atual()
+        alvo = fold_text(termo)
+        linhas = [row for row, texto in snap['legacy'] if not alvo or alvo in texto]
+        return [dict(r) for r in linhas[:limit]]
+
+    def coordinates(self) -> List[tuple]:
+        """(id, latitude, longitude) dos laboratorios ativos com coordenadas (para o LabGeoIndex)"""
+        snap = self._atual()
+        return [(lab['id'], lab.get('latitude'), lab.get('longitude')) for lab in snap['labs'].values()
+                if lab.get('situacao') == 'Ativo' and lab.get('latitude') is not None
+                and lab.get('longitude') is not None]
+
+    def warm(self):
+        """Carrega em background (chamado na partida do app)"""
+        threading.Thread(target=self._refresh_silencioso, name='metron-lab-catalog', daemon=True).start()
+
+    def refresh(self):
+        """Recarrega agora (sincrono)"""
+        inicio = time.perf_counter()
+        try:
+            dados = self.loader()
+        except Exception as e:
+            print(f"[LAB-CATALOG] Falha ao carregar catalogo: {e}")
+            with self._lock:
+                self._stats['load_errors'] += 1
+                self._recarregando = False
+            raise
+        snap = self._montar(dados)
+        with self._lock:
+            self._snapshot = snap
+            self._recarregando = False
+            self._stats['loads'] += 1
+            self._stats['last_load_ms'] = round((time.perf_counter() - inicio) * 1000.0, 1)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            snap = self._snapshot
+            return {
+                'labs': len(snap['labs']) if snap else 0,
+                'scopes': len(snap['scopes']) if snap else 0,
+                'terms': len(snap['terms']) if snap else 0,
+                'legacy_labs': len(snap['legacy']) if snap else 0,
+                'age_seconds': round(time.time() - snap['loaded_at'], 1) if snap else None,
+                **self._stats,
+            }
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _montar(dados: Dict[str, List[Dict]]) -> Dict:
+        labs = {row['id']: row for row in dados.get('labs', [])}
+        scopes = list(dados.get('scopes', []))
+        postings = {}
+        for idx, escopo in enumerate(scopes):
+            texto = fold_text(f"{escopo.get('descricao_servico') or ''} {escopo.get('grupo') or ''}")
+            for termo in set(texto.split()):
+                postings.setdefault(termo, []).append(idx)
+        legacy = sorted(dados.get('legacy', []), key=lambda r: (r.get('nome') or ''))
+        legacy = [(row, '\n'.join(fold_text(row.get(c)) for c in LEGACY_SEARCH_FIELDS)) for row in legacy]
+        return {
+            'labs': labs,
+            'scopes': scopes,
+            'postings': postings,
+            'terms': sorted(postings),
+            'legacy': legacy,
+            'loaded_at': time.time(),
+        }
+
+    def _postings(self, snap: Dict, token: str) -> Set[int]:
+        prefixos = {token}
+        for chave, termos in self.aliases.items():
+            if chave.startswith(token) or token.startswith(chave):
+                prefixos.update(termos)
+        ids = set()
+        for prefixo in prefixos:
+            ids.update(self._por_prefixo(snap, prefixo))
+        with self._lock:
+            self._stats['lookups'] += 1
+        return ids
+
+    @staticmethod
+    def _por_prefixo(snap: Dict, prefixo: str) -> Set[int]:
+        termos, postings = snap['terms'], snap['postings']
+        ids = set()
+        i = bisect.bisect_left(termos, prefixo)
+        while i < len(termos) and termos[i].startswith(prefixo):
+            ids.update(postings[termos[i]])
+            i += 1
+        return ids
+
+    def _atual(self) -> Dict:
+        with self._lock:
+            snap = self._snapshot
+            vencido = snap is not None and time.time() - snap['loaded_at'] > self.refresh_seconds
+            disparar = vencido and not self._recarregando
+            if disparar:
+                self._recarregando = True
+        if snap is None:
+            self.refresh()
+            with self._lock:
+                return self._snapshot
+        if disparar:
+            threading.Thread(target=self._refresh_silencioso, name='metron-lab-catalog', daemon=True).start()
+        return snap
+
+    def _refresh_silencioso(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass
@@ -0,0 +1,153 @@
+"""
+Latest Calibration
+Projecao da ultima calibracao de cada instrumento (tabela resumo), para as
+listagens nao rodarem uma subconsulta correlacionada por instrumento
+"""
+
+import time
+from typing import Dict, Iterable
+
+from .periodic import PeriodicDbJob
+
+TABLE = 'instrumento_ultima_calibracao'
+
+CREATE_TABLE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        instrumento_id BIGINT UNSIGNED NOT NULL PRIMARY KEY,
+        calibracao_id BIGINT UNSIGNED NOT NULL,
+        data_calibracao DATE NULL,
+        data_proxima_calibracao DATE NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        KEY idx_iuc_proxima (data_proxima_calibracao),
+        KEY idx_iuc_calibracao (calibracao_id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# JOIN que substitui "c.id = (SELECT id FROM calibracoes ... ORDER BY data_calibracao DESC LIMIT 1)"
+LATEST_CALIBRATION_JOIN = f"""
+    LEFT JOIN {TABLE} uc ON uc.instrumento_id = i.id
+    LEFT JOIN calibracoes c ON c.id = uc.calibracao_id
+"""
+
+# Maior data por instrumento e, nela, o maior id (sem funcao de janela: roda no MySQL 5.7);
+# {marcadores} = ids dos instrumentos
+REFRESH_SQL = f"""
+    INSERT INTO {TABLE} (instrumento_id, calibracao_id, data_calibracao, data_proxima_calibracao)
+    SELECT c.instrumento_id, c.id, c.data_calibracao, c.data_proxima_calibracao
+    FROM calibracoes c
+    JOIN (
+        SELECT m.instrumento_id, MAX(c2.id) AS id
+        FROM (
+            SELECT instrumento_id, MAX(data_calibracao) AS data_calibracao
+            FROM calibracoes
+            WHERE instrumento_id IN ({{marcadores}})
+            GROUP BY instrumento_id
+        ) m
+        JOIN calibracoes c2 ON c2.instrumento_id = m.instrumento_id
+            AND (c2.data_calibracao = m.data_calibracao
+                 OR (m.data_calibracao IS NULL AND c2.data_calibracao IS NULL))
+        GROUP BY m.instrumento_id
+    ) ultima ON ultima.id = c.id
+    ON DUPLICATE KEY UPDATE
+        calibracao_id = VALUES(calibracao_id),
+        data_calibracao = VALUES(data_calibracao),
+        data_proxima_calibracao = VALUES(data_proxima_calibracao)
+"""
+DELETE_WITHOUT_CALIBRATION_SQL = f"""
+    DELETE uc FROM {TABLE} uc
+    LEFT JOIN calibracoes c ON c.instrumento_id = uc.instrumento_id
+    WHERE uc.instrumento_id IN ({{marcadores}}) AND c.id IS NULL
+"""
+
+
+def ensure_latest_calibration_table(cursor):
+    cursor.execute(CREATE_TABLE_SQL)
+
+
+def refresh_latest_calibrations(cursor, instrumento_ids: Iterable[int]) -> int:
+    """
+    Recalcula a ultima calibracao dos instrumentos informados
+
+    Roda na transacao do chamador (quem grava a calibracao faz o commit).
+    Desempate por id: com duas calibracoes na mesma data vale a mais nova.
+
+    Returns:
+        Quantidade de instrumentos recalculados
+    """
+    ids = sorted({int(i) for i in instrumento_ids if i})
+    if not ids:
+        return 0
+    marcadores = ', '.join(['%s'] * len(ids))
+    cursor.execute(REFRESH_SQL.format(marcadores=marcadores), ids)
+    # Instrumentos que ficaram sem calibracao saem da projecao
+    cursor.execute(DELETE_WITHOUT_CALIBRATION_SQL.format(marcadores=marcadores), ids)
+    return len(ids)
+
+
+def backfill_latest_calibrations(cursor, batch_size: int = 1000, commit=None) -> int:
+    """
+    Preenche a projecao de todos os instrumentos com um cursor ja aberto
+    (migracao: as listagens nao ficam vazias ate a primeira reconciliacao)
+
+    Args:
+        commit: Chamado depois de cada lote (ex.: conn.commit), para transacoes curtas
+    """
+    ultimo_id, total = 0, 0
+    while True:
+        cursor.execute("SELECT id FROM instrumentos WHERE id > %s ORDER BY id LIMIT %s",
+                       (ultimo_id, batch_size))
+        ids = [row[0] for row in cursor.fetchall()]
+        if ids:
+            total += refresh_latest_calibrations(cursor, ids)
+            ultimo_id = ids[-1]
+            if commit:
+                commit()
+        if len(ids) < batch_size:
+            return total
+
+
+def reconcile_latest_calibrations(pool, batch_size: int = 1000) -> Dict:
+    """
+    Reconstroi a projecao inteira em lotes de instrumentos
+
+    Cobre calibracoes gravadas fora deste app (ex.: pelo Gocal Laravel) e
+    remove linhas de instrumentos apagados. Cada lote e uma transacao curta.
+    """
+    inicio = time.perf_counter()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        ensure_latest_calibration_table(cursor)
+        cursor.close()
+    ultimo_id, total = 0, 0
+    while True:
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM instrumentos WHERE id > %s ORDER BY id LIMIT %s",
+                           (ultimo_id, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if ids:
+                total += refresh_latest_calibrations(cursor, ids)
+                ultimo_id = ids[-1]
+            conn.commit()
+            cursor.close()
+        if len(ids) < batch_size:
+            break
+    # Linhas de instrumentos apagados
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            DELETE uc FROM {TABLE} uc
+            LEFT JOIN instrumentos i ON i.id = uc.instrumento_id
+            WHERE i.id IS NULL
+        """)
+        conn.commit()
+        cursor.close()
+    return {'instruments': total, 'seconds': round(time.perf_counter() - inicio, 3)}
+
+
+class LatestCalibrationReconciler(PeriodicDbJob):
+    """Reconciliacao periodica da projecao em uma thread do processo"""
+
+    def __init__(self, pool, interval: float = 300.0, batch_size: int = 1000):
+        super().__init__(pool, reconcile_latest_calibrations, name='metron-ultima-calibracao',
+                         interval=interval, batch_size=batch_size)
@@ -0,0 +1,82 @@
+"""
+Pagination
+Cursor opaco para paginacao por chave (keyset): a proxima pagina continua
+a partir dos valores de ordenacao do ultimo item, sem OFFSET, entao toda
+pagina custa o mesmo em qualquer profundidade
+"""
+
+import json
+import base64
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+def encode_cursor(values: List) -> str:
+    """Valores de ordenacao do ultimo item -> token para o cliente"""
+    texto = json.dumps(list(values), separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str, size: int) -> Optional[List]:
+    """Token -> valores de ordenacao (None se vazio ou invalido)"""
+    if not token:
+        return None
+    try:
+        texto = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        values = json.loads(texto)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def parse_fields(raw: str, allowed, default) -> List[str]:
+    """
+    Projecao de campos pedida pelo cliente (?fields=a,b,c)
+
+    Campos fora de `allowed` sao ignorados; sem nenhum valido vale `default`.
+    """
+    pedidos = [f.strip() for f in (raw or '').split(',') if f.strip()]
+    campos = [f for f in pedidos if f in allowed]
+    return list(dict.fromkeys(campos)) if campos else list(default)
+
+
+def parse_sort(raw: str, allowed: Dict, default: str) -> Tuple[str, bool]:
+    """
+    Ordenacao pedida pelo cliente (?ordenar=nome ou ?ordenar=-created_at para decrescente)
+
+    Returns:
+        (campo, decrescente); campo fora de `allowed` cai no `default`
+    """
+    for pedido in ((raw or '').strip(), default):
+        desc = pedido.startswith('-')
+        campo = pedido.lstrip('-+')
+        if campo in allowed:
+            return campo, desc
+    raise ValueError(f"Ordenacao padrao invalida: {default}")
+
+
+def keyset_order(expr: str, desc: bool, id_expr: str = 'id') -> str:
+    """ORDER BY estavel: a expressao de ordenacao e o id como desempate, no mesmo sentido"""
+    sentido = 'DESC' if desc else 'ASC'
+    return f" ORDER BY {expr} {sentido}, {id_expr} {sentido}"
+
+
+def keyset_predicate(expr: str, desc: bool, last_value, last_id, id_expr: str = 'id',
+                     expr_params: Sequence = ()) -> Tuple[str, List]:
+    """
+    Condicao que continua depois de (last_value, last_id) na ordem de keyset_order
+
+    NULL conta como o menor valor, como o MySQL ordena (primeiro em ASC, ultimo
+    em DESC). `expr_params` sao os parametros da propria expressao (ex.: MATCH)
+    e entram a cada vez que ela aparece.
+    """
+    ep = list(expr_params)
+    if desc:
+        if last_value is None:
+            return f"({expr} IS NULL AND {id_expr} < %s)", ep + [last_id]
+        return (f"({expr} < %s OR ({expr} = %s AND {id_expr} < %s) OR {expr} IS NULL)",
+                ep + [last_value] + ep + [last_value, last_id] + ep)
+    if last_value is None:
+        return f"(({expr} IS NULL AND {id_expr} > %s) OR {expr} IS NOT NULL)", ep + [last_id] + ep
+    return f"({expr} > %s OR ({expr} = %s AND {id_expr} > %s))", ep + [last_value] + ep + [last_value, last_id]
@@ -0,0 +1,72 @@
+"""
+Periodic DB Job
+Job periodico de manutencao do banco (reconciliacao de tabelas derivadas)
+rodando em uma thread do processo
+"""
+
+import time
+import threading
+from typing import Callable, Dict, Optional
+
+
+class PeriodicDbJob:
+    """Roda func(pool, batch_size) na partida e depois a cada `interval` segundos.
+
+    Falhas sao registradas em stats() e o job tenta de novo no proximo ciclo.
+    """
+
+    def __init__(self, pool, func: Callable[..., Dict], name: str,
+                 interval: float = 300.0, batch_size: int = 1000):
+        """
+        Inicializa o job
+
+        Args:
+            pool: ConnectionPool do app
+            func: Reconciliacao; recebe (pool, batch_size) e retorna um resumo
+            name: Nome da thread e prefixo dos logs
+            interval: Segundos entre execucoes (a primeira roda na partida)
+            batch_size: Linhas por transacao
+        """
+        self.pool = pool
+        self.func = func
+        self.name = name
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'errors': 0, 'last_run': None, 'last_result': None, 'last_error': None}
+
+    def start(self) -> bool:
+        if self._thread is not None:
+            return False
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self) -> Optional[Dict]:
+        try:
+            resultado = self.func(self.pool, self.batch_size)
+        except Exception as e:
+            print(f"[{self.name.upper()}] Falha na reconciliacao: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+                self._stats['last_error'] = str(e)
+            return None
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['last_run'] = int(time.time())
+            self._stats['last_result'] = resultado
+        return resultado
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'interval': self.interval, **self._stats}
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
@@ -0,0 +1,260 @@
+"""
+Extraction Scheduler
+Fila unica na frente do extrator: classes de prioridade (chat interativo
+antes do lote), divisao justa da capacidade entre clientes dentro da classe
+e controle de tarefas (pausar, retomar, cancelar)
+"""
+
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+PRIORIDADE_INTERATIVA = 0
+PRIORIDADE_LOTE = 1
+
+
+class _WorkItem:
+    __slots__ = ('fn', 'args', 'kwargs', 'future', 'job_id', 'tenant', 'enqueued_at')
+
+    def __init__(self, fn, args, kwargs, job_id, tenant):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.job_id = job_id
+        self.tenant = tenant
+        self.enqueued_at = time.time()
+
+
+class ExtractionScheduler:
+    """Executa extracoes com um numero fixo de workers.
+
+    A proxima extracao sai sempre da classe de maior prioridade com itens
+    pendentes. Dentro da classe os clientes (user_id/empresa_id) sao
+    atendidos em rodizio, um item por vez, para que um lote de 300 PDFs
+    nao bloqueie o PDF unico de outro cliente.
+
+    Itens de tarefas pausadas ficam na fila sem serem despachados; itens de
+    tarefas canceladas saem da fila e o evento de cancelamento da tarefa
+    avisa as extracoes em andamento.
+    """
+
+    def __init__(self, workers: int = 5):
+        """
+        Inicializa o scheduler
+
+        Args:
+            workers: Numero de extracoes simultaneas (limite de quota do provedor)
+        """
+        self.workers = max(1, workers)
+        self._cond = threading.Condition()
+        # {prioridade: OrderedDict{tenant: deque[_WorkItem]}}
+        self._queues = {}
+        self._running = 0
+        self._threads = []
+        self._avg_duration = 20.0  # segundos por extracao (media movel)
+        self._completed = 0
+        self._paused = set()         # job_ids pausados
+        self._cancel_events = {}     # {job_id: threading.Event}
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def submit(self, fn: Callable, *args, priority: int = PRIORIDADE_LOTE,
+               tenant: str = '', job_id: Optional[str] = None, **kwargs) -> Future:
+        """
+        Enfileira uma extracao
+
+        Args:
+            fn: Funcao a executar no worker
+            priority: PRIORIDADE_INTERATIVA ou PRIORIDADE_LOTE
+            tenant: Chave de divisao justa (empresa/usuario)
+            job_id: Tarefa a que o item pertence (para posicao na fila)
+
+        Returns:
+            Future com o resultado de fn
+        """
+        item = _WorkItem(fn, args, kwargs, job_id, tenant or '')
+        with self._cond:
+            self._ensure_workers()
+            tenants = self._queues.setdefault(priority, OrderedDict())
+            tenants.setdefault(item.tenant, deque()).append(item)
+            self._cond.notify()
+        return item.future
+
+    def cancel_event(self, job_id: str) -> threading.Event:
+        """Evento sinalizado quando a tarefa e cancelada (para extracoes em andamento)"""
+        with self._cond:
+            return self._cancel_events.setdefault(job_id, threading.Event())
+
+    def is_cancelled(self, job_id: str) -> bool:
+        with self._cond:
+            ev = self._cancel_events.get(job_id)
+            return bool(ev and ev.is_set())
+
+    def is_paused(self, job_id: str) -> bool:
+        with self._cond:
+            return job_id in self._paused
+
+    def pause(self, job_id: str) -> int:
+        """Para de despachar itens da tarefa. Retorna quantos ficaram retidos."""
+        with self._cond:
+            self._paused.add(job_id)
+            return sum(1 for item in self._all_items() if item.job_id == job_id)
+
+    def resume(self, job_id: str) -> int:
+        """Volta a despachar itens da tarefa. Retorna quantos voltaram para a fila."""
+        with self._cond:
+            self._paused.discard(job_id)
+            self._cond.notify_all()
+            return sum(1 for item in self._all_items() if item.job_id == job_id)
+
+    def cancel(self, job_id: str) -> int:
+        """
+        Cancela a tarefa: remove os itens pendentes da fila e sinaliza o
+        evento de cancelamento para as extracoes que ja estao rodando
+
+        Returns:
+            Quantidade de itens pendentes removidos da fila
+        """
+        cancelados = []
+        with self._cond:
+            self._cancel_events.setdefault(job_id, threading.Event()).set()
+            self._paused.discard(job_id)
+            for tenants in self._queues.values():
+                for tenant in list(tenants.keys()):
+                    fila = tenants[tenant]
+                    restantes = deque()
+                    for item in fila:
+                        if item.job_id == job_id:
+                            cancelados.append(item.future)
+                        else:
+                            restantes.append(item)
+                    if restantes:
+                        tenants[tenant] = restantes
+                    else:
+                        del tenants[tenant]
+        # Fora do lock: future.cancel() roda os done-callbacks nesta thread, e eles
+        # podem pegar locks do chamador que, por sua vez, consultam o scheduler
+        for future in cancelados:
+            future.cancel()
+        return len(cancelados)
+
+    def forget(self, job_id: str):
+        """Libera o estado de controle de uma tarefa finalizada"""
+        with self._cond:
+            self._paused.discard(job_id)
+            self._cancel_events.pop(job_id, None)
+
+    def queue_info(self, job_id: str) -> Optional[Dict]:
+        """
+        Posicao do primeiro item pendente da tarefa e estimativa de inicio
+
+        Returns:
+            {'queue_position', 'queued_items', 'estimated_start_seconds'} ou None
+            se a tarefa nao tem itens aguardando
+        """
+        with self._cond:
+            ordem = self._dispatch_order()
+            posicao = None
+            pendentes = 0
+            for i, item in enumerate(ordem):
+                if item.job_id == job_id:
+                    pendentes += 1
+                    if posicao is None:
+                        posicao = i
+            if posicao is None:
+                return None
+            # Quantas extracoes precisam terminar antes deste item comecar
+            livres = self.workers - self._running
+            necessarias = max(0, posicao - livres + 1)
+            return {
+                'queue_position': posicao + 1,
+                'queued_items': pendentes,
+                'estimated_start_seconds': int(round(necessarias / self.workers * self._avg_duration)),
+            }
+
+    def stats(self) -> Dict:
+        with self._cond:
+            por_classe = {str(prio): sum(len(q) for q in tenants.values())
+                          for prio, tenants in self._queues.items()}
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': por_classe,
+                'paused_jobs': len(self._paused),
+                'completed': self._completed,
+                'avg_duration_seconds': round(self._avg_duration, 2),
+            }
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f'metron-extract-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _all_items(self) -> List[_WorkItem]:
+        return [item for tenants in self._queues.values() for fila in tenants.values() for item in fila]
+
+    def _dispatch_order(self) -> List[_WorkItem]:
+        """Simula a ordem de saida da fila (prioridade, depois rodizio), sem pausados"""
+        ordem = []
+        for prio in sorted(self._queues):
+            filas = [[item for item in q if item.job_id not in self._paused]
+                     for q in self._queues[prio].values()]
+            rodada = 0
+            while True:
+                houve = False
+                for fila in filas:
+                    if rodada < len(fila):
+                        ordem.append(fila[rodada])
+                        houve = True
+                if not houve:
+                    break
+                rodada += 1
+        return ordem
+
+    def _next_item(self) -> Optional[_WorkItem]:
+        for prio in sorted(self._queues):
+            tenants = self._queues[prio]
+            for tenant in list(tenants.keys()):
+                fila = tenants[tenant]
+                item = next((it for it in fila if it.job_id not in self._paused), None)
+                if item is None:
+                    continue
+                fila.remove(item)
+                # Rodizio: o cliente atendido vai para o fim da fila da classe
+                del tenants[tenant]
+                if fila:
+                    tenants[tenant] = fila
+                if item.future.set_running_or_notify_cancel():
+                    return item
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                item = self._next_item()
+                while item is None:
+                    self._cond.wait()
+                    item = self._next_item()
+                self._running += 1
+
+            inicio = time.time()
+            try:
+                item.future.set_result(item.fn(*item.args, **item.kwargs))
+            except BaseException as e:
+                item.future.set_exception(e)
+            finally:
+                duracao = time.time() - inicio
+                with self._cond:
+                    self._running -= 1
+                    self._completed += 1
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * duracao
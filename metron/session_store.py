@@ -0,0 +1,488 @@
+"""
+Session Store
+Documentos extraidos por sessao, compartilhados entre os workers do
+servidor (gunicorn -w N): memoria do processo, arquivo SQLite ou Redis.
+Os backends guardam cada documento como blob comprimido (compact_docs).
+"""
+
+import time
+import socket
+import struct
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from .compact_docs import LazyDocs, pack_doc
+
+_FRAME = struct.Struct('>I')
+
+
+def _join_blobs(blobs: List[bytes]) -> bytes:
+    """Lista de blobs -> um unico payload (cada blob prefixado pelo tamanho)"""
+    return b''.join(_FRAME.pack(len(b)) + b for b in blobs)
+
+
+def _split_blobs(payload: bytes) -> List[bytes]:
+    blobs, pos = [], 0
+    while pos < len(payload):
+        (n,) = _FRAME.unpack_from(payload, pos)
+        pos += _FRAME.size
+        blobs.append(bytes(payload[pos:pos + n]))
+        pos += n
+    return blobs
+
+
+# ============================================================
+# BACKENDS
+# ============================================================
+class MemoryBackend:
+    """Dict LRU no proprio processo (um worker so, ou desenvolvimento).
+
+    Limitado por orcamento de bytes (tamanho comprimido de cada sessao), por
+    numero de sessoes e por tempo ocioso: sessoes abandonadas expiram e as
+    menos usadas saem primeiro quando o orcamento estoura.
+    """
+
+    name = 'memory'
+
+    def __init__(self, max_sessions: int = 1000, max_bytes: int = 128 * 1024 * 1024,
+                 ttl_seconds: int = 4 * 3600, max_items: int = 200):
+        self.max_sessions = max(1, max_sessions)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max(1, max_items)
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # {session_id: [blobs, bytes, ultimo_acesso]}
+        self._bytes = 0
+        self._ultima_varredura = 0.0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'trimmed': 0}
+
+    def load(self, session_id: str) -> Optional[List[bytes]]:
+        with self._lock:
+            self._sweep_expired()
+            entry = self._data.get(session_id)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            entry[2] = time.time()
+            self._data.move_to_end(session_id)
+            self._stats['hits'] += 1
+            return list(entry[0])
+
+    def save(self, session_id: str, blobs: List[bytes]):
+        with self._lock:
+            self._put(session_id, list(blobs))
+
+    def append(self, session_id: str, blobs: List[bytes]):
+        with self._lock:
+            entry = self._data.get(session_id)
+            self._put(session_id, (entry[0] if entry else []) + list(blobs))
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._remove(session_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._sweep_expired()
+            return {'sessions': len(self._data), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    **self._stats}
+
+    def _put(self, session_id: str, blobs: List[bytes]):
+        if len(blobs) > self.max_items:
+            self._stats['trimmed'] += len(blobs) - self.max_items
+            blobs = blobs[-self.max_items:]
+        self._remove(session_id)
+        tamanho = sum(len(b) for b in blobs)
+        self._data[session_id] = [blobs, tamanho, time.time()]
+        self._bytes += tamanho
+        self._sweep_expired()
+        # Orcamento: sai a sessao menos usada (nunca a que acabou de ser gravada)
+        while (self._bytes > self.max_bytes or len(self._data) > self.max_sessions) and len(self._data) > 1:
+            antigo = next(iter(self._data))
+            self._remove(antigo)
+            self._stats['evictions'] += 1
+
+    def _remove(self, session_id: str):
+        entry = self._data.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _sweep_expired(self):
+        agora = time.time()
+        # Varre no maximo a cada 30s; a ordem LRU permite parar no primeiro ativo
+        if agora - self._ultima_varredura < 30:
+            return
+        self._ultima_varredura = agora
+        limite = agora - self.ttl_seconds
+        while self._data:
+            sid, entry = next(iter(self._data.items()))
+            if entry[2] >= limite:
+                break
+            self._remove(sid)
+            self._stats['expirations'] += 1
+
+
+class SQLiteBackend:
+    """Arquivo SQLite compartilhado pelos workers da mesma maquina (modo WAL)"""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str, ttl_seconds: int = 24 * 3600, max_items: int = 200):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max(1, max_items)
+        self._local = threading.local()
+        self._ultima_limpeza = 0.0
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_blobs ("
+                " session_id TEXT PRIMARY KEY,"
+                " payload BLOB NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_session_blobs_updated ON session_blobs(updated_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id: str) -> Optional[List[bytes]]:
+        row = self._conn().execute(
+            "SELECT payload FROM session_blobs WHERE session_id = ? AND updated_at >= ?",
+            (session_id, time.time() - self.ttl_seconds)
+        ).fetchone()
+        return _split_blobs(row[0]) if row else None
+
+    def save(self, session_id: str, blobs: List[bytes]):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO session_blobs (session_id, payload, updated_at) VALUES (?, ?, ?)",
+            (session_id, _join_blobs(list(blobs)[-self.max_items:]), time.time())
+        )
+        self._limpar_periodicamente()
+
+    def append(self, session_id: str, blobs: List[bytes]):
+        conn = self._conn()
+        # BEGIN IMMEDIATE: le-modifica-grava sem perder extend concorrente de outro worker
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT payload FROM session_blobs WHERE session_id = ?", (session_id,)).fetchone()
+            atual = _split_blobs(row[0]) if row else []
+            conn.execute(
+                "INSERT OR REPLACE INTO session_blobs (session_id, payload, updated_at) VALUES (?, ?, ?)",
+                (session_id, _join_blobs((atual + list(blobs))[-self.max_items:]), time.time())
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._limpar_periodicamente()
+
+    def delete(self, session_id: str):
+        self._conn().execute("DELETE FROM session_blobs WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self) -> int:
+        cur = self._conn().execute("DELETE FROM session_blobs WHERE updated_at < ?",
+                                   (time.time() - self.ttl_seconds,))
+        return cur.rowcount
+
+    def _limpar_periodicamente(self):
+        # Sessoes abandonadas saem do arquivo (no maximo a cada 10 min por worker)
+        if time.time() - self._ultima_limpeza > 600:
+            self._ultima_limpeza = time.time()
+            self.purge_expired()
+
+    def stats(self) -> Dict:
+        row = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM session_blobs").fetchone()
+        return {'sessions': row[0], 'bytes': row[1], 'path': self.path}
+
+
+class _RespClient:
+    """Cliente minimo do protocolo Redis (RESP2): Redis, Valkey, KeyDB, Dragonfly"""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        partes = urlparse(url)
+        self.host = partes.hostname or '127.0.0.1'
+        self.port = partes.port or 6379
+        self.password = partes.password
+        self.db = int((partes.path or '/0').lstrip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _sock(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+            if self.password:
+                self._call(conn, 'AUTH', self.password)
+            if self.db:
+                self._call(conn, 'SELECT', str(self.db))
+        return conn
+
+    def execute(self, *args):
+        try:
+            return self._call(self._sock(), *args)
+        except (OSError, ConnectionError):
+            # Conexao caiu: reconecta uma vez
+            self._local.conn = None
+            return self._call(self._sock(), *args)
+
+    def transaction(self, *commands):
+        """
+        Comandos em MULTI/EXEC enviados de uma vez (uma ida ao servidor)
+
+        Se a conexao cair, reconecta e repete a transacao inteira uma vez: ou
+        todos os comandos valem, ou nenhum.
+
+        Returns:
+            Lista com a resposta de cada comando
+        """
+        try:
+            return self._transacao(self._sock(), commands)
+        except (OSError, ConnectionError):
+            self._local.conn = None
+            return self._transacao(self._sock(), commands)
+
+    def _transacao(self, conn, commands):
+        sock, leitor = conn
+        sock.sendall(b''.join(self._codificar(c) for c in [('MULTI',), *commands, ('EXEC',)]))
+        try:
+            # +OK do MULTI e +QUEUED de cada comando; um erro aqui faz o EXEC abortar
+            erro = None
+            for _ in range(len(commands) + 1):
+                try:
+                    self._ler(leitor)
+                except RuntimeError as e:
+                    erro = erro or e
+            respostas = self._ler(leitor)
+        except RuntimeError:
+            # Resposta lida pela metade: a conexao nao serve para o proximo comando
+            self._local.conn = None
+            raise
+        if erro:
+            raise erro
+        return respostas
+
+    def _call(self, conn, *args):
+        sock, leitor = conn
+        sock.sendall(self._codificar(args))
+        return self._ler(leitor)
+
+    @staticmethod
+    def _codificar(args) -> bytes:
+        partes = [f'*{len(args)}\r\n'.encode()]
+        for a in args:
+            dado = a if isinstance(a, bytes) else str(a).encode('utf-8')
+            partes.append(b'$%d\r\n%s\r\n' % (len(dado), dado))
+        return b''.join(partes)
+
+    def _ler(self, leitor):
+        linha = leitor.readline()
+        if not linha:
+            raise ConnectionError('Conexao com o Redis encerrada')
+        tipo, resto = linha[:1], linha[1:-2]
+        if tipo == b'+':
+            return resto.decode()
+        if tipo == b'-':
+            raise RuntimeError(f'Redis: {resto.decode()}')
+        if tipo == b':':
+            return int(resto)
+        if tipo == b'$':
+            n = int(resto)
+            if n < 0:
+                return None
+            dado = leitor.read(n + 2)
+            return dado[:-2]
+        if tipo == b'*':
+            n = int(resto)
+            return None if n < 0 else [self._ler(leitor) for _ in range(n)]
+        raise ConnectionError(f'Resposta RESP invalida: {linha!r}')
+
+
+class RedisBackend:
+    """Lista por sessao no Redis (RPUSH e atomico entre workers e maquinas)"""
+
+    name = 'redis'
+
+    def __init__(self, url: str = 'redis://127.0.0.1:6379/0', ttl_seconds: int = 24 * 3600,
+                 prefix: str = 'metron:session:', max_items: int = 200):
+        self.client = _RespClient(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.max_items = max(1, max_items)
+
+    def _key(self, session_id: str) -> str:
+        return self.prefix + session_id
+
+    def load(self, session_id: str) -> Optional[List[bytes]]:
+        key = self._key(session_id)
+        itens = self.client.execute('LRANGE', key, 0, -1)
+        if not itens:
+            return None
+        # TTL ocioso: leitura tambem renova a validade
+        self.client.execute('EXPIRE', key, self.ttl_seconds)
+        return itens
+
+    def save(self, session_id: str, blobs: List[bytes]):
+        key = self._key(session_id)
+        if not blobs:
+            self.client.execute('DEL', key)
+            return
+        # Uma transacao: nenhum leitor ve a sessao vazia ou pela metade
+        self.client.transaction(('DEL', key), *self._acrescentar(key, blobs))
+
+    def append(self, session_id: str, blobs: List[bytes]):
+        if not blobs:
+            return
+        self.client.transaction(*self._acrescentar(self._key(session_id), blobs))
+
+    def _acrescentar(self, key: str, blobs: List[bytes]) -> List[tuple]:
+        return [('RPUSH', key, *blobs), ('LTRIM', key, -self.max_items, -1), ('EXPIRE', key, self.ttl_seconds)]
+
+    def delete(self, session_id: str):
+        self.client.execute('DEL', self._key(session_id))
+
+    def stats(self) -> Dict:
+        return {'url': f'redis://{self.client.host}:{self.client.port}/{self.client.db}'}
+
+
+# ============================================================
+# STORE
+# ============================================================
+class SessionStore:
+    """Documentos extraidos por sessao, com cache local de leitura.
+
+    O backend e a fonte da verdade. Cada worker guarda por `local_ttl`
+    segundos o que leu (o chat consulta o mesmo contexto varias vezes por
+    conversa); escritas feitas neste worker invalidam o cache local na hora.
+    get() devolve um LazyDocs: cada documento so e descomprimido quando
+    acessado, e o JSON compacto da sessao (contexto do prompt) sai direto
+    dos blobs.
+    """
+
+    # Campos que nunca vao para o cache da sessao (o PDF fica no JobStore)
+    DROP_KEYS = ('_pdf_base64',)
+
+    def __init__(self, backend, local_ttl: float = 2.0, local_max_sessions: int = 256):
+        """
+        Inicializa o store
+
+        Args:
+            backend: MemoryBackend, SQLiteBackend ou RedisBackend
+            local_ttl: Validade do cache local de leitura (segundos, 0 desliga)
+            local_max_sessions: Sessoes mantidas no cache local
+        """
+        self.backend = backend
+        self.local_ttl = local_ttl
+        self.local_max_sessions = max(1, local_max_sessions)
+        self._lock = threading.Lock()
+        self._local = OrderedDict()  # {session_id: (lido_em, LazyDocs | None)}
+        self._stats = {'local_hits': 0, 'backend_reads': 0, 'backend_errors': 0}
+
+    def get(self, session_id: str, default=None) -> LazyDocs:
+        """Documentos da sessao (LazyDocs somente-leitura) ou default"""
+        if not session_id:
+            return default
+        if self.local_ttl > 0:
+            with self._lock:
+                cached = self._local.get(session_id)
+                if cached and time.time() - cached[0] < self.local_ttl:
+                    self._local.move_to_end(session_id)
+                    self._stats['local_hits'] += 1
+                    return cached[1] if cached[1] is not None else default
+        try:
+            blobs = self.backend.load(session_id)
+        except Exception as e:
+            print(f"[SESSION-STORE] Falha ao ler sessao: {e}")
+            with self._lock:
+                self._stats['backend_errors'] += 1
+            return default
+        with self._lock:
+            self._stats['backend_reads'] += 1
+        docs = LazyDocs(blobs) if blobs is not None else None
+        self._lembrar(session_id, docs)
+        return docs if docs is not None else default
+
+    def set(self, session_id: str, docs: List):
+        """Substitui os documentos da sessao"""
+        self._esquecer(session_id)
+        self.backend.save(session_id, self._compactar(docs or []))
+
+    def extend(self, session_id: str, docs: List):
+        """Acrescenta documentos a sessao (os mais antigos saem acima do limite por sessao)"""
+        if not docs:
+            return
+        self._esquecer(session_id)
+        self.backend.append(session_id, self._compactar(docs))
+
+    def delete(self, session_id: str):
+        if not session_id:
+            return
+        self._esquecer(session_id)
+        self.backend.delete(session_id)
+
+    def __contains__(self, session_id) -> bool:
+        return bool(self.get(session_id))
+
+    def stats(self) -> Dict:
+        try:
+            backend = self.backend.stats()
+        except Exception as e:
+            backend = {'error': str(e)}
+        with self._lock:
+            return {'backend': self.backend.name, 'local_sessions': len(self._local),
+                    **self._stats, **backend}
+
+    def _compactar(self, docs: List) -> List[bytes]:
+        return [pack_doc({k: v for k, v in d.items() if k not in self.DROP_KEYS} if isinstance(d, dict) else d)
+                for d in docs]
+
+    def _lembrar(self, session_id: str, docs):
+        if self.local_ttl <= 0:
+            return
+        with self._lock:
+            self._local[session_id] = (time.time(), docs)
+            self._local.move_to_end(session_id)
+            while len(self._local) > self.local_max_sessions:
+                self._local.popitem(last=False)
+
+    def _esquecer(self, session_id: str):
+        with self._lock:
+            self._local.pop(session_id, None)
+
+
+def create_session_store(kind: str = 'memory', path: str = '', url: str = '',
+                         ttl_seconds: int = 24 * 3600, local_ttl: float = 2.0,
+                         max_items: int = 200, max_bytes: int = 128 * 1024 * 1024) -> SessionStore:
+    """
+    Monta o SessionStore a partir da configuracao
+
+    Args:
+        kind: 'memory', 'sqlite' ou 'redis'
+        path: Arquivo do SQLite
+        url: URL do Redis (redis://[:senha@]host:porta/db)
+        ttl_seconds: Sessoes sem atividade expiram apos este tempo
+        local_ttl: Validade do cache local de leitura
+        max_items: Documentos mantidos por sessao (os mais antigos saem)
+        max_bytes: Orcamento de memoria do backend em memoria
+    """
+    kind = (kind or 'memory').lower()
+    if kind == 'sqlite':
+        backend = SQLiteBackend(path, ttl_seconds=ttl_seconds, max_items=max_items)
+    elif kind == 'redis':
+        backend = RedisBackend(url or 'redis://127.0.0.1:6379/0', ttl_seconds=ttl_seconds, max_items=max_items)
+    else:
+        # Em memoria nao ha outro worker para ler: o cache local so duplicaria os dados
+        backend = MemoryBackend(max_bytes=max_bytes, ttl_seconds=ttl_seconds, max_items=max_items)
+        local_ttl = 0
+    return SessionStore(backend, local_ttl=local_ttl)
@@ -0,0 +1,81 @@
+"""
+Single Flight
+Coalesce chamadas identicas simultaneas: quem chega enquanto a mesma chave
+esta em andamento espera e recebe o mesmo resultado
+"""
+
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Garante no maximo uma execucao em andamento por chave no processo.
+
+    Nao e cache: assim que a execucao termina a chave e liberada, e a proxima
+    chamada executa de novo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # {chave: _Call}
+        self._executions = 0
+        self._coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Executa fn uma unica vez por chave em andamento
+
+        Args:
+            key: Chave de coalescencia (ex: hash do PDF + modo)
+            fn: Funcao sem argumentos que produz o resultado
+
+        Returns:
+            (resultado, compartilhado) - compartilhado=True se o resultado
+            veio da execucao de outra chamada
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executions': self._executions,
+                'coalesced': self._coalesced,
+            }
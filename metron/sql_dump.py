@@ -0,0 +1,93 @@
+"""
+SQL Dump
+Geracao de scripts SQL em fluxo: INSERT de varias linhas em lotes de
+tamanho fixo e arquivos TSV no formato padrao do LOAD DATA (\\N para NULL)
+"""
+
+import json
+import math
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable, Iterator, List, Sequence
+
+
+def chunked_iter(itens: Iterable, size: int) -> Iterator[List]:
+    """Como chunked(), mas para iteradores (nao precisa de len)"""
+    lote = []
+    for item in itens:
+        lote.append(item)
+        if len(lote) >= max(1, int(size)):
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+class SqlExpr(str):
+    """Expressao SQL escrita como esta (NOW(), @base + 3) em vez de virar literal"""
+
+
+def sql_literal(valor) -> str:
+    """Valor Python como literal MySQL (aspas e barras escapadas)"""
+    if valor is None:
+        return 'NULL'
+    if isinstance(valor, SqlExpr):
+        return str(valor)
+    if isinstance(valor, bool):
+        return 'TRUE' if valor else 'FALSE'
+    if isinstance(valor, int):
+        return str(valor)
+    if isinstance(valor, (float, Decimal)):
+        return str(valor) if math.isfinite(valor) else 'NULL'
+    if isinstance(valor, datetime):
+        valor = valor.strftime('%Y-%m-%d %H:%M:%S')
+    elif isinstance(valor, date):
+        valor = valor.strftime('%Y-%m-%d')
+    elif isinstance(valor, (dict, list)):
+        valor = json.dumps(valor, ensure_ascii=False)
+    texto = str(valor).replace('\\', '\\\\').replace("'", "''").replace('\x00', '\\0')
+    return "'" + texto + "'"
+
+
+def insert_statements(table: str, columns: Sequence[str], rows: Iterable[Sequence],
+                      batch_size: int = 500) -> Iterator[str]:
+    """INSERT INTO table (...) VALUES (...),(...); com ate `batch_size` linhas cada"""
+    cabecalho = f"INSERT INTO {table} ({', '.join(columns)}) VALUES\n"
+    for lote in chunked_iter(rows, batch_size):
+        yield cabecalho + ',\n'.join('(' + ', '.join(sql_literal(v) for v in row) + ')' for row in lote) + ';\n'
+
+
+_TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\x00': '\\0'})
+
+
+def tsv_field(valor) -> str:
+    """Campo para LOAD DATA com FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' (o padrao)"""
+    if valor is None or isinstance(valor, (float, Decimal)) and not math.isfinite(valor):
+        return '\\N'
+    if isinstance(valor, bool):
+        return '1' if valor else '0'
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(valor, date):
+        return valor.strftime('%Y-%m-%d')
+    if isinstance(valor, (dict, list)):
+        valor = json.dumps(valor, ensure_ascii=False)
+    return str(valor).translate(_TSV_ESCAPES)
+
+
+def tsv_lines(rows: Iterable[Sequence], batch_size: int = 500) -> Iterator[bytes]:
+    """Linhas TSV (UTF-8) entregues em blocos de `batch_size` linhas"""
+    for lote in chunked_iter(rows, batch_size):
+        yield ''.join('\t'.join(tsv_field(v) for v in row) + '\n' for row in lote).encode('utf-8')
+
+
+def load_data_statement(arquivo: str, table: str, columns: Sequence[str], set_clause: str = '') -> str:
+    """LOAD DATA LOCAL INFILE compativel com tsv_lines (colunas com @ viram variaveis do SET)"""
+    sql = (f"LOAD DATA LOCAL INFILE '{arquivo}' INTO TABLE {table}\n"
+           f"    CHARACTER SET utf8mb4\n"
+           f"    FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'\n"
+           f"    LINES TERMINATED BY '\\n'\n"
+           f"    ({', '.join(columns)})")
+    if set_clause:
+        sql += f"\n    SET {set_clause}"
+    return sql + ';\n'
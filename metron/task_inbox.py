@@ -0,0 +1,186 @@
+"""
+Task Inbox
+Entrega de trabalho ao processo dono de uma tarefa: fila e contexto de
+execucao so existem no worker que abriu a tarefa, entao os outros workers
+deixam mensagens (e arquivos) num diretorio da tarefa que o dono consome
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import threading
+import tempfile
+from typing import Callable, Dict, Optional
+
+
+class TaskInbox:
+    """Caixa de entrada por tarefa, em disco, consumida pelo processo dono.
+
+    - O dono chama register() ao abrir a tarefa e unregister() ao terminar;
+      enquanto isso uma thread renova o arquivo `owner` (batimento) e entrega
+      cada mensagem, na ordem de chegada, para `handler(task_id, mensagem, anexo)`.
+    - send() so aceita a mensagem se o dono estiver vivo (batimento recente):
+      com o dono reiniciado ou encerrado, quem chamou decide o que fazer.
+    - O diretorio precisa ser comum aos workers (mesma maquina ou disco
+      compartilhado) e, para o anexo ser movido sem copia, estar no mesmo
+      sistema de arquivos dos arquivos enviados.
+    """
+
+    _ID = re.compile(r'[0-9A-Za-z-]{1,64}')
+
+    def __init__(self, handler: Callable[[str, Dict, Optional[str]], None], base_dir: Optional[str] = None,
+                 poll_interval: float = 0.5, stale_seconds: float = 30.0):
+        """
+        Inicializa a caixa
+
+        Args:
+            handler: handler(task_id, mensagem, caminho do anexo ou None), chamado no dono
+            base_dir: Diretorio das caixas (padrao: temp/metron_inbox)
+            poll_interval: Intervalo entre leituras das caixas deste processo
+            stale_seconds: Sem batimento ha mais que isso, o dono e dado como morto
+        """
+        self.handler = handler
+        self.base_dir = base_dir or os.path.join(tempfile.gettempdir(), 'metron_inbox')
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._locais = set()
+        self._thread = None
+        self._stats = {'sent': 0, 'refused': 0, 'delivered': 0, 'errors': 0}
+
+    # ------------------------------------------------------------------
+    # Dono
+    # ------------------------------------------------------------------
+    def register(self, task_id: str):
+        """Este processo e o dono da tarefa: passa a consumir a caixa dela"""
+        pasta = self._pasta(task_id)
+        os.makedirs(pasta, exist_ok=True)
+        self._bater(pasta)
+        with self._lock:
+            self._locais.add(task_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='metron-inbox', daemon=True)
+                self._thread.start()
+
+    def unregister(self, task_id: str):
+        """Tarefa encerrada: para de consumir e apaga a caixa (mensagens restantes sao descartadas)"""
+        with self._lock:
+            if task_id not in self._locais:
+                return
+            self._locais.discard(task_id)
+        shutil.rmtree(self._pasta(task_id), ignore_errors=True)
+
+    def is_local(self, task_id: str) -> bool:
+        with self._lock:
+            return task_id in self._locais
+
+    # ------------------------------------------------------------------
+    # Outros workers
+    # ------------------------------------------------------------------
+    def owner_alive(self, task_id: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(os.path.join(self._pasta(task_id), 'owner')) <= self.stale_seconds
+        except (OSError, ValueError):
+            return False
+
+    def send(self, task_id: str, message: Dict, attachment: Optional[str] = None) -> bool:
+        """
+        Deixa uma mensagem para o dono da tarefa
+
+        Args:
+            message: Dados serializaveis em JSON
+            attachment: Arquivo movido para a caixa junto com a mensagem
+
+        Returns:
+            False se o dono nao esta vivo (o anexo continua onde estava)
+        """
+        if not self.owner_alive(task_id):
+            with self._lock:
+                self._stats['refused'] += 1
+            return False
+        pasta = self._pasta(task_id)
+        nome = f"{time.time_ns():020d}_{uuid.uuid4().hex}"
+        dados = dict(message)
+        try:
+            if attachment:
+                anexo = os.path.join(pasta, nome + os.path.splitext(attachment)[1])
+                os.replace(attachment, anexo)
+                dados['_anexo'] = os.path.basename(anexo)
+            temporario = os.path.join(pasta, nome + '.tmp')
+            with open(temporario, 'w', encoding='utf-8') as f:
+                json.dump(dados, f)
+            os.replace(temporario, os.path.join(pasta, nome + '.json'))
+        except OSError:
+            # Caixa apagada no meio (a tarefa terminou): devolve o anexo
+            if attachment and dados.get('_anexo'):
+                try:
+                    os.replace(os.path.join(pasta, dados['_anexo']), attachment)
+                except OSError:
+                    pass
+            with self._lock:
+                self._stats['refused'] += 1
+            return False
+        with self._lock:
+            self._stats['sent'] += 1
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'local_tasks': len(self._locais), **self._stats}
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+    def _pasta(self, task_id: str) -> str:
+        if not self._ID.fullmatch(task_id or ''):
+            raise ValueError(f'task_id invalido: {task_id!r}')
+        return os.path.join(self.base_dir, task_id)
+
+    @staticmethod
+    def _bater(pasta: str):
+        caminho = os.path.join(pasta, 'owner')
+        with open(caminho, 'a'):
+            pass
+        os.utime(caminho, None)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                tarefas = list(self._locais)
+            for task_id in tarefas:
+                try:
+                    self._drenar(task_id)
+                except Exception as e:
+                    print(f"[INBOX] Falha ao ler a caixa da tarefa {task_id[:8]}...: {e}")
+            time.sleep(self.poll_interval)
+
+    def _drenar(self, task_id: str):
+        pasta = self._pasta(task_id)
+        try:
+            self._bater(pasta)
+            nomes = sorted(n for n in os.listdir(pasta) if n.endswith('.json'))
+        except OSError:
+            return
+        for nome in nomes:
+            if not self.is_local(task_id):
+                return
+            caminho = os.path.join(pasta, nome)
+            try:
+                with open(caminho, 'r', encoding='utf-8') as f:
+                    mensagem = json.load(f)
+                os.remove(caminho)
+            except (OSError, ValueError):
+                continue
+            anexo = mensagem.pop('_anexo', None)
+            try:
+                self.handler(task_id, mensagem, os.path.join(pasta, anexo) if anexo else None)
+                with self._lock:
+                    self._stats['delivered'] += 1
+            except Exception as e:
+                print(f"[INBOX] Erro ao processar mensagem da tarefa {task_id[:8]}...: {e}")
+                with self._lock:
+                    self._stats['errors'] += 1
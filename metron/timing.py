@@ -0,0 +1,145 @@
+"""
+Stage Timing
+Tempo de parede e bytes por etapa de cada documento extraido, com resumo
+p50/p95 por tarefa e histograma movel do processo
+"""
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+# Limites superiores (ms) das faixas do histograma
+HISTOGRAM_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+@contextmanager
+def medir_etapa(timings: Optional[Dict], etapa: str, nbytes: int = 0):
+    """
+    Mede o tempo de um bloco e acumula em timings[etapa]
+
+    Uso:
+        with medir_etapa(timings, 'pdf_to_images'):
+            ...
+
+    O dict produzido pode ser complementado com bytes depois:
+    registrar_bytes(timings, etapa, n). Com timings=None nao mede nada.
+    """
+    if timings is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_etapa(timings, etapa, time.perf_counter() - inicio, nbytes)
+
+
+def registrar_etapa(timings: Optional[Dict], etapa: str, segundos: float, nbytes: int = 0):
+    """Acumula uma medicao (varias execucoes da mesma etapa somam)"""
+    if timings is None:
+        return
+    atual = timings.setdefault(etapa, {'ms': 0.0, 'bytes': 0})
+    atual['ms'] = round(atual['ms'] + segundos * 1000.0, 2)
+    atual['bytes'] += int(nbytes or 0)
+
+
+def registrar_bytes(timings: Optional[Dict], etapa: str, nbytes: int):
+    if timings is None:
+        return
+    timings.setdefault(etapa, {'ms': 0.0, 'bytes': 0})['bytes'] += int(nbytes or 0)
+
+
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil por interpolacao linear (valores nao precisam estar ordenados)"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    if len(ordenados) == 1:
+        return round(ordenados[0], 2)
+    pos = (len(ordenados) - 1) * p / 100.0
+    baixo = int(pos)
+    alto = min(baixo + 1, len(ordenados) - 1)
+    return round(ordenados[baixo] + (ordenados[alto] - ordenados[baixo]) * (pos - baixo), 2)
+
+
+def resumir_etapas(documentos: Iterable[Dict]) -> Dict:
+    """
+    Agrega os tempos de varios documentos
+
+    Args:
+        documentos: Dicts {etapa: {'ms', 'bytes'}} (um por documento)
+
+    Returns:
+        {etapa: {'count', 'p50_ms', 'p95_ms', 'total_ms', 'bytes'}}
+    """
+    por_etapa = {}
+    for doc in documentos:
+        for etapa, medida in (doc or {}).items():
+            if not isinstance(medida, dict):
+                continue
+            acc = por_etapa.setdefault(etapa, {'valores': [], 'bytes': 0})
+            acc['valores'].append(medida.get('ms', 0.0))
+            acc['bytes'] += medida.get('bytes', 0)
+    return {
+        etapa: {
+            'count': len(acc['valores']),
+            'p50_ms': percentil(acc['valores'], 50),
+            'p95_ms': percentil(acc['valores'], 95),
+            'total_ms': round(sum(acc['valores']), 2),
+            'bytes': acc['bytes'],
+        }
+        for etapa, acc in por_etapa.items()
+    }
+
+
+class StageHistogram:
+    """Janela movel das ultimas `window` medicoes de cada etapa no processo.
+
+    Serve para o /metrics: percentis recentes e contagem por faixa de tempo,
+    sem crescer com o tempo de vida do processo.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = max(1, window)
+        self._lock = threading.Lock()
+        self._amostras = {}  # {etapa: deque[(ms, bytes)]}
+        self._documentos = 0
+
+    def record(self, timings: Dict):
+        """Registra as etapas de um documento"""
+        with self._lock:
+            self._documentos += 1
+            for etapa, medida in (timings or {}).items():
+                if not isinstance(medida, dict):
+                    continue
+                fila = self._amostras.get(etapa)
+                if fila is None:
+                    fila = self._amostras[etapa] = deque(maxlen=self.window)
+                fila.append((medida.get('ms', 0.0), medida.get('bytes', 0)))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            amostras = {etapa: list(fila) for etapa, fila in self._amostras.items()}
+            documentos = self._documentos
+
+        etapas = {}
+        for etapa, valores in amostras.items():
+            tempos = [ms for ms, _ in valores]
+            faixas = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+            for ms in tempos:
+                i = 0
+                while i < len(HISTOGRAM_BUCKETS_MS) and ms > HISTOGRAM_BUCKETS_MS[i]:
+                    i += 1
+                faixas[i] += 1
+            rotulos = [f'<={b}ms' for b in HISTOGRAM_BUCKETS_MS] + [f'>{HISTOGRAM_BUCKETS_MS[-1]}ms']
+            etapas[etapa] = {
+                'count': len(tempos),
+                'p50_ms': percentil(tempos, 50),
+                'p95_ms': percentil(tempos, 95),
+                'mean_ms': round(sum(tempos) / len(tempos), 2) if tempos else None,
+                'mean_bytes': int(sum(b for _, b in valores) / len(valores)) if valores else 0,
+                'histogram': {r: n for r, n in zip(rotulos, faixas) if n},
+            }
+        return {'window': self.window, 'documents': documentos, 'stages': etapas}
@@ -0,0 +1,187 @@
+"""
+URL Fetch
+Download de PDFs remotos fora da requisicao HTTP: timeouts, tamanho maximo,
+hash calculado durante o download e conexoes reaproveitadas entre downloads
+"""
+
+import os
+import time
+import uuid
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+from urllib.parse import unquote, urlparse
+
+PDF_MAGIC = b'%PDF-'
+
+
+class UrlFetchError(Exception):
+    """Falha ao baixar um PDF (URL invalida, HTTP != 200, limite excedido, etc)"""
+
+
+class UrlFetcher:
+    """Baixa PDFs em um pool proprio de threads.
+
+    Os downloads nao ocupam os workers de extracao (que sao limitados pela
+    quota da IA) nem os workers do servidor web. Uma unica requests.Session
+    com pool de conexoes e compartilhada, entao varios PDFs do mesmo host
+    reaproveitam a conexao TCP/TLS.
+    """
+
+    def __init__(self, workers: int = 4, connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 max_bytes: int = 50 * 1024 * 1024, chunk_size: int = 256 * 1024, verify_tls: bool = True,
+                 total_timeout: float = 120.0):
+        """
+        Inicializa o fetcher
+
+        Args:
+            workers: Downloads simultaneos
+            connect_timeout: Timeout de conexao (segundos)
+            read_timeout: Timeout entre blocos recebidos (segundos)
+            max_bytes: Tamanho maximo aceito por PDF
+            chunk_size: Tamanho do bloco de leitura
+            verify_tls: Valida o certificado TLS do servidor remoto
+            total_timeout: Prazo do download inteiro (segundos); o read_timeout
+                vale por bloco e um servidor que pinga bytes nunca o estoura
+        """
+        self.workers = max(1, workers)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.verify_tls = verify_tls
+        self.total_timeout = total_timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='metron-fetch')
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {'downloads': 0, 'errors': 0, 'bytes': 0, 'in_flight': 0}
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def submit(self, url: str, dest_dir: str, cancel_event: Optional[threading.Event] = None) -> Future:
+        """Agenda o download; o Future resolve com o dict de fetch() ou UrlFetchError"""
+        return self._executor.submit(self.fetch, url, dest_dir, cancel_event)
+
+    def fetch(self, url: str, dest_dir: str, cancel_event: Optional[threading.Event] = None) -> Dict:
+        """
+        Baixa um PDF para dest_dir
+
+        Returns:
+            {'path', 'name', 'sha256', 'size', 'seconds'}
+        """
+        inicio = time.perf_counter()
+        nome = self.filename_for(url)
+        destino = os.path.join(dest_dir, f"{uuid.uuid4().hex}_{nome}")
+        with self._lock:
+            self._stats['in_flight'] += 1
+        try:
+            resultado = self._baixar(url, destino, nome, cancel_event)
+            resultado['seconds'] = time.perf_counter() - inicio
+            with self._lock:
+                self._stats['downloads'] += 1
+                self._stats['bytes'] += resultado['size']
+            return resultado
+        except Exception as e:
+            _remover(destino)
+            with self._lock:
+                self._stats['errors'] += 1
+            if isinstance(e, UrlFetchError):
+                raise
+            raise UrlFetchError(f'Falha no download: {e}') from e
+        finally:
+            with self._lock:
+                self._stats['in_flight'] -= 1
+
+    @staticmethod
+    def filename_for(url: str) -> str:
+        """Nome do arquivo a partir do caminho da URL (padrao documento_web.pdf)"""
+        base = unquote(urlparse(url).path.rstrip('/').split('/')[-1]) or 'documento_web.pdf'
+        base = ''.join(c if (c.isalnum() or c in '._-') else '_' for c in base)[:120]
+        if not base.lower().endswith('.pdf'):
+            base += '.pdf'
+        return base
+
+    @staticmethod
+    def validate_url(url: str) -> bool:
+        partes = urlparse(url or '')
+        return partes.scheme in ('http', 'https') and bool(partes.netloc)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'workers': self.workers, **self._stats}
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+    def _sessao(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                sessao = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+                sessao.mount('http://', adapter)
+                sessao.mount('https://', adapter)
+                self._session = sessao
+            return self._session
+
+    def _baixar(self, url: str, destino: str, nome: str, cancel_event: Optional[threading.Event]) -> Dict:
+        if not self.validate_url(url):
+            raise UrlFetchError('URL invalida (use http ou https)')
+
+        prazo = time.monotonic() + self.total_timeout
+        excedido = f'Download excedeu o tempo total de {self.total_timeout:g} s'
+        with self._sessao().get(url, stream=True, timeout=self.timeout, verify=self.verify_tls) as resp:
+            if resp.status_code != 200:
+                raise UrlFetchError(f'Erro ao acessar URL: {resp.status_code}')
+            declarado = resp.headers.get('Content-Length')
+            if declarado and declarado.isdigit() and int(declarado) > self.max_bytes:
+                raise UrlFetchError(f'Arquivo maior que o limite de {self.max_bytes // (1024 * 1024)} MB')
+
+            # Uma leitura presa esperando o bloco completo nao volta ao laco:
+            # no prazo a resposta e fechada e a leitura falha (no maximo um read_timeout depois)
+            vigia = threading.Timer(max(0.0, prazo - time.monotonic()), resp.close)
+            vigia.daemon = True
+            vigia.start()
+            hasher = hashlib.sha256()
+            lidos = 0
+            try:
+                with open(destino, 'wb') as f:
+                    for bloco in resp.iter_content(self.chunk_size):
+                        if not bloco:
+                            continue
+                        if cancel_event is not None and cancel_event.is_set():
+                            raise UrlFetchError('Download cancelado')
+                        if lidos == 0 and not bloco.startswith(PDF_MAGIC):
+                            raise UrlFetchError('O conteudo da URL nao e um PDF')
+                        lidos += len(bloco)
+                        if lidos > self.max_bytes:
+                            raise UrlFetchError(f'Arquivo maior que o limite de {self.max_bytes // (1024 * 1024)} MB')
+                        if time.monotonic() > prazo:
+                            raise UrlFetchError(excedido)
+                        hasher.update(bloco)
+                        f.write(bloco)
+            except UrlFetchError:
+                raise
+            except Exception as e:
+                if time.monotonic() >= prazo:
+                    raise UrlFetchError(excedido) from e
+                raise
+            finally:
+                vigia.cancel()
+            if time.monotonic() > prazo:
+                # Resposta fechada pelo vigia pode encerrar o laco sem erro, com o conteudo truncado
+                raise UrlFetchError(excedido)
+
+        if lidos == 0:
+            raise UrlFetchError('A URL retornou um arquivo vazio')
+        return {'path': destino, 'name': nome, 'sha256': hasher.hexdigest(), 'size': lidos}
+
+
+def _remover(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
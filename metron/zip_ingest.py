@@ -0,0 +1,110 @@
+"""
+ZIP Ingest
+Le os PDFs de um arquivo ZIP entrada por entrada, sem descompactar o
+arquivo inteiro, com hash e deduplicacao conforme le
+"""
+
+import os
+import uuid
+import hashlib
+import zipfile
+from typing import Dict, Iterator, Optional, Set
+
+PDF_MAGIC = b'%PDF-'
+ZIP_MAGIC = b'PK\x03\x04'
+
+
+def _nome_seguro(entry_name: str) -> str:
+    """Nome plano para a entrada (sem diretorios nem caracteres estranhos)"""
+    base = entry_name.replace('\\', '/').strip('/').replace('/', '_')
+    limpo = ''.join(c if (c.isalnum() or c in '._-') else '_' for c in base)
+    return limpo or 'documento.pdf'
+
+
+def iter_zip_pdfs(source, dest_dir: str, max_entry_bytes: int = 100 * 1024 * 1024,
+                  max_entries: int = 5000, seen_hashes: Optional[Set[str]] = None,
+                  chunk_size: int = 1024 * 1024) -> Iterator[Dict]:
+    """
+    Percorre as entradas de um ZIP e copia cada PDF, em blocos, para um
+    arquivo proprio em dest_dir (memoria limitada a chunk_size por vez)
+
+    Args:
+        source: Caminho ou arquivo (seekable) do ZIP
+        dest_dir: Onde gravar cada PDF lido
+        max_entry_bytes: Tamanho maximo descompactado por entrada
+        max_entries: Limite de entradas percorridas (protecao contra ZIP malicioso)
+        seen_hashes: Hashes ja vistos (deduplicacao entre chamadas)
+        chunk_size: Tamanho do bloco de leitura
+
+    Yields:
+        Um evento por entrada: {'entry', 'name', 'status', ...}
+        status: 'ok' (com 'path', 'sha256', 'size'), 'duplicate', 'skipped' ou 'error'
+    """
+    vistos = seen_hashes if seen_hashes is not None else set()
+
+    with zipfile.ZipFile(source) as zf:
+        for i, info in enumerate(zf.infolist()):
+            if i >= max_entries:
+                yield {'entry': '', 'name': '', 'status': 'error',
+                       'reason': f'Limite de {max_entries} entradas atingido'}
+                return
+
+            nome = _nome_seguro(info.filename)
+            evento = {'entry': info.filename, 'name': nome}
+
+            if info.is_dir() or info.filename.startswith('__MACOSX/') or os.path.basename(info.filename).startswith('._'):
+                continue
+            if not info.filename.lower().endswith('.pdf'):
+                yield {**evento, 'status': 'skipped', 'reason': 'Nao e PDF'}
+                continue
+            if info.flag_bits & 0x1:
+                yield {**evento, 'status': 'skipped', 'reason': 'Entrada criptografada'}
+                continue
+            if info.file_size > max_entry_bytes:
+                yield {**evento, 'status': 'skipped', 'reason': 'Arquivo muito grande'}
+                continue
+
+            destino = os.path.join(dest_dir, f"{uuid.uuid4().hex}_{nome}")
+            hasher = hashlib.sha256()
+            lidos = 0
+            try:
+                with zf.open(info) as origem, open(destino, 'wb') as saida:
+                    primeiro = True
+                    while True:
+                        bloco = origem.read(chunk_size)
+                        if not bloco:
+                            break
+                        if primeiro and not bloco.startswith(PDF_MAGIC):
+                            raise ValueError('Conteudo nao e PDF')
+                        primeiro = False
+                        lidos += len(bloco)
+                        # Nao confia no tamanho declarado no cabecalho do ZIP
+                        if lidos > max_entry_bytes:
+                            raise ValueError('Arquivo muito grande')
+                        hasher.update(bloco)
+                        saida.write(bloco)
+            except Exception as e:
+                _remover(destino)
+                yield {**evento, 'status': 'skipped' if isinstance(e, ValueError) else 'error',
+                       'reason': str(e)}
+                continue
+
+            digest = hasher.hexdigest()
+            if lidos == 0:
+                _remover(destino)
+                yield {**evento, 'status': 'skipped', 'reason': 'Arquivo vazio'}
+                continue
+            if digest in vistos:
+                _remover(destino)
+                yield {**evento, 'status': 'duplicate', 'sha256': digest}
+                continue
+
+            vistos.add(digest)
+            yield {**evento, 'status': 'ok', 'path': destino, 'sha256': digest, 'size': lidos}
+
+
+def _remover(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
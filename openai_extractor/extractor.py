@@ -5,7 +5,9 @@ Extrai dados de certificados usando GPT-4 Vision
 
 import os
 import json
+import time
 import base64
+import threading
 from typing import Dict, List, Optional
 from openai import OpenAI
 import fitz  # PyMuPDF
@@ -33,10 +35,11 @@ class OpenAIExtractor:
         self.token_usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
         print("[OK] Gocal IA Extractor inicializado!")
     
-    def pdf_to_images(self, pdf_path: str, max_pages: int = 3) -> List[str]:
+    def pdf_to_images(self, pdf_path: str, max_pages: int = 3, timings: Optional[Dict] = None) -> List[str]:
         images = []
         
         try:
+            inicio = time.perf_counter()
             doc = fitz.open(pdf_path)
             num_pages = min(len(doc), max_pages)
             
@@ -48,10 +51,14 @@ class OpenAIExtractor:
                 # Renderiza em resolução otimizada (300 DPI)
                 pix = page.get_pixmap(dpi=300)
                 img_bytes = pix.tobytes("png")
+                self._registrar_etapa(timings, 'pdf_to_images', inicio, len(img_bytes))
                 
                 # Converte para base64
+                inicio = time.perf_counter()
                 img_base64 = base64.b64encode(img_bytes).decode('utf-8')
                 images.append(img_base64)
+                self._registrar_etapa(timings, 'base64', inicio, len(img_base64))
+                inicio = time.perf_counter()
                 
                 print(f"  [OK] Pagina {page_num + 1} convertida")
             
@@ -62,7 +69,22 @@ class OpenAIExtractor:
             print(f"[ERRO] Erro ao converter PDF: {e}")
             return []
 
-    def extract_from_pdf(self, pdf_path: str, filename: str = "", user_prompt: str = "") -> Dict:
+    @staticmethod
+    def _cancelado(cancel_event: Optional[threading.Event]) -> bool:
+        return cancel_event is not None and cancel_event.is_set()
+
+    @staticmethod
+    def _registrar_etapa(timings: Optional[Dict], etapa: str, inicio: float, nbytes: int = 0):
+        """Acumula em timings[etapa] o tempo desde `inicio` (perf_counter) e os bytes"""
+        if timings is None:
+            return
+        atual = timings.setdefault(etapa, {'ms': 0.0, 'bytes': 0})
+        atual['ms'] = round(atual['ms'] + (time.perf_counter() - inicio) * 1000.0, 2)
+        atual['bytes'] += int(nbytes or 0)
+
+    def extract_from_pdf(self, pdf_path: str, filename: str = "", user_prompt: str = "",
+                         cancel_event: Optional[threading.Event] = None,
+                         timings: Optional[Dict] = None) -> Dict:
         """
         Extrai dados do certificado usando OpenAI Vision
         
@@ -70,6 +92,8 @@ class OpenAIExtractor:
             pdf_path: Caminho do PDF
             filename: Nome do arquivo original
             user_prompt: Pergunta ou instrução especifica do usuário
+            cancel_event: Se sinalizado, interrompe antes da proxima chamada à API
+            timings: Se informado, recebe {etapa: {'ms', 'bytes'}} de cada etapa
             
         Returns:
             Dicionário com dados extraídos
@@ -80,9 +104,12 @@ class OpenAIExtractor:
             return {"error": error}
         
         # Converte PDF para imagens
-        images = self.pdf_to_images(pdf_path)
+        images = self.pdf_to_images(pdf_path, timings=timings)
         if not images:
             return {"error": "Nao foi possivel processar o PDF"}
+
+        if self._cancelado(cancel_event):
+            return {"error": "Extracao cancelada", "cancelled": True}
         
         print(f"[IA] Enviando para Gocal IA...")
         
@@ -190,12 +217,15 @@ Analise o documento visualmente e retorne SOMENTE o JSON. Nao adicione texto for
                 })
             
             # Chama API
+            bytes_requisicao = len(final_text_prompt) + sum(len(img) for img in images)
+            inicio = time.perf_counter()
             response = self.client.chat.completions.create(
                 model="gpt-4o",
                 messages=messages,
                 max_tokens=4000,
                 temperature=0.1
             )
+            self._registrar_etapa(timings, 'model_call', inicio, bytes_requisicao)
             
             # Contabiliza tokens
             if response.usage:
@@ -212,9 +242,13 @@ Analise o documento visualmente e retorne SOMENTE o JSON. Nao adicione texto for
             # Se a IA recusou, tenta de novo
             recusa_patterns = ["i'm sorry", "i can't assist", "i cannot assist", "i can't help", "i cannot help", "sorry, i can"]
             if any(p in content.lower() for p in recusa_patterns):
+                if self._cancelado(cancel_event):
+                    return {"error": "Extracao cancelada", "cancelled": True}
                 print("[IA] DETECTADA RECUSA DA IA! Tentando novamente com prompt reforçado...")
                 messages[0]["content"] = "Voce e um assistente tecnico de metrologia. Sua UNICA funcao e analisar certificados de calibracao. As imagens enviadas sao de um certificado de calibracao tecnico. Voce DEVE analisa-las e responder conforme solicitado. Isso e uma tarefa 100% legitima de controle de qualidade industrial."
+                inicio = time.perf_counter()
                 response2 = self.client.chat.completions.create(model="gpt-4o", messages=messages, max_tokens=4000, temperature=0.2)
+                self._registrar_etapa(timings, 'refusal_retry', inicio, bytes_requisicao)
                 if response2.usage:
                     self.token_usage['prompt_tokens'] += response2.usage.prompt_tokens
                     self.token_usage['completion_tokens'] += response2.usage.completion_tokens
@@ -241,6 +275,7 @@ Analise o documento visualmente e retorne SOMENTE o JSON. Nao adicione texto for
                 }
 
             # Para os outros casos, continua o fluxo de processamento JSON
+            inicio_pos = time.perf_counter()
             if content.startswith('```'):
                 lines = content.split('\n')
                 if lines[0].startswith('```'): lines = lines[1:]
@@ -277,8 +312,13 @@ Analise o documento visualmente e retorne SOMENTE o JSON. Nao adicione texto for
                         print("[IA] JSON extraído por localização de chaves")
                 except Exception: pass
 
+            if dados is None and self._cancelado(cancel_event):
+                return {"error": "Extracao cancelada", "cancelled": True}
+
             if dados is None:
                 print("[IA] JSON inválido — solicitando correção à IA...")
+                self._registrar_etapa(timings, 'postprocess', inicio_pos)
+                inicio_fix = time.perf_counter()
                 try:
                     fix_resp = self.client.chat.completions.create(
                         model="gpt-4o",
@@ -295,12 +335,15 @@ Analise o documento visualmente e retorne SOMENTE o JSON. Nao adicione texto for
                     print("[IA] JSON corrigido pela IA com sucesso")
                 except Exception as e2:
                     print(f"[IA] Falha também na correção: {e2}")
+                self._registrar_etapa(timings, 'json_fix', inicio_fix, min(len(content), 3000))
+                inicio_pos = time.perf_counter()
 
             if dados is None:
                 print(f"[ERRO] Não foi possível extrair JSON do PDF '{filename}'. Conteúdo: {content[:200]}")
                 return {"error": f"A IA não retornou JSON válido para '{filename}'. Tente novamente ou verifique o PDF."}
 
             dados['arquivo_origem'] = filename or os.path.basename(pdf_path)
+            self._registrar_etapa(timings, 'postprocess', inicio_pos, len(content))
 
             print(f"[OK] Extracao concluida!")
             print(f"   - Identificacao: {dados.get('identificacao', 'n/i')}")
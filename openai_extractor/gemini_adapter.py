@@ -4,6 +4,7 @@ Permite usar o Google Gemini (1.5 Flash) como backend de extracao e chat.
 """
 import os
 import json
+import time
 import fitz  # PyMuPDF
 import google.generativeai as genai
 from .prompts import SYSTEM_PROMPT, EXTRACTION_PROMPT, JSON_SCHEMA_PROMPT, CONVERSATIONAL_PROMPT, GRAPH_EXTRACTION_PROMPT
@@ -31,10 +32,20 @@ class GeminiAdapter:
         self.validator = SecurityValidator()
         print("[OK] Gemini Adapter (Google) inicializado!")
 
-    def pdf_to_parts(self, pdf_path, max_pages=3):
+    @staticmethod
+    def _registrar_etapa(timings, etapa, inicio, nbytes=0):
+        """Acumula em timings[etapa] o tempo desde `inicio` (perf_counter) e os bytes"""
+        if timings is None:
+            return
+        atual = timings.setdefault(etapa, {'ms': 0.0, 'bytes': 0})
+        atual['ms'] = round(atual['ms'] + (time.perf_counter() - inicio) * 1000.0, 2)
+        atual['bytes'] += int(nbytes or 0)
+
+    def pdf_to_parts(self, pdf_path, max_pages=3, timings=None):
         """Converte PDF para partes de imagem aceitas pelo Gemini"""
         parts = []
         try:
+            inicio = time.perf_counter()
             doc = fitz.open(pdf_path)
             num_pages = min(len(doc), max_pages)
             print(f"[GEMINI] Convertendo {num_pages} paginas do PDF...")
@@ -48,17 +59,18 @@ class GeminiAdapter:
                     "data": img_bytes
                 })
             doc.close()
+            self._registrar_etapa(timings, 'pdf_to_images', inicio, sum(len(p['data']) for p in parts))
         except Exception as e:
             print(f"[ERRO] Falha na conversao do PDF: {e}")
         return parts
 
-    def extract_from_pdf(self, pdf_path, filename="", user_prompt=""):
-        """Extracao via Gemini Vision"""
+    def extract_from_pdf(self, pdf_path, filename="", user_prompt="", cancel_event=None, timings=None):
+        """Extracao via Gemini Vision (timings: recebe {etapa: {'ms', 'bytes'}})"""
         # Validacao Basica
         is_valid, error = self.validator.validate_pdf(filename or pdf_path)
         if not is_valid: return {"error": error}
 
-        parts = self.pdf_to_parts(pdf_path)
+        parts = self.pdf_to_parts(pdf_path, timings=timings)
         if not parts: return {"error": "Falha ao ler imagens do PDF"}
 
         # Logica de Prompt
@@ -84,12 +96,19 @@ class GeminiAdapter:
         if is_json_mode:
             config.response_mime_type = "application/json"
 
+        if cancel_event is not None and cancel_event.is_set():
+            return {"error": "Extracao cancelada", "cancelled": True}
+
         print(f"[GEMINI] Enviando para AI (JSON Mode={is_json_mode})...")
         
         try:
             # Chama API
+            inicio = time.perf_counter()
             response = self.model.generate_content([prompt_text] + parts, generation_config=config)
             text_resp = response.text
+            self._registrar_etapa(timings, 'model_call', inicio,
+                                  len(prompt_text) + sum(len(p['data']) for p in parts))
+            inicio = time.perf_counter()
             
             # Processa Resposta
             if is_json_mode:
@@ -115,6 +134,7 @@ class GeminiAdapter:
                      pass
 
             data['arquivo_origem'] = filename
+            self._registrar_etapa(timings, 'postprocess', inicio, len(text_resp))
             print("[OK] Gemini processou com sucesso.")
             return data
 
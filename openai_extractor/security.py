@@ -102,3 +102,17 @@ class SecurityValidator:
             return False, "Nome de arquivo inválido"
         
         return True, ""
+
+    @staticmethod
+    def validate_zip(filename: str) -> Tuple[bool, str]:
+        """Valida se o arquivo é um ZIP (lote de PDFs)"""
+        if not filename:
+            return False, "Nenhum arquivo enviado"
+        
+        if not filename.lower().endswith('.zip'):
+            return False, "Apenas arquivos ZIP são aceitos"
+        
+        if re.search(r'[<>:"|?*\\]', filename):
+            return False, "Nome de arquivo inválido"
+        
+        return True, ""
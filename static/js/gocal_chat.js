@@ -203,6 +203,7 @@ window.analyzeContextPDF = async function () {
             formData.append('pdf_url', contextPdfUrl);
         }
         formData.append('comando', 'analise completa com checklist');
+        formData.append('prioridade', 'interativo');
 
         const response = await fetch('/upload-async', {
             method: 'POST',
@@ -491,6 +492,7 @@ async function retryWithPersistentPdf(message) {
         const formData = new FormData();
         formData.append('pdfs', persistentPdf);
         formData.append('comando', message || 'resumo e analise geral');
+        formData.append('prioridade', 'interativo');
 
         const response = await fetch('/upload-async', {
             method: 'POST',
@@ -689,6 +691,8 @@ async function sendMessage() {
                 formData.append('comando', message);
             }
             // else: sem mensagem -> sem comando -> EXTRACTION_PROMPT
+            formData.append('prioridade', 'interativo');
+            if (currentUserId) formData.append('user_id', currentUserId);
 
             // Envia para endpoint async
             const response = await fetch('/upload-async', {
@@ -814,7 +818,7 @@ function pollProgress(taskId, originalMessage) {
             }
 
             // Verifica conclusão total
-            if (statusData.status === 'completed' || statusData.status === 'error') {
+            if (statusData.status === 'completed' || statusData.status === 'error' || statusData.status === 'cancelled') {
                 clearInterval(interval);
                 removeLastMessage(); // Remove loading spinner
 
@@ -948,6 +952,9 @@ function pollProgress(taskId, originalMessage) {
                     }, 4000);
                     */
 
+                } else if (statusData.file_errors && Object.keys(statusData.file_errors).length > 0) {
+                    // Ex: falha no download do pdf_url (agora feito em background)
+                    addBotMessage('❌ ' + Object.values(statusData.file_errors)[0]);
                 } else {
                     addBotMessage('⚠️ Processamento finalizado. Verifique erros na lista lateral.');
                 }
@@ -43,6 +43,9 @@
     const progressLabel = document.getElementById('progressLabel');
     const progressDetail = document.getElementById('progressDetail');
     const progressFiles = document.getElementById('progressFiles');
+    const progressControls = document.getElementById('progressControls');
+    const btnPausarLote = document.getElementById('btnPausarLote');
+    const btnCancelarLote = document.getElementById('btnCancelarLote');
 
     const resultsStats = document.getElementById('resultsStats');
     const resultsGrid = document.getElementById('resultsGrid');
@@ -117,11 +120,11 @@
     // ============================================
     function addFiles(fileList) {
         const newFiles = Array.from(fileList).filter(f =>
-            f.type === 'application/pdf' || f.name.toLowerCase().endsWith('.pdf')
+            f.type === 'application/pdf' || f.name.toLowerCase().endsWith('.pdf') || isZipFile(f)
         );
 
         if (newFiles.length === 0) {
-            showToast('Apenas arquivos PDF são aceitos.', 'error');
+            showToast('Apenas arquivos PDF ou ZIP são aceitos.', 'error');
             return;
         }
 
@@ -136,6 +139,10 @@
         showToast(`${newFiles.length} arquivo(s) adicionado(s).`, 'success');
     }
 
+    function isZipFile(file) {
+        return file.name.toLowerCase().endsWith('.zip');
+    }
+
     function removeFile(index) {
         selectedFiles.splice(index, 1);
         renderFilesList();
@@ -154,7 +161,7 @@
 
         filesList.innerHTML = selectedFiles.map((file, idx) => `
             <div class="file-item" style="animation-delay: ${idx * 0.05}s">
-                <span class="file-item-icon">📄</span>
+                <span class="file-item-icon">${isZipFile(file) ? '🗜️' : '📄'}</span>
                 <div class="file-item-info">
                     <div class="file-item-name">${file.name}</div>
                     <div class="file-item-size">${formatFileSize(file.size)}</div>
@@ -182,12 +189,23 @@
         btnProcessar.disabled = true;
         btnProcessar.innerHTML = '<span class="mini-spinner"></span> Enviando...';
 
+        // Lotes grandes (acima do limite de um POST) vão em partes, com retomada.
+        // ZIPs também: o servidor lê as entradas assim que o arquivo termina de subir.
+        const totalBytes = selectedFiles.reduce((acc, f) => acc + f.size, 0);
+        if (totalBytes > CHUNKED_THRESHOLD_BYTES || selectedFiles.some(isZipFile)) {
+            await startChunkedProcessing();
+            return;
+        }
+
         // Monta FormData
         const formData = new FormData();
         selectedFiles.forEach(file => {
             formData.append('pdfs', file);
         });
         formData.append('comando', 'extrair dados estruturados em json para banco de dados');
+        formData.append('prioridade', 'lote');
+        const loteUserId = document.getElementById('userId')?.value;
+        if (loteUserId) formData.append('user_id', loteUserId);
 
         try {
             const response = await fetch('/upload-async', {
@@ -219,12 +237,126 @@
         }
     }
 
+    // ============================================
+    // UPLOAD EM PARTES (lotes > 40MB)
+    // ============================================
+    const CHUNKED_THRESHOLD_BYTES = 40 * 1024 * 1024;
+    const CHUNK_MAX_RETRIES = 5;
+
+    async function startChunkedProcessing() {
+        const loteUserId = document.getElementById('userId')?.value;
+        try {
+            const initRes = await fetch('/upload-chunked/init', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    files: selectedFiles.map(f => ({ name: f.name, size: f.size })),
+                    comando: 'extrair dados estruturados em json para banco de dados',
+                    prioridade: 'lote',
+                    user_id: loteUserId || ''
+                })
+            });
+            const upload = await initRes.json();
+            if (!upload.success) {
+                showToast('Erro ao iniciar: ' + (upload.message || 'Desconhecido'), 'error');
+                resetProcessButton();
+                return;
+            }
+
+            // A tarefa já existe: o progresso aparece enquanto os arquivos sobem
+            currentTaskId = upload.task_id;
+            showProgressSection();
+            startPolling(upload.task_id);
+            showToast('Enviando arquivos em partes...', 'info');
+
+            for (let i = 0; i < selectedFiles.length; i++) {
+                const ok = await uploadFileInChunks(upload.upload_id, upload.files[i], selectedFiles[i], upload.chunk_size);
+                if (!ok) showToast(`Falha ao enviar ${selectedFiles[i].name}`, 'error');
+            }
+
+            await fetch(`/upload-chunked/${upload.upload_id}/finalize`, { method: 'POST' });
+            resetProcessButton();
+        } catch (err) {
+            console.error('Erro no upload em partes:', err);
+            showToast('Erro de conexão com o servidor.', 'error');
+            resetProcessButton();
+        }
+    }
+
+    async function uploadFileInChunks(uploadId, fileInfo, file, chunkSize) {
+        let offset = fileInfo.received || 0;
+        let retries = 0;
+        while (offset < file.size) {
+            const chunk = file.slice(offset, Math.min(offset + chunkSize, file.size));
+            try {
+                const res = await fetch(`/upload-chunked/${uploadId}/${fileInfo.file_id}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: chunk
+                });
+                const data = await res.json();
+                if (data.success) {
+                    offset = data.received;
+                    retries = 0;
+                    continue;
+                }
+                // Servidor indica de onde continuar (offset fora de ordem / hash divergente)
+                if (typeof data.expected_offset === 'number') {
+                    offset = data.expected_offset;
+                } else if (res.status !== 409) {
+                    return false;
+                }
+            } catch (err) {
+                console.warn('Parte falhou, tentando de novo:', err);
+            }
+            if (++retries > CHUNK_MAX_RETRIES) return false;
+            await new Promise(r => setTimeout(r, 1000 * retries));
+        }
+        return true;
+    }
+
     function resetProcessButton() {
         btnProcessar.disabled = false;
         btnProcessar.innerHTML = '<span class="btn-icon">🚀</span> Iniciar Processamento';
     }
 
+    // ============================================
+    // CONTROLE DA TAREFA (pausar / retomar / cancelar)
+    // ============================================
+    let loteIsPaused = false;
+
+    btnPausarLote.addEventListener('click', async () => {
+        if (!currentTaskId) return;
+        const acao = loteIsPaused ? 'resume' : 'pause';
+        try {
+            const res = await fetch(`/upload-${acao}/${encodeURIComponent(currentTaskId)}`, { method: 'POST' });
+            const data = await res.json();
+            if (data.success) {
+                loteIsPaused = !loteIsPaused;
+                btnPausarLote.textContent = loteIsPaused ? '▶️ Retomar' : '⏸️ Pausar';
+            }
+            showToast(data.message || 'Erro', data.success ? 'info' : 'error');
+        } catch (err) {
+            showToast('Erro de conexão com o servidor.', 'error');
+        }
+    });
+
+    btnCancelarLote.addEventListener('click', async () => {
+        if (!currentTaskId) return;
+        if (!confirm('Cancelar o processamento? Os documentos já analisados serão mantidos.')) return;
+        try {
+            const res = await fetch(`/upload-cancel/${encodeURIComponent(currentTaskId)}`, { method: 'POST' });
+            const data = await res.json();
+            showToast(data.message || 'Erro', data.success ? 'info' : 'error');
+        } catch (err) {
+            showToast('Erro de conexão com o servidor.', 'error');
+        }
+    });
+
     function showProgressSection() {
+        progressControls.style.display = 'flex';
+        loteIsPaused = false;
+        btnPausarLote.textContent = '⏸️ Pausar';
         progressSection.style.display = 'block';
         progressSection.scrollIntoView({ behavior: 'smooth', block: 'start' });
 
@@ -241,17 +373,30 @@
     // ============================================
     // POLLING
     // ============================================
+    // Consultas seguidas sem achar a tarefa antes de desistir (~15 s): o estado
+    // publicado para os outros workers pode chegar com um pequeno atraso
+    const MAX_NOT_FOUND_POLLS = 12;
+
     function startPolling(taskId) {
+        let notFoundPolls = 0;
         pollInterval = setInterval(async () => {
             try {
                 const res = await fetch(`/upload-status/${taskId}`);
                 const status = await res.json();
 
+                if (status.status === 'not_found') {
+                    notFoundPolls += 1;
+                    if (notFoundPolls < MAX_NOT_FOUND_POLLS) return;
+                } else {
+                    notFoundPolls = 0;
+                }
+
                 updateProgress(status);
 
-                if (status.status === 'completed' || status.status === 'error') {
+                if (status.status === 'completed' || status.status === 'error' || status.status === 'cancelled' || status.status === 'not_found') {
                     clearInterval(pollInterval);
                     pollInterval = null;
+                    progressControls.style.display = 'none';
 
                     if (status.results && status.results.length > 0) {
                         extractedResults = status.results.map(normalizeLoteResult);
@@ -280,6 +425,18 @@
             progressDetail.innerHTML = '<span class="mini-spinner"></span> A IA está analisando os documentos... Não feche esta página.';
         } else if (status.status === 'completed') {
             progressDetail.textContent = '✅ Processamento concluído!';
+        } else if (status.status === 'paused') {
+            progressDetail.textContent = '⏸️ Processamento pausado. Os documentos pendentes aguardam a retomada.';
+        } else if (status.status === 'cancelling' || status.status === 'cancelled') {
+            progressDetail.textContent = '✖ Processamento cancelado. Os documentos já analisados foram mantidos.';
+        } else if (zipEmLeitura(status)) {
+            const z = zipEmLeitura(status);
+            progressDetail.innerHTML = `<span class="mini-spinner"></span> Lendo ZIP: ${z.entries} entrada(s), ` +
+                `${z.pdfs} PDF(s) na fila, ${z.duplicates} duplicado(s), ${z.skipped} ignorado(s)`;
+        } else if (status.status === 'queued' && status.queue_position) {
+            const eta = status.estimated_start_seconds || 0;
+            progressDetail.innerHTML = `<span class="mini-spinner"></span> Na fila: posição ${status.queue_position}` +
+                (eta > 0 ? ` (início estimado em ~${Math.ceil(eta / 60)} min)` : '');
         } else {
             progressDetail.innerHTML = '<span class="mini-spinner"></span> Iniciando processamento...';
         }
@@ -289,8 +446,8 @@
             // Python dict preserva ordem de insercao (3.7+), mesma ordem do upload
             const entries = Object.entries(status.files);
             entries.forEach(([serverFilename, fileStatus], idx) => {
-                const el = document.getElementById('pf-' + idx);
-                if (!el) return;
+                // PDFs lidos de um ZIP aparecem só no servidor: cria a linha na hora
+                const el = document.getElementById('pf-' + idx) || criarLinhaProgresso(idx, serverFilename);
 
                 // Remove classes anteriores
                 el.classList.remove('processing', 'done', 'error');
@@ -298,7 +455,16 @@
                 const statusEl = el.querySelector('.progress-file-status');
                 const iconEl = el.querySelector('.progress-file-icon');
 
-                if (fileStatus === 'processing') {
+                if (fileStatus === 'processing' || fileStatus === 'unpacking') {
+                    el.classList.add('processing');
+                    statusEl.className = 'progress-file-status processing';
+                    statusEl.textContent = fileStatus === 'unpacking' ? 'Lendo ZIP...' : 'Processando...';
+                    iconEl.innerHTML = '<span class="mini-spinner"></span>';
+                } else if (fileStatus === 'duplicate' || fileStatus === 'skipped') {
+                    statusEl.className = 'progress-file-status pending';
+                    statusEl.textContent = fileStatus === 'duplicate' ? 'Duplicado' : 'Ignorado';
+                    iconEl.textContent = '⏭️';
+                } else if (fileStatus === 'processing') {
                     el.classList.add('processing');
                     statusEl.className = 'progress-file-status processing';
                     statusEl.textContent = 'Processando...';
@@ -313,6 +479,11 @@
                     statusEl.className = 'progress-file-status error';
                     statusEl.textContent = 'Erro';
                     iconEl.textContent = '❌';
+                } else if (fileStatus === 'cancelled') {
+                    el.classList.add('error');
+                    statusEl.className = 'progress-file-status error';
+                    statusEl.textContent = 'Cancelado';
+                    iconEl.textContent = '✖';
                 } else {
                     // pending - manter animação
                     statusEl.className = 'progress-file-status pending';
@@ -323,6 +494,30 @@
         }
     }
 
+    function zipEmLeitura(status) {
+        const zips = Object.values(status.zip_progress || {}).filter(z => !z.done);
+        if (zips.length === 0) return null;
+        return zips.reduce((acc, z) => ({
+            entries: acc.entries + z.entries,
+            pdfs: acc.pdfs + z.pdfs,
+            duplicates: acc.duplicates + z.duplicates,
+            skipped: acc.skipped + z.skipped
+        }), { entries: 0, pdfs: 0, duplicates: 0, skipped: 0 });
+    }
+
+    function criarLinhaProgresso(idx, nome) {
+        const el = document.createElement('div');
+        el.className = 'progress-file';
+        el.id = 'pf-' + idx;
+        el.innerHTML = `
+            <span class="progress-file-icon"><span class="pending-dot"></span></span>
+            <span class="progress-file-name"></span>
+            <span class="progress-file-status pending">Na fila</span>`;
+        el.querySelector('.progress-file-name').textContent = nome;
+        progressFiles.appendChild(el);
+        return el;
+    }
+
     // ============================================
     // RESULTADOS
     // ============================================